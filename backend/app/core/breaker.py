@@ -0,0 +1,179 @@
+# Per-provider/model circuit breakers
+
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Environment variables
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "60"))  # seconds of outcomes considered
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "4"))  # calls in the window before the ratio counts
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "4.0"))  # a first token slower than this counts as a failure; 0 disables
+# CPU-only Ollama routinely takes longer than that for a first token, and it is the last fallback
+BREAKER_SLOW_SECONDS_OLLAMA = float(os.getenv("BREAKER_SLOW_SECONDS_OLLAMA", "0"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_QUOTA_OPEN_SECONDS = float(os.getenv("BREAKER_QUOTA_OPEN_SECONDS", "300"))  # after an HTTP 429
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "600"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Numeric encoding used for monitoring gauges
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Slow-first-token threshold per provider; others use BREAKER_SLOW_SECONDS
+SLOW_SECONDS = {"ollama": BREAKER_SLOW_SECONDS_OLLAMA}
+
+
+class Permit:
+    """Returned by `allow_request` and handed back with the call's outcome.
+
+    Each half-open probe gets its own permit, so only the call that owns
+    the probe can close or reopen the breaker or give the probe up.
+    """
+
+    __slots__ = ("probe",)
+
+    def __init__(self, probe: bool):
+        self.probe = probe
+
+
+# Shared by all calls let through while the breaker is closed
+CALL = Permit(probe=False)
+
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker for one provider/model.
+
+    Closed: calls flow and outcomes (error, timeout, quota, and a first
+    token slower than the provider's `slow_seconds` unless that is 0) are kept for `BREAKER_WINDOW` seconds; once there are enough calls and
+    the failure ratio crosses `BREAKER_FAILURE_RATIO` the breaker opens. A
+    429 opens it straight away for the longer quota cooldown.
+
+    Open: calls are refused without touching the network until the cooldown
+    ends. Half-open: exactly one probe call is let through; success closes
+    the breaker, failure reopens it with a doubled cooldown. Outcomes of
+    calls let through before the breaker opened do not decide anything
+    after that; only the probe's permit does.
+    """
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+        self.slow_seconds = SLOW_SECONDS.get(provider, BREAKER_SLOW_SECONDS)
+        self.state = CLOSED
+        self.outcomes: deque = deque()  # (timestamp, failed, kind)
+        self.open_until = 0.0
+        self.cooldown = BREAKER_OPEN_SECONDS
+        self._probe: Optional[Permit] = None
+        self.last_latency = 0.0
+        self.times_opened = 0
+
+    def is_available(self) -> bool:
+        """Cheap check for routing: would `allow_request` let a call through right now?"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() >= self.open_until
+        return self._probe is None
+
+    def allow_request(self) -> Optional[Permit]:
+        """Claim permission for one call, or None if refused. In half-open state only the first caller gets through."""
+        if self.state == CLOSED:
+            return CALL
+        if self.state == OPEN:
+            if time.monotonic() < self.open_until:
+                return None
+            self.state = HALF_OPEN
+            self._probe = None
+        if self._probe is not None:
+            return None
+        self._probe = Permit(probe=True)
+        return self._probe
+
+    def _owns_probe(self, permit: Permit) -> bool:
+        return permit.probe and permit is self._probe
+
+    def record_success(self, latency: float, permit: Permit = CALL) -> None:
+        self.last_latency = latency
+        if self._owns_probe(permit):
+            self._close()
+            return
+        if self.slow_seconds and latency > self.slow_seconds:
+            self._record(True, "slow")
+        else:
+            self._record(False, "ok")
+
+    def record_failure(self, kind: str = "error", permit: Permit = CALL) -> None:
+        """Record a failed call. `kind` is "error", "timeout", "slow" or "quota"."""
+        if self._owns_probe(permit):
+            self._open(min(self.cooldown * 2, BREAKER_MAX_OPEN_SECONDS))
+            return
+        if kind == "quota" and self.state == CLOSED:
+            self._open(BREAKER_QUOTA_OPEN_SECONDS)
+            return
+        self._record(True, kind)
+
+    def release(self, permit: Permit = CALL) -> None:
+        """The call was abandoned (e.g. client went away) before an outcome was known."""
+        if self._owns_probe(permit):
+            self._probe = None
+
+    def _record(self, failed: bool, kind: str) -> None:
+        now = time.monotonic()
+        self.outcomes.append((now, failed, kind))
+        self._prune(now)
+        if self.state != CLOSED or len(self.outcomes) < BREAKER_MIN_CALLS:
+            return
+        failures = sum(1 for _, f, _ in self.outcomes if f)
+        if failures / len(self.outcomes) >= BREAKER_FAILURE_RATIO:
+            self._open(BREAKER_OPEN_SECONDS)
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - BREAKER_WINDOW
+        while self.outcomes and self.outcomes[0][0] < cutoff:
+            self.outcomes.popleft()
+
+    def _open(self, cooldown: float) -> None:
+        self.state = OPEN
+        self.cooldown = cooldown
+        self.open_until = time.monotonic() + cooldown
+        self._probe = None
+        self.times_opened += 1
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self.cooldown = BREAKER_OPEN_SECONDS
+        self._probe = None
+        self.outcomes.clear()
+
+    def snapshot(self) -> Dict:
+        self._prune(time.monotonic())
+        counts: Dict[str, int] = {}
+        for _, _, kind in self.outcomes:
+            counts[kind] = counts.get(kind, 0) + 1
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "state": self.state,
+            "open_for_s": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == OPEN else 0.0,
+            "window_outcomes": counts,
+            "last_latency_s": round(self.last_latency, 3),
+            "times_opened": self.times_opened,
+        }
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+
+def get_breaker(provider: str, model: str) -> CircuitBreaker:
+    breaker = _breakers.get((provider, model))
+    if breaker is None:
+        breaker = _breakers[(provider, model)] = CircuitBreaker(provider, model)
+    return breaker
+
+
+def breaker_states() -> List[Dict]:
+    return [breaker.snapshot() for breaker in _breakers.values()]
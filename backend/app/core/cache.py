@@ -0,0 +1,140 @@
+# Exact-match response cache for stateless first-turn questions
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, AsyncGenerator, Dict, Optional
+from app.core.llm import is_failure_reply
+from app.core.prompt import get_system_prompt
+
+# Environment variables
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "21600"))  # seconds
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_REPLAY_CPS = float(os.getenv("RESPONSE_CACHE_REPLAY_CPS", "800"))  # characters/second on /chat/stream, 0 = all at once
+RESPONSE_CACHE_REPLAY_CHUNK = int(os.getenv("RESPONSE_CACHE_REPLAY_CHUNK", "32"))  # characters per token event
+
+# Modes whose answers depend on more than the question (hospital_search is location-driven)
+UNCACHEABLE_MODES = {"hospital_search", "doctor_summary"}
+
+_ENTRY_OVERHEAD_BYTES = 400
+_TRAILING_PUNCT_RE = re.compile(r"[\s?!.]+$")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """Case, whitespace and trailing punctuation do not change the question."""
+    return _TRAILING_PUNCT_RE.sub("", _SPACE_RE.sub(" ", message.strip().lower()))
+
+
+@lru_cache(maxsize=16)
+def prompt_version(mode: str) -> str:
+    """Short hash of the system prompt for `mode`, so prompt edits invalidate cached answers."""
+    return hashlib.sha1(get_system_prompt(mode).encode("utf-8")).hexdigest()[:12]
+
+
+def cache_key(message: str, mode: str) -> str:
+    return f"{mode}:{prompt_version(mode)}:{normalize_message(message)}"
+
+
+def is_cacheable_request(history: list, mode: str, image: Optional[str]) -> bool:
+    """Only first turns without an image are stateless enough to share answers."""
+    return RESPONSE_CACHE_ENABLED and not history and not image and mode not in UNCACHEABLE_MODES
+
+
+class _Cached:
+    __slots__ = ("response", "expires_at", "nbytes")
+
+    def __init__(self, response: Dict[str, Any], expires_at: float):
+        self.response = response
+        self.expires_at = expires_at
+        self.nbytes = _ENTRY_OVERHEAD_BYTES + len(json.dumps(response, ensure_ascii=False))
+
+
+class ResponseCache:
+    """LRU + TTL cache of parsed responses, capped by an estimate of bytes held.
+
+    Values are the fields of a ChatResponse ("stage", "urgency", "message",
+    "confidence", "data"). Expired entries are dropped when looked up;
+    the byte cap evicts from the least recently used end.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Cached]" = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.response
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        entry = _Cached(response, time.monotonic() + self.ttl)
+        if entry.nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.resident_bytes += entry.nbytes
+        while self.resident_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        self.resident_bytes -= self._entries.pop(key).nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def is_cacheable_response(response: Dict[str, Any]) -> bool:
+    """Never cache emergencies (they need the live fast path), malformed answers or apology/error text."""
+    message = response.get("message") or ""
+    return (
+        response.get("stage") != "emergency"
+        and response.get("urgency") in ("Low", "Moderate", "High")
+        and len(message) > 20
+        and not is_failure_reply(message)
+    )
+
+
+async def replay_text(text: str) -> AsyncGenerator[str, None]:
+    """Yield cached text in word-aligned chunks, paced at RESPONSE_CACHE_REPLAY_CPS."""
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + RESPONSE_CACHE_REPLAY_CHUNK)
+        if end < len(text):
+            space = text.find(" ", end)
+            end = len(text) if space == -1 else space + 1
+        yield text[start:end]
+        if RESPONSE_CACHE_REPLAY_CPS > 0 and end < len(text):
+            await asyncio.sleep((end - start) / RESPONSE_CACHE_REPLAY_CPS)
+        start = end
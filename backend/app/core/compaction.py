@@ -0,0 +1,121 @@
+# Background conversation compaction: fold old turns into a rolling digest
+
+import os
+import json
+import logging
+from typing import Dict, List, Optional
+from app.core.llm import get_llm_response, is_failure_reply
+from app.core.scheduler import PRIORITY_BACKGROUND
+from app.core.state import get_session_state, save_session_state
+from app.core.tasks import SessionTasks
+from app.core.timeline import detach_timeline
+
+logger = logging.getLogger("MedGPT.compaction")
+
+# Environment variables
+COMPACT_AFTER_TURNS = int(os.getenv("COMPACT_AFTER_TURNS", "10"))  # user turns before compaction kicks in, 0 disables
+COMPACT_KEEP_TURNS = int(os.getenv("COMPACT_KEEP_TURNS", "4"))  # most recent turns left verbatim
+
+DIGEST_PREFIX = "[Conversation digest] Summary of our earlier conversation:"
+DIGEST_ACK = "Understood. I will keep these details from earlier in our conversation in mind."
+
+COMPACTION_REQUEST = (
+    "Summarize our conversation so far for the treating doctor. Keep every clinically relevant detail: "
+    "symptoms, onset and duration, severity, triggers, relevant history, medications mentioned, red flags "
+    "and advice already given. Be concise, use short bullet points, and do not add new advice."
+)
+
+_running = SessionTasks("Compaction", logger)
+
+
+def is_digest(msg: Dict[str, str]) -> bool:
+    return msg.get("content", "").startswith(DIGEST_PREFIX)
+
+
+def count_user_turns(history: List[Dict[str, str]]) -> int:
+    return sum(1 for msg in history if msg["role"] == "user" and not is_digest(msg))
+
+
+def _split_point(history: List[Dict[str, str]]) -> int:
+    """Index where the verbatim tail starts: the user message opening the last COMPACT_KEEP_TURNS turns."""
+    seen = 0
+    for i in range(len(history) - 1, -1, -1):
+        if history[i]["role"] == "user" and not is_digest(history[i]):
+            seen += 1
+            if seen == COMPACT_KEEP_TURNS:
+                return i
+    return 0
+
+
+def _digest_text(raw_response: str) -> Optional[str]:
+    try:
+        parsed = json.loads(raw_response)
+    except json.JSONDecodeError:
+        return None
+    text = parsed.get("message") or parsed.get("response") or ""
+    summary = parsed.get("summary")
+    if isinstance(summary, dict):
+        lines = [text] if text else []
+        for section, content in summary.items():
+            if isinstance(content, dict):
+                content = "; ".join(f"{key}: {value}" for key, value in content.items())
+            lines.append(f"- {section}: {content}")
+        text = "\n".join(lines)
+    text = text.strip()
+    # The orchestrator turns provider failures into apology text; never store that as a digest
+    if not text or is_failure_reply(text):
+        return None
+    return text
+
+
+async def compact_session(session_id: str) -> bool:
+    """Replace the oldest turns of a session with a model-written digest.
+
+    The summary is generated from a snapshot of the old turns. Before writing
+    back we check that the session still starts with that exact prefix, so
+    turns appended meanwhile are kept and a session that was reset is left
+    alone. Returns True if the history was compacted.
+    """
+    detach_timeline()
+    history = get_session_state(session_id)
+    cut = _split_point(history)
+    if cut <= 2:
+        return False
+    old_turns = list(history[:cut])
+
+    raw_response = await get_llm_response(old_turns, COMPACTION_REQUEST, mode="doctor_summary", priority=PRIORITY_BACKGROUND)
+    digest = _digest_text(raw_response)
+    if digest is None:
+        logger.warning(f"Compaction for session {session_id} produced no usable digest")
+        return False
+
+    current = get_session_state(session_id)
+    if current[:cut] != old_turns:
+        logger.info(f"Session {session_id} changed during compaction, discarding digest")
+        return False
+
+    compacted = [
+        {"role": "user", "content": f"{DIGEST_PREFIX}\n{digest}", "pinned": True},
+        {"role": "assistant", "content": DIGEST_ACK, "pinned": True},
+    ] + current[cut:]
+    save_session_state(session_id, compacted)
+    logger.info(json.dumps({
+        "event": "session_compacted",
+        "session_id": session_id,
+        "messages_before": len(current),
+        "messages_after": len(compacted),
+        "digest_chars": len(digest),
+    }))
+    return True
+
+
+def schedule_compaction(session_id: str, history: List[Dict[str, str]]) -> None:
+    """Start a background compaction once a session has grown past COMPACT_AFTER_TURNS user turns.
+
+    Called after each turn is saved; cheap when there is nothing to do.
+    """
+    if COMPACT_AFTER_TURNS <= 0 or session_id in _running:
+        return
+    if count_user_turns(history) <= COMPACT_AFTER_TURNS:
+        return
+    _running.start(session_id, compact_session(session_id))
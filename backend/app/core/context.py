@@ -0,0 +1,97 @@
+# Context assembly: fit conversation history into a per-provider token budget
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List
+
+# Environment variables
+CONTEXT_BUDGET_GEMINI = int(os.getenv("CONTEXT_BUDGET_GEMINI", "6000"))
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+OLLAMA_OUTPUT_RESERVE = int(os.getenv("OLLAMA_OUTPUT_RESERVE", "1024"))
+
+# Ollama's num_ctx covers prompt *and* generated tokens, so leave room for the answer
+PROVIDER_BUDGETS = {
+    "gemini": CONTEXT_BUDGET_GEMINI,
+    "ollama": OLLAMA_NUM_CTX - OLLAMA_OUTPUT_RESERVE,
+}
+
+# Assistant turns carrying this marker keep the emergency context alive and are never trimmed
+EMERGENCY_MARKER = "STAGE: emergency"
+
+# Role/formatting tokens every chat template adds around a message
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """Tokenizer-free token estimate.
+
+    BPE vocabularies average roughly four characters per token on English
+    prose, but short words and punctuation each cost a token of their own, so
+    take whichever of the two counts is larger.
+    """
+    if not text:
+        return 0
+    by_chars = (len(text) + 3) // 4
+    by_words = int(len(text.split()) * 1.3)
+    return max(by_chars, by_words)
+
+
+def message_tokens(msg: Dict[str, str]) -> int:
+    return estimate_tokens(msg.get("content", "")) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def is_pinned(msg: Dict[str, str]) -> bool:
+    return bool(msg.get("pinned")) or EMERGENCY_MARKER in msg.get("content", "")
+
+
+@dataclass
+class ContextWindow:
+    messages: List[Dict[str, str]]
+    prompt_tokens: int  # system prompt + kept messages
+    trimmed_tokens: int
+    trimmed_messages: int
+
+
+def assemble_context(messages: List[Dict[str, str]], system_prompt: str, budget: int) -> ContextWindow:
+    """Keep the system prompt, pinned turns and as many recent turns as fit in `budget`.
+
+    The last message (the new user turn) is always kept. Older turns are
+    taken newest-first and the window stops at the first one that does not
+    fit, so the model never sees a gap in the recent conversation. An
+    assistant reply whose user turn was cut is dropped as well.
+    """
+    if not messages:
+        return ContextWindow([], estimate_tokens(system_prompt), 0, 0)
+
+    costs = [message_tokens(msg) for msg in messages]
+    total = sum(costs)
+    used = estimate_tokens(system_prompt) + costs[-1]
+    pinned = [i for i in range(len(messages) - 1) if is_pinned(messages[i])]
+    used += sum(costs[i] for i in pinned)
+
+    keep = set(pinned)
+    keep.add(len(messages) - 1)
+    start = len(messages) - 1
+    for i in range(len(messages) - 2, -1, -1):
+        if i in keep:
+            continue
+        if used + costs[i] > budget:
+            break
+        used += costs[i]
+        start = i
+        keep.add(i)
+    # Don't open the recent window on an assistant reply to a question we dropped
+    if start < len(messages) - 1 and messages[start]["role"] == "assistant" and not is_pinned(messages[start]):
+        keep.discard(start)
+        used -= costs[start]
+
+    kept = [messages[i] for i in sorted(keep)]
+    kept_tokens = sum(costs[i] for i in keep)
+    return ContextWindow(
+        messages=kept,
+        prompt_tokens=used,
+        trimmed_tokens=total - kept_tokens,
+        trimmed_messages=len(messages) - len(kept),
+    )
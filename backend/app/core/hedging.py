@@ -0,0 +1,156 @@
+# Hedged provider requests: race a backup stream against a slow primary
+
+import os
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, Callable, Dict, Optional, Set
+from app.core.metrics import FALLBACKS
+
+# Environment variables
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "1.5"))  # seconds, until enough TTFT samples exist
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.3"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "4.0"))
+
+_MIN_SAMPLES = 20
+
+
+class TTFTTracker:
+    """Rolling window of time-to-first-token samples for one provider."""
+
+    def __init__(self, size: int = 256):
+        self.samples = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < _MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float:
+        """How long to wait for the primary's first token before starting the backup."""
+        p = self.percentile(HEDGE_PERCENTILE)
+        if p is None:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, p))
+
+
+class HedgeStats:
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.wins: Dict[str, int] = {}
+
+    def record(self, hedged: bool, winner: Optional[str]) -> None:
+        self.requests += 1
+        if hedged:
+            self.hedged += 1
+        if winner:
+            self.wins[winner] = self.wins.get(winner, 0) + 1
+
+    def snapshot(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "wins": dict(self.wins),
+        }
+
+
+hedge_stats = HedgeStats()
+ttft_trackers = {"gemini": TTFTTracker(), "ollama": TTFTTracker()}
+
+
+class _Contender:
+    def __init__(self, name: str, stream: AsyncGenerator[str, None], errors: Set[str]):
+        self.name = name
+        self.stream = stream
+        self.errors = errors
+        self.pending = asyncio.ensure_future(self._first())
+
+    async def _first(self) -> Optional[str]:
+        """The first chunk, or None if the provider failed or produced nothing."""
+        try:
+            chunk = await self.stream.__anext__()
+        except (StopAsyncIteration, Exception):
+            return None
+        return None if chunk in self.errors else chunk
+
+    async def close(self) -> None:
+        self.pending.cancel()
+        try:
+            await self.pending
+        except (asyncio.CancelledError, Exception):
+            pass
+        await self.stream.aclose()
+
+
+async def hedged_stream(
+    primary_name: str,
+    primary: Callable[[], AsyncGenerator[str, None]],
+    primary_errors: Set[str],
+    backup_name: str,
+    backup: Callable[[], AsyncGenerator[str, None]],
+    backup_errors: Set[str],
+    delay: float,
+) -> AsyncGenerator[str, None]:
+    """Stream from whichever provider produces a valid first chunk first.
+
+    The primary starts immediately. If it has not produced a first chunk
+    after `delay` seconds the backup is started too; the first contender to
+    deliver a chunk that is not an error marker wins and the other one is
+    cancelled, which closes its upstream connection. If the primary fails
+    before `delay` the backup starts right away. When every contender fails
+    the stream ends without output and the caller decides what to say.
+    """
+    contenders = [_Contender(primary_name, primary(), primary_errors)]
+    hedged = False
+    winner: Optional[_Contender] = None
+    first_chunk: Optional[str] = None
+    try:
+        done, _ = await asyncio.wait({contenders[0].pending}, timeout=delay)
+        if done and contenders[0].pending.result() is not None:
+            winner = contenders[0]
+        else:
+            if not done:
+                hedged = True
+            else:
+                # Primary already failed: this is a plain fallback, not a hedge
+                await contenders.pop(0).close()
+            contenders.append(_Contender(backup_name, backup(), backup_errors))
+            while contenders and winner is None:
+                done, _ = await asyncio.wait({c.pending for c in contenders}, return_when=asyncio.FIRST_COMPLETED)
+                for contender in list(contenders):
+                    if contender.pending not in done:
+                        continue
+                    contenders.remove(contender)
+                    if winner is None and contender.pending.result() is not None:
+                        winner = contender
+                    else:
+                        await contender.close()
+        for loser in contenders:
+            if loser is not winner:
+                await loser.close()
+        contenders = []
+        hedge_stats.record(hedged, winner.name if winner else None)
+        if winner is not None and winner.name == backup_name:
+            FALLBACKS.labels(backup_name, "hedge" if hedged else "error").inc()
+        if winner is None:
+            return
+        first_chunk = winner.pending.result()
+    finally:
+        for contender in contenders:
+            await contender.close()
+
+    yield first_chunk
+    try:
+        async for chunk in winner.stream:
+            if chunk in winner.errors:
+                break
+            yield chunk
+    finally:
+        await winner.stream.aclose()
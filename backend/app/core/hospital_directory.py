@@ -0,0 +1,207 @@
+# Offline hospital directory: answers hospital searches without a model call
+
+import os
+import re
+import csv
+import json
+import bisect
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("MedGPT.hospital_directory")
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data")
+
+# Environment variables
+HOSPITAL_DIRECTORY_SOURCE = os.getenv("HOSPITAL_DIRECTORY_SOURCE", os.path.join(_DATA_DIR, "hospitals.csv"))  # .csv or .json
+HOSPITAL_DIRECTORY_INDEX = os.getenv("HOSPITAL_DIRECTORY_INDEX", os.path.join(_DATA_DIR, "hospitals.index.json"))
+HOSPITAL_DIRECTORY_MAX_RESULTS = int(os.getenv("HOSPITAL_DIRECTORY_MAX_RESULTS", "8"))
+
+_INDEX_VERSION = 2
+_MIN_PREFIX = 4  # shorter prefixes ("pun", "del") are too ambiguous to trust
+# Area names this generic exist in many cities, so they only count next to the city name
+_GENERIC_AREA_RE = re.compile(
+    r"^(?:sector \d+|chowk|(?:new|old|park) town|cantonment|cantt)$|\b(?:road|street|square|market|lines|college|university)$"
+)
+# States and regions are wider than any city in the directory; they must not prefix-match one ("bengal")
+_REGIONS = frozenset({
+    "andhra pradesh", "assam", "bengal", "bihar", "goa", "gujarat", "haryana", "himachal pradesh", "jharkhand",
+    "karnataka", "kashmir", "kerala", "madhya pradesh", "maharashtra", "ncr", "odisha", "punjab", "rajasthan",
+    "tamil nadu", "telangana", "uttar pradesh", "uttarakhand", "west bengal", "india",
+})
+# Words that may be left over around a known name without pointing somewhere else ("pune city", "the noida area")
+_LEFTOVER_WORDS = frozenset({"the", "city", "area", "district", "town", "centre", "center", "side", "state"})
+
+
+def _key(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9 ]", " ", text.lower())).strip()
+
+
+def read_source(path: str) -> List[Dict[str, str]]:
+    """Rows with name, category, city, city_aliases ("|"-separated) and area from a CSV file or a JSON list."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+    return [row for row in rows if row.get("name") and row.get("city")]
+
+
+def compile_index(rows: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Group hospitals by city and build the name/alias/area lookup tables.
+
+    `names` maps every normalized city name, alias and area to
+    [city key, area or ""]; `tokens` is the inverted index from each word of
+    those names to the names containing it.
+    """
+    cities: Dict[str, Dict[str, Any]] = {}
+    names: Dict[str, List[str]] = {}
+    for row in rows:
+        city_key = _key(row["city"])
+        city = cities.setdefault(city_key, {"name": row["city"].strip(), "hospitals": []})
+        area = (row.get("area") or "").strip()
+        city["hospitals"].append({
+            "name": row["name"].strip(),
+            "category": (row.get("category") or "Hospital").strip(),
+            "area": area,
+            "maps_query": ", ".join(part for part in (row["name"].strip(), area, city["name"]) if part),
+        })
+        names[city_key] = [city_key, ""]
+        for alias in (row.get("city_aliases") or "").split("|"):
+            if _key(alias):
+                names.setdefault(_key(alias), [city_key, ""])
+        if _key(area) and not _GENERIC_AREA_RE.search(_key(area)):
+            names.setdefault(_key(area), [city_key, area])
+    tokens: Dict[str, List[str]] = {}
+    for name in names:
+        for token in name.split():
+            tokens.setdefault(token, []).append(name)
+    return {"version": _INDEX_VERSION, "cities": cities, "names": names, "tokens": tokens}
+
+
+def build_index(source: str = HOSPITAL_DIRECTORY_SOURCE, index_path: str = HOSPITAL_DIRECTORY_INDEX) -> Dict[str, Any]:
+    index = compile_index(read_source(source))
+    index["source_mtime"] = os.path.getmtime(source)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+class HospitalDirectory:
+    """Resolves a free-text location to a city's hospitals.
+
+    Resolution tries, in order: the whole location as a city, alias or area
+    name; the longest run of its words that is a known name, as long as the
+    words left over name the same city, a region or nothing in particular
+    ("sector 62 noida" -> "noida", but not "srinagar garhwal");
+    then a unique prefix match for partial input ("bengal" -> "bengaluru").
+    Hospitals in the matched area come first.
+    """
+
+    def __init__(self, index: Dict[str, Any]):
+        self.cities: Dict[str, Dict[str, Any]] = index["cities"]
+        self.names: Dict[str, List[str]] = index["names"]
+        self.tokens: Dict[str, List[str]] = index["tokens"]
+        self._sorted_names = sorted(self.names)
+
+    @classmethod
+    def load(cls, source: str = HOSPITAL_DIRECTORY_SOURCE, index_path: str = HOSPITAL_DIRECTORY_INDEX) -> Optional["HospitalDirectory"]:
+        """Load the compiled index, rebuilding it when the source file is newer. None if there is no directory."""
+        if not os.path.exists(source):
+            return None
+        index = None
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, encoding="utf-8") as f:
+                    index = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                index = None
+            if index and (index.get("version") != _INDEX_VERSION or index.get("source_mtime") != os.path.getmtime(source)):
+                index = None
+        if index is None:
+            try:
+                index = build_index(source, index_path)
+            except OSError:
+                # Read-only deployments: compile in memory
+                index = compile_index(read_source(source))
+        return cls(index)
+
+    def _resolve_name(self, location: str) -> Optional[str]:
+        name = self._known_run(location)
+        if name is not None:
+            return name
+        if len(location) >= _MIN_PREFIX:
+            i = bisect.bisect_left(self._sorted_names, location)
+            matches = []
+            while i < len(self._sorted_names) and self._sorted_names[i].startswith(location):
+                matches.append(self._sorted_names[i])
+                i += 1
+            if matches and len({self.names[m][0] for m in matches}) == 1:
+                return matches[0]
+        return None
+
+    def _known_run(self, location: str) -> Optional[str]:
+        """The location itself if it is a known name, else its longest known run of words whose leftovers agree."""
+        if location in self.names:
+            return location
+        words = location.split()
+        for size in range(len(words) - 1, 0, -1):
+            for start in range(len(words) - size + 1):
+                candidate = " ".join(words[start:start + size])
+                if candidate in self.names and all(
+                    self._leftover_agrees(" ".join(rest), self.names[candidate][0])
+                    for rest in (words[:start], words[start + size:])
+                ):
+                    return candidate
+        return None
+
+    def _leftover_agrees(self, leftover: str, city_key: str) -> bool:
+        """Whether words around a matched name leave it standing: nothing, filler, a generic area, a region or the same city."""
+        if not leftover or leftover in _REGIONS or _GENERIC_AREA_RE.search(leftover):
+            return True
+        if all(word in _LEFTOVER_WORDS for word in leftover.split()):
+            return True
+        name = self._known_run(leftover)
+        return name is not None and self.names[name][0] == city_key
+
+    def resolve(self, location: str) -> Optional[Tuple[str, str]]:
+        """(city key, area or "") for a location, or None."""
+        location = _key(location)
+        if location in _REGIONS:
+            return None
+        name = self._resolve_name(location)
+        if name is None:
+            return None
+        city_key, area = self.names[name]
+        return city_key, area
+
+    def find_in_text(self, text: str) -> Optional[Tuple[str, str]]:
+        """A known city or area mentioned anywhere in `text` ("hospitals mumbai")."""
+        words = _key(text).split()
+        for i, word in enumerate(words):
+            for name in self.tokens.get(word, ()):
+                size = len(name.split())
+                if " ".join(words[i:i + size]) == name:
+                    city_key, area = self.names[name]
+                    return city_key, area
+        return None
+
+    def hospitals(self, city_key: str, area: str = "", limit: int = HOSPITAL_DIRECTORY_MAX_RESULTS) -> Tuple[str, List[Dict[str, str]]]:
+        """(display name, hospitals) for a city, those in `area` first, in the `hospital_list` item shape."""
+        city = self.cities[city_key]
+        ordered = sorted(city["hospitals"], key=lambda h: h["area"] != area) if area else city["hospitals"]
+        items = [{"name": h["name"], "category": h["category"], "maps_query": h["maps_query"]} for h in ordered[:limit]]
+        display = f"{area}, {city['name']}" if area else city["name"]
+        return display, items
+
+
+hospital_directory = HospitalDirectory.load()
+
+
+if __name__ == "__main__":
+    # python -m app.core.hospital_directory: compile the index ahead of time (e.g. in the Docker build)
+    built = build_index()
+    print(f"Indexed {sum(len(c['hospitals']) for c in built['cities'].values())} hospitals in "
+          f"{len(built['cities'])} cities ({len(built['names'])} names) -> {HOSPITAL_DIRECTORY_INDEX}")
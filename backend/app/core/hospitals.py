@@ -0,0 +1,255 @@
+# Hospital search: location extraction, per-location result cache, request coalescing
+
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from app.core.llm import get_llm_response
+from app.core.hospital_directory import hospital_directory
+from app.core.scheduler import PRIORITY_INTERACTIVE
+
+logger = logging.getLogger("MedGPT.hospitals")
+
+# Environment variables
+HOSPITAL_CACHE_TTL = float(os.getenv("HOSPITAL_CACHE_TTL", "86400"))  # seconds a location's list is reused
+HOSPITAL_CACHE_MAX = int(os.getenv("HOSPITAL_CACHE_MAX", "512"))  # locations kept
+
+_PREPOSITION_RE = re.compile(r"\b(?:in|near|at|around)\s+")
+_PHRASE_RE = re.compile(r"[a-z0-9][a-z0-9 ,.'-]{1,60}")
+# Words that end the location phrase ("hospitals in pune please", "near andheri right now")
+_LOCATION_STOP_RE = re.compile(
+    r"\s+\b(?:please|pls|now|right|today|tonight|urgently|asap|immediately|for|with|that|which|who|where|"
+    r"open|and|because|since|area|city|district|region|town)\b.*$"
+)
+_NOT_A_PLACE = {"me", "my location", "my area", "here", "us", "my place", "my home", "the area", "an emergency", "emergency", "case"}
+# A phrase made only of these (and numbers) names no place on its own: "at night", "in sector 62", "near the station"
+_GENERIC_WORDS = frozenset({
+    "the", "a", "an", "this", "that", "night", "day", "daytime", "morning", "afternoon", "evening", "noon",
+    "midnight", "weekend", "weekends", "time", "once", "all", "least", "walking", "driving", "distance",
+    "sector", "block", "phase", "road", "street", "station", "hospital", "hospitals", "clinic", "home",
+    "work", "office", "school", "case", "emergency", "an emergency",
+})
+
+
+def normalize_location(location: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9 ]", " ", location.lower())).strip()
+
+
+def extract_locations(message: str) -> List[str]:
+    """Candidate places a hospital question is about, most likely first.
+
+    Every "in/near/at/around <place>" phrase is a candidate, cut at the next
+    such word, so "near the station in pune" gives both "the station" and
+    "pune"; the last phrase comes first. A phrase with commas gives the
+    whole phrase and then each part, the last one first: "near sadar chowk,
+    raipur" gives "sadar chowk raipur", "raipur", "sadar chowk". Phrases that
+    name no place ("near me", "at night", "in sector 62") are left out.
+    """
+    message = message.lower()
+    starts = [m.end() for m in _PREPOSITION_RE.finditer(message)]
+    candidates = []
+    for start in reversed(starts):
+        phrase = _PHRASE_RE.match(message, start)
+        if phrase is None:
+            continue
+        text = re.split(r"[?!;.]|\b(?:in|near|at|around)\b", phrase.group(0), maxsplit=1)[0]
+        text = _LOCATION_STOP_RE.sub("", " " + text)
+        parts = [part for part in text.split(",") if part.strip()]
+        for location in ([" ".join(parts)] if len(parts) > 1 else []) + parts[::-1]:
+            location = normalize_location(location)
+            if not location or location in _NOT_A_PLACE or location.startswith(("my ", "the nearest", "a ")):
+                continue
+            if all(word in _GENERIC_WORDS or word.isdigit() for word in location.split()):
+                continue
+            if location not in candidates:
+                candidates.append(location)
+    return candidates
+
+
+def extract_location(message: str) -> Optional[str]:
+    """The most likely place a hospital question is about ("hospitals in Navi Mumbai?" -> "navi mumbai"), or None."""
+    candidates = extract_locations(message)
+    return candidates[0] if candidates else None
+
+
+def display_location(location: str) -> str:
+    return " ".join(part.capitalize() for part in location.split())
+
+
+def lead_in(place: str) -> str:
+    """The friendly sentence shown above the list, templated instead of generated."""
+    return (
+        f"Here are some major hospitals and emergency centers in {place}. "
+        "In an emergency, call your local emergency number (e.g. 112) right away."
+    )
+
+
+def parse_hospital_data(raw_response: str, location: str) -> Optional[Dict[str, Any]]:
+    """The `hospital_list` data payload of a hospital_search reply, or None if it has no usable list."""
+    try:
+        data = json.loads(raw_response).get("data")
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    if not isinstance(data, dict) or data.get("type") != "hospital_list":
+        return None
+    hospitals = data.get("hospitals")
+    if isinstance(hospitals, str):
+        try:
+            hospitals = json.loads(hospitals)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(hospitals, list):
+        return None
+    cleaned = []
+    for hospital in hospitals:
+        if not isinstance(hospital, dict) or not hospital.get("name"):
+            continue
+        cleaned.append({
+            "name": hospital["name"],
+            "category": hospital.get("category") or "Hospital",
+            "maps_query": hospital.get("maps_query") or f"{hospital['name']}, {display_location(location)}",
+        })
+    if not cleaned:
+        return None
+    return {"type": "hospital_list", "hospitals": cleaned}
+
+
+async def fetch_hospital_data(location: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict[str, Any]]:
+    """Ask the model for a location's hospital list, without any conversation history so it can be shared."""
+    raw_response = await get_llm_response([], f"List major hospitals in {display_location(location)}", mode="hospital_search", priority=priority)
+    return parse_hospital_data(raw_response, location)
+
+
+class HospitalCache:
+    """Per-location cache of hospital lists with single-flight fetching.
+
+    Concurrent lookups for a location that is not cached share one fetch:
+    the first caller starts it as a task and everyone awaits that task
+    shielded, so a caller that goes away does not cancel it for the others.
+    The fetch runs at the first caller's priority. Failed fetches are not
+    cached.
+    """
+
+    def __init__(self, ttl: float = HOSPITAL_CACHE_TTL, max_entries: int = HOSPITAL_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.directory_hits = 0
+
+    def get(self, location: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(location)
+        if entry is None:
+            return None
+        data, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[location]
+            return None
+        self._entries.move_to_end(location)
+        return data
+
+    def put(self, location: str, data: Dict[str, Any]) -> None:
+        self._entries[location] = (data, time.monotonic() + self.ttl)
+        self._entries.move_to_end(location)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def lookup(
+        self,
+        location: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        fetch: Callable[[str, int], Awaitable[Optional[Dict[str, Any]]]] = fetch_hospital_data,
+    ) -> Optional[Dict[str, Any]]:
+        data = self.get(location)
+        if data is not None:
+            self.hits += 1
+            return data
+        task = self._inflight.get(location)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(location, priority, fetch))
+            self._inflight[location] = task
+        return await asyncio.shield(task)
+
+    async def _fetch(self, location: str, priority: int, fetch: Callable[[str, int], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        try:
+            data = await fetch(location, priority)
+            if data is not None:
+                self.put(location, data)
+            else:
+                logger.warning(f"No usable hospital list for {location!r}")
+            return data
+        finally:
+            self._inflight.pop(location, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "locations": len(self._entries),
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "directory_hits": self.directory_hits,
+        }
+
+
+hospital_cache = HospitalCache()
+
+
+def _answer(place: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "stage": "interview",
+        "urgency": "Low",
+        "message": lead_in(place),
+        "confidence": 0.9,
+        "data": data,
+    }
+
+
+async def hospital_answer(message: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[Dict[str, Any]]:
+    """A complete hospital_search answer for `message`, or None when no location can be resolved.
+
+    `priority` is the model queue priority of a lookup that has to ask the model.
+
+    The offline directory is tried first, with every candidate location in
+    the message, or any known place named in it when there is no candidate;
+    otherwise the most likely candidate goes to the model through the
+    per-location cache.
+    """
+    candidates = extract_locations(message)
+    if hospital_directory is not None:
+        found = None
+        tried: List[str] = []
+        for candidate in candidates:
+            # A part of a phrase the directory could not place ("hyderabad" of "hyderabad, pakistan")
+            # would resolve without the words that put it somewhere else
+            if any(f" {candidate} " in f" {earlier} " for earlier in tried):
+                continue
+            tried.append(candidate)
+            found = hospital_directory.resolve(candidate)
+            if found:
+                break
+        if not found and not candidates:
+            # No "in/near <place>" phrase ("hospitals mumbai"): look for a known city anywhere in the message.
+            # A phrase that did not resolve names a place the directory does not know, so the model gets it
+            found = hospital_directory.find_in_text(message)
+        if found:
+            place, hospitals = hospital_directory.hospitals(*found)
+            hospital_cache.directory_hits += 1
+            return _answer(place, {"type": "hospital_list", "hospitals": hospitals})
+    if not candidates:
+        return None
+    location = candidates[0]
+    data = await hospital_cache.lookup(location, priority)
+    if data is None:
+        return None
+    return _answer(display_location(location), data)
@@ -4,22 +4,48 @@ import httpx
 import re
 import asyncio
 import time
+import logging
 from typing import Optional, Dict, Any, AsyncGenerator
 from app.core.prompt import get_system_prompt
+from app.core.context import assemble_context, PROVIDER_BUDGETS, OLLAMA_NUM_CTX
+from app.core.hedging import HEDGE_ENABLED, hedged_stream, ttft_trackers
+from app.core.breaker import get_breaker
+from app.core.timeline import mark, record_span
+from app.core.scheduler import PRIORITY_INTERACTIVE, QueueRejected, ollama_scheduler
+from app.core.metrics import FALLBACKS, GENERATION_TIME, PARSE_FAILURES, RESPONSE_TOKENS, TTFT, mode_label
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger("MedGPT.llm")
+
 # Environment variables
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
 
-# Circuit breaker for Gemini Quota
-gemini_disabled_until = 0.0
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:1b")
 
 # Persistent client for connection pooling
 http_client = httpx.AsyncClient(timeout=120.0)
 
+def classify_failure(error: Exception) -> str:
+    """Map a provider exception to a circuit-breaker failure kind."""
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+        return "quota"
+    return "error"
+
+def record_provider_call(provider: str, mode: str, outcome: str, start_time: float, ttft: Optional[float], chars: int) -> None:
+    """Observe one provider call in the latency and size histograms. `ttft` is in seconds, None if no token arrived."""
+    labels = (provider, mode_label(mode), outcome)
+    if ttft is not None:
+        TTFT.labels(*labels).observe(ttft)
+    GENERATION_TIME.labels(*labels).observe(time.time() - start_time)
+    RESPONSE_TOKENS.labels(*labels).observe(chars / GenerationStats.CHARS_PER_TOKEN)
+
 def ensure_json_response(text: str) -> str:
     """Enforce JSON output structure using regex."""
     if not text:
@@ -35,7 +61,8 @@ def ensure_json_response(text: str) -> str:
             json.loads(potential_json)
             return potential_json
         except json.JSONDecodeError:
-            pass
+            # Plain prose without a JSON block is a normal reply; a block that does not parse is not
+            PARSE_FAILURES.labels("invalid_json").inc()
         
     return json.dumps({
         "stage": "interview",
@@ -46,18 +73,18 @@ def ensure_json_response(text: str) -> str:
 
 async def call_gemini_stream(messages: list[Dict[str, str]], mode: str = "quick_triage", image: Optional[str] = None, mime_type: str = "image/jpeg") -> AsyncGenerator[str, None]:
     """Call Google Gemini 2.0 Flash via REST API with streaming."""
-    global gemini_disabled_until
-    
     if not GEMINI_API_KEY:
         yield "Error: Gemini API Key missing"
         return
     
-    if time.time() < gemini_disabled_until:
-        print("DEBUG: Gemini disabled due to circuit breaker")
-        yield "ERROR: QUOTA_EXCEEDED"
+    breaker = get_breaker("gemini", GEMINI_MODEL)
+    permit = breaker.allow_request()
+    if permit is None:
+        logger.debug("Gemini skipped: circuit breaker open")
+        yield "ERROR: CIRCUIT_OPEN"
         return
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:streamGenerateContent?key={GEMINI_API_KEY}"
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{GEMINI_MODEL}:streamGenerateContent?key={GEMINI_API_KEY}"
     
     gemini_contents = []
     for i, msg in enumerate(messages):
@@ -78,13 +105,21 @@ async def call_gemini_stream(messages: list[Dict[str, str]], mode: str = "quick_
     }
 
     start_time = time.time()
+    started = time.perf_counter()
     first_token_received = False
+    ttft = 0.0
+    outcome_recorded = False
+    outcome = "cancelled"
+    chars = 0
 
     try:
         async with http_client.stream("POST", url, json=payload, timeout=httpx.Timeout(5.0, connect=2.0)) as response:
+            record_span("gemini_connect", started)
             if response.status_code == 429:
-                print("DEBUG: Gemini Quota Exceeded. Disabling for 5 minutes.")
-                gemini_disabled_until = time.time() + 300 # 5 minutes
+                logger.warning("Gemini quota exceeded, opening circuit breaker")
+                breaker.record_failure("quota", permit)
+                outcome_recorded = True
+                outcome = "quota"
                 yield "ERROR: QUOTA_EXCEEDED"
                 return
             response.raise_for_status()
@@ -101,16 +136,60 @@ async def call_gemini_stream(messages: list[Dict[str, str]], mode: str = "quick_
                         text = chunk["candidates"][0]["content"]["parts"][0]["text"]
                         if not first_token_received:
                             ttft = (time.time() - start_time) * 1000
-                            print(f"DEBUG: Gemini TTFT: {ttft:.2f}ms")
+                            ttft_trackers["gemini"].observe(ttft / 1000)
+                            logger.debug("Gemini TTFT: %.2fms", ttft)
+                            mark("gemini_ttft")
                             first_token_received = True
+                        chars += len(text)
                         yield text
                 except: continue
+        if first_token_received:
+            breaker.record_success(ttft / 1000, permit)
+        else:
+            breaker.record_failure("error", permit)
+        outcome_recorded = True
+        outcome = "ok" if first_token_received else "empty"
     except Exception as e:
-        print(f"Gemini Stream Error: {e}")
+        logger.error("Gemini stream error: %s", e)
+        outcome = classify_failure(e)
+        breaker.record_failure(outcome, permit)
+        outcome_recorded = True
         yield "ERROR: GEMINI_FAIL"
+    finally:
+        if not outcome_recorded:
+            # Abandoned mid-call (client gone, lost a hedge): no verdict on the provider
+            breaker.release(permit)
+        record_span("gemini", started)
+        record_provider_call("gemini", mode, outcome, start_time, ttft / 1000 if first_token_received else None, chars)
+
+async def call_ollama_stream(messages: list[Dict[str, str]], mode: str = "quick_triage", image: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE) -> AsyncGenerator[str, None]:
+    """Call Ollama once `ollama_scheduler` grants a slot; requests it turns away fail like an Ollama error."""
+    if not get_breaker("ollama", OLLAMA_MODEL).is_available():
+        # No point queueing for a provider that will refuse the call
+        logger.debug("Ollama skipped: circuit breaker open")
+        yield "ERROR: OLLAMA_FAIL"
+        return
+    try:
+        async with ollama_scheduler.slot(priority, mode):
+            # Closed before the slot is released, so the next request never overlaps a generation still running
+            stream = _ollama_stream(messages, mode, image)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+    except QueueRejected:
+        yield "ERROR: OLLAMA_FAIL"
 
-async def call_ollama_stream(messages: list[Dict[str, str]], mode: str = "quick_triage", image: Optional[str] = None) -> AsyncGenerator[str, None]:
+async def _ollama_stream(messages: list[Dict[str, str]], mode: str, image: Optional[str]) -> AsyncGenerator[str, None]:
     """Call Ollama with streaming and telemetry."""
+    breaker = get_breaker("ollama", OLLAMA_MODEL)
+    permit = breaker.allow_request()
+    if permit is None:
+        logger.debug("Ollama skipped: circuit breaker open")
+        yield "ERROR: OLLAMA_FAIL"
+        return
+
     url = f"{OLLAMA_BASE_URL}/api/chat"
     ollama_messages = [{"role": "system", "content": get_system_prompt(mode)}]
     
@@ -121,21 +200,27 @@ async def call_ollama_stream(messages: list[Dict[str, str]], mode: str = "quick_
         ollama_messages.append(message_payload)
 
     payload = {
-        "model": "llama3.2:1b",
+        "model": OLLAMA_MODEL,
         "messages": ollama_messages,
         "stream": True,
         "keep_alive": "60m",
-        "options": {"temperature": 0.3, "num_ctx": 4096}
+        "options": {"temperature": 0.3, "num_ctx": OLLAMA_NUM_CTX}
     }
     
     if mode == "hospital_search":
         payload["format"] = "json"
 
     start_time = time.time()
+    started = time.perf_counter()
     first_token_received = False
+    ttft = 0.0
+    outcome_recorded = False
+    outcome = "cancelled"
+    chars = 0
 
     try:
         async with http_client.stream("POST", url, json=payload, timeout=60.0) as response:
+            record_span("ollama_connect", started)
             response.raise_for_status()
             async for line in response.aiter_lines():
                 if not line: continue
@@ -144,43 +229,174 @@ async def call_ollama_stream(messages: list[Dict[str, str]], mode: str = "quick_
                     if "message" in chunk and "content" in chunk["message"]:
                         if not first_token_received:
                             ttft = (time.time() - start_time) * 1000
-                            print(f"DEBUG: Ollama TTFT: {ttft:.2f}ms")
+                            ttft_trackers["ollama"].observe(ttft / 1000)
+                            logger.debug("Ollama TTFT: %.2fms", ttft)
+                            mark("ollama_ttft")
                             first_token_received = True
+                        chars += len(chunk["message"]["content"])
                         yield chunk["message"]["content"]
                     if chunk.get("done"): break
                 except: continue
+        if first_token_received:
+            breaker.record_success(ttft / 1000, permit)
+        else:
+            breaker.record_failure("error", permit)
+        outcome_recorded = True
+        outcome = "ok" if first_token_received else "empty"
     except Exception as e:
-        print(f"Ollama Stream Error: {e}")
+        logger.error("Ollama stream error: %s", e)
+        outcome = classify_failure(e)
+        breaker.record_failure(outcome, permit)
+        outcome_recorded = True
         yield "ERROR: OLLAMA_FAIL"
+    finally:
+        if not outcome_recorded:
+            breaker.release(permit)
+        record_span("ollama", started)
+        record_provider_call("ollama", mode, outcome, start_time, ttft / 1000 if first_token_received else None, chars)
+
+def build_provider_messages(messages: list[Dict[str, str]], mode: str, provider: str) -> list[Dict[str, str]]:
+    """Trim history to the provider's token budget and log what was dropped."""
+    window = assemble_context(messages, get_system_prompt(mode), PROVIDER_BUDGETS[provider])
+    logger.info(json.dumps({
+        "event": "context_window",
+        "provider": provider,
+        "mode": mode,
+        "prompt_tokens": window.prompt_tokens,
+        "kept_messages": len(window.messages),
+        "trimmed_messages": window.trimmed_messages,
+        "trimmed_tokens": window.trimmed_tokens,
+    }))
+    return window.messages
+
+class GenerationStats:
+    """Counts generations that finished vs. were cancelled because nobody was reading them."""
+
+    # Characters per token, same ratio the context estimator uses
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = 0
+        self.fallbacks = 0  # answered by Ollama after Gemini was skipped or failed (hedge wins are in hedge_stats)
+        self.tokens_saved = 0
+        self.avg_response_tokens = 0.0
 
-async def get_llm_response_stream(conversation_history: list[Dict[str, str]], user_message: str, mode: str = "quick_triage", image: Optional[str] = None, mime_type: str = "image/jpeg") -> AsyncGenerator[str, None]:
-    """Orchestrates streaming LLM calls with fallback."""
+    def record_completed(self, chars: int) -> None:
+        tokens = chars / self.CHARS_PER_TOKEN
+        self.completed += 1
+        # EWMA of response length; seeded by the first response
+        if self.completed == 1:
+            self.avg_response_tokens = tokens
+        else:
+            self.avg_response_tokens += 0.1 * (tokens - self.avg_response_tokens)
+
+    def record_cancelled(self, chars: int) -> None:
+        self.cancelled += 1
+        self.tokens_saved += max(0, round(self.avg_response_tokens - chars / self.CHARS_PER_TOKEN))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "fallbacks": self.fallbacks,
+            "tokens_saved": self.tokens_saved,
+            "avg_response_tokens": round(self.avg_response_tokens, 1),
+        }
+
+generation_stats = GenerationStats()
+
+async def get_llm_response_stream(conversation_history: list[Dict[str, str]], user_message: str, mode: str = "quick_triage", image: Optional[str] = None, mime_type: str = "image/jpeg", priority: int = PRIORITY_INTERACTIVE) -> AsyncGenerator[str, None]:
+    """Orchestrates streaming LLM calls with fallback.
+
+    If the consumer stops early (its task is cancelled or it closes this
+    generator), the provider stream is closed right away: leaving its
+    `http_client.stream` block drops the upstream connection, which stops
+    Gemini billing and makes Ollama abort the generation.
+
+    `priority` orders the request in the Ollama queue (see app.core.scheduler).
+    """
+    stream = _stream_with_fallback(conversation_history, user_message, mode, image, mime_type, priority)
+    chars = 0
+    try:
+        async for chunk in stream:
+            chars += len(chunk)
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        generation_stats.record_cancelled(chars)
+        logger.info(json.dumps({"event": "generation_cancelled", "mode": mode, "chars_streamed": chars}))
+        raise
+    finally:
+        await stream.aclose()
+    generation_stats.record_completed(chars)
+
+GEMINI_ERRORS = {"ERROR: QUOTA_EXCEEDED", "ERROR: GEMINI_FAIL", "ERROR: CIRCUIT_OPEN"}
+FALLBACK_REASONS = {"ERROR: QUOTA_EXCEEDED": "quota", "ERROR: GEMINI_FAIL": "error", "ERROR: CIRCUIT_OPEN": "circuit_open"}
+OLLAMA_ERRORS = {"ERROR: OLLAMA_FAIL"}
+OLLAMA_FAIL_MESSAGE = "I'm having trouble connecting to my local backup. Please try again."
+# Sent in place of an answer when the model's reply has no usable message
+NO_MESSAGE_REPLY = "I apologize, but I'm having trouble formulating a response. Could you rephrase your question?"
+PROCESSING_ERROR_REPLY = "Internal processing error. Please repeat."
+FAILURE_REPLIES = (OLLAMA_FAIL_MESSAGE, NO_MESSAGE_REPLY, PROCESSING_ERROR_REPLY)
+
+def is_failure_reply(text: str) -> bool:
+    """Whether a reply is (or ends in) one of the canned apologies sent instead of an answer."""
+    return text.strip().endswith(FAILURE_REPLIES)
+
+async def _stream_with_fallback(conversation_history: list[Dict[str, str]], user_message: str, mode: str, image: Optional[str], mime_type: str, priority: int) -> AsyncGenerator[str, None]:
     messages = conversation_history + [{"role": "user", "content": user_message}]
     
+    # Breaker state decides routing up front, so an outage costs microseconds instead of a timeout
+    gemini_available = get_breaker("gemini", GEMINI_MODEL).is_available()
+
+    # Hedged mode: start Ollama speculatively if Gemini is slower than usual to answer
+    if HEDGE_ENABLED and gemini_available:
+        delay = ttft_trackers["gemini"].hedge_delay()
+        produced = False
+        async for chunk in hedged_stream(
+            "gemini",
+            lambda: call_gemini_stream(build_provider_messages(messages, mode, "gemini"), mode=mode, image=image, mime_type=mime_type),
+            GEMINI_ERRORS,
+            "ollama",
+            lambda: call_ollama_stream(build_provider_messages(messages, mode, "ollama"), mode=mode, image=image, priority=priority),
+            OLLAMA_ERRORS,
+            delay,
+        ):
+            produced = True
+            yield chunk
+        if not produced:
+            yield OLLAMA_FAIL_MESSAGE
+        return
+
     # Try Gemini Stream (unless disabled)
     is_fallback = False
     
-    # Fast check for circuit breaker before entering generator loop
-    if time.time() > gemini_disabled_until:
-        async for chunk in call_gemini_stream(messages, mode=mode, image=image, mime_type=mime_type):
-            if chunk == "ERROR: QUOTA_EXCEEDED" or chunk == "ERROR: GEMINI_FAIL":
+    fallback_reason = "circuit_open"
+    if gemini_available:
+        gemini_messages = build_provider_messages(messages, mode, "gemini")
+        async for chunk in call_gemini_stream(gemini_messages, mode=mode, image=image, mime_type=mime_type):
+            if chunk in GEMINI_ERRORS:
                 is_fallback = True
+                fallback_reason = FALLBACK_REASONS[chunk]
                 break
             yield chunk
     else:
         is_fallback = True
         
     if is_fallback:
-        print("Falling back to Ollama Stream...")
-        async for chunk in call_ollama_stream(messages, mode=mode, image=image):
-            if chunk == "ERROR: OLLAMA_FAIL":
-                yield "I'm having trouble connecting to my local backup. Please try again."
+        logger.info("Falling back to Ollama stream (%s)", fallback_reason)
+        generation_stats.fallbacks += 1
+        FALLBACKS.labels("ollama", fallback_reason).inc()
+        ollama_messages = build_provider_messages(messages, mode, "ollama")
+        async for chunk in call_ollama_stream(ollama_messages, mode=mode, image=image, priority=priority):
+            if chunk in OLLAMA_ERRORS:
+                yield OLLAMA_FAIL_MESSAGE
                 break
             yield chunk
 
 # Keep original for non-streaming compatibility if needed
-async def get_llm_response(conversation_history: list[Dict[str, str]], user_message: str, mode: str = "quick_triage", image: Optional[str] = None, mime_type: str = "image/jpeg") -> str:
-    full_response = ""
-    async for chunk in get_llm_response_stream(conversation_history, user_message, mode, image, mime_type):
-        full_response += chunk
-    return ensure_json_response(full_response)
+async def get_llm_response(conversation_history: list[Dict[str, str]], user_message: str, mode: str = "quick_triage", image: Optional[str] = None, mime_type: str = "image/jpeg", priority: int = PRIORITY_INTERACTIVE) -> str:
+    parts = []
+    async for chunk in get_llm_response_stream(conversation_history, user_message, mode, image, mime_type, priority):
+        parts.append(chunk)
+    return ensure_json_response("".join(parts))
@@ -0,0 +1,182 @@
+# Logging off the event loop: records go through a bounded queue to a background writer thread
+
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Any, Dict, List, Optional, Tuple
+
+# Environment variables
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # per-logger overrides, e.g. "httpx=WARNING,MedGPT.llm=DEBUG"
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")  # keep 1 in N records below WARNING per logger prefix, e.g. "MedGPT.timeline=10"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records waiting for the writer; more are dropped
+LOG_DEBUG_CAPTURE_DIR = os.getenv("LOG_DEBUG_CAPTURE_DIR", "")  # set to keep the last parsed model response per session
+LOG_DEBUG_CAPTURE_SAMPLE = int(os.getenv("LOG_DEBUG_CAPTURE_SAMPLE", "1"))  # capture 1 in N responses
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_CAPTURE_LOGGER = "MedGPT.debug_capture"
+_SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _parse_pairs(spec: str) -> List[Tuple[str, str]]:
+    pairs = []
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            pairs.append((name.strip(), value.strip()))
+    return pairs
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the writer falls behind."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in N records below WARNING for loggers under a configured prefix.
+
+    A counter per prefix rather than a random draw, so the kept share is
+    exact and the filter costs one dict lookup and an increment.
+    """
+
+    def __init__(self, rates: Dict[str, int]):
+        super().__init__()
+        # Longest prefix first so "MedGPT.timeline" wins over "MedGPT"
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+        self.counters: Dict[str, int] = {prefix: 0 for prefix in rates}
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or hasattr(record, "capture_key"):
+            return True
+        for prefix, every in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                count = self.counters[prefix]
+                self.counters[prefix] = count + 1
+                if count % every:
+                    self.sampled_out += 1
+                    return False
+                return True
+        return True
+
+
+class DebugCaptureHandler(logging.Handler):
+    """Writes captured payloads to `<dir>/<key>.json` on the writer thread, replacing the previous one."""
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            path = os.path.join(self.directory, f"{_SAFE_NAME_RE.sub('_', record.capture_key)[:100]}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(record.capture_payload)
+        except Exception:
+            self.handleError(record)
+
+
+class _ByCapture(logging.Filter):
+    def __init__(self, captures: bool):
+        super().__init__()
+        self.captures = captures
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return hasattr(record, "capture_key") == self.captures
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_sampler: Optional[SamplingFilter] = None
+_capture_count = 0
+
+
+def setup_logging() -> None:
+    """Route all logging through one bounded queue to a writer thread. Safe to call more than once."""
+    global _listener, _queue_handler, _sampler
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    rates = {prefix: max(1, int(every)) for prefix, every in _parse_pairs(LOG_SAMPLE) if every.isdigit()}
+    if rates:
+        _sampler = SamplingFilter(rates)
+        _queue_handler.addFilter(_sampler)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    stream_handler.addFilter(_ByCapture(False))
+    handlers: List[logging.Handler] = [stream_handler]
+    if LOG_DEBUG_CAPTURE_DIR:
+        capture_handler = DebugCaptureHandler(LOG_DEBUG_CAPTURE_DIR)
+        capture_handler.addFilter(_ByCapture(True))
+        handlers.append(capture_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_pairs(LOG_LEVELS):
+        logging.getLogger(name).setLevel(level.upper())
+    # uvicorn writes its own logs (the access log on every request) straight to the console
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.handlers:
+            uvicorn_logger.handlers = [_queue_handler]
+
+    capture_logger = logging.getLogger(_CAPTURE_LOGGER)
+    capture_logger.setLevel(logging.DEBUG)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def capture_debug(key: str, payload: Any) -> None:
+    """Keep `payload` as the latest debug capture for `key` (a session id), written in the background.
+
+    A no-op unless LOG_DEBUG_CAPTURE_DIR is set.
+    """
+    global _capture_count
+    if not LOG_DEBUG_CAPTURE_DIR:
+        return
+    _capture_count += 1
+    if _capture_count % LOG_DEBUG_CAPTURE_SAMPLE:
+        return
+    logging.getLogger(_CAPTURE_LOGGER).debug(
+        "debug capture", extra={"capture_key": key, "capture_payload": json.dumps(payload, indent=2, ensure_ascii=False)}
+    )
+
+
+def logging_stats() -> Dict[str, int]:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "sampled_out": _sampler.sampled_out if _sampler else 0,
+    }
@@ -0,0 +1,126 @@
+# Event loop lag monitor: a ticker task measures scheduling delay, a watchdog thread samples what blocked the loop
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from app.core.metrics import LOOP_LAG, LOOP_STALLS
+
+logger = logging.getLogger("MedGPT.looplag")
+
+# Environment variables
+LOOP_LAG_ENABLED = os.getenv("LOOP_LAG_ENABLED", "1") == "1"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))  # seconds between ticks
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))  # lag in seconds counted as a stall
+LOOP_LAG_DEBUG = os.getenv("LOOP_LAG_DEBUG", "0") == "1"  # sample the loop thread's stack during stalls
+LOOP_LAG_STACK_DEPTH = int(os.getenv("LOOP_LAG_STACK_DEPTH", "20"))  # innermost frames kept per sample
+LOOP_LAG_SAMPLES = int(os.getenv("LOOP_LAG_SAMPLES", "20"))  # stall samples kept for /health
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a task that sleeps a fixed interval.
+
+    Every session shares one loop, so a blocking call anywhere delays every
+    in-flight stream; that delay shows up here as lag. Each tick is observed
+    in the lag histogram and ticks later than LOOP_LAG_THRESHOLD count as
+    stalls.
+
+    The ticker only learns about a stall once it is over, when the culprit
+    has already returned. With LOOP_LAG_DEBUG a watchdog thread checks the
+    ticker's heartbeat instead and, while the loop is still blocked, takes
+    one stack sample of the loop thread per stall and logs it.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD,
+                 debug: bool = LOOP_LAG_DEBUG):
+        self.interval = interval
+        self.threshold = threshold
+        self.debug = debug
+        self._ticker: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = 0.0  # perf_counter by which the next tick is due
+        self._sampled_heartbeat = 0.0
+        self.samples: Deque[Dict[str, Any]] = deque(maxlen=LOOP_LAG_SAMPLES)
+        self.ticks = 0
+        self.stalls = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self) -> None:
+        if not LOOP_LAG_ENABLED or self._ticker is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter() + self.interval
+        self._ticker = asyncio.create_task(self._tick())
+        if self.debug:
+            self._stopping.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._ticker:
+            self._ticker.cancel()
+            self._ticker = None
+        if self._watchdog:
+            self._stopping.set()
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _tick(self) -> None:
+        while True:
+            due = time.perf_counter() + self.interval
+            self._heartbeat = due
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - due)
+            self.ticks += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                LOOP_STALLS.inc()
+
+    def _watch(self) -> None:
+        # Checking at half the threshold catches a stall before it has lasted 1.5x the threshold
+        check_every = max(0.005, self.threshold / 2)
+        while not self._stopping.wait(check_every):
+            heartbeat = self._heartbeat
+            blocked = time.perf_counter() - heartbeat
+            if blocked >= self.threshold and heartbeat != self._sampled_heartbeat:
+                self._sampled_heartbeat = heartbeat
+                self._sample(blocked)
+
+    def _sample(self, blocked: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = [
+            f"{entry.filename}:{entry.lineno} in {entry.name}"
+            for entry in traceback.extract_stack(frame)[-LOOP_LAG_STACK_DEPTH:]
+        ]
+        sample = {"at": round(time.time(), 3), "blocked_ms": round(blocked * 1000, 1), "stack": stack}
+        self.samples.append(sample)
+        logger.warning(json.dumps({"event": "loop_stall", **sample}))
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "ticks": self.ticks,
+            "stalls": self.stalls,
+            "last_lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+        }
+        if self.debug:
+            stats["recent_stalls"] = list(self.samples)[-5:]
+        return stats
+
+
+loop_monitor = LoopLagMonitor()
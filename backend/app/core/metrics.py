@@ -0,0 +1,272 @@
+# Prometheus metrics: counters, gauges and histograms rendered in the text exposition format
+
+import os
+import sys
+import math
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Metrics are recorded from the event loop thread only, so series are plain
+# attributes updated in place: no locks, and once a label combination has been
+# seen recording allocates nothing beyond the label lookup key.
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, Any] = {}
+        self._default = None if self.labelnames else self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The series for one label combination, created on first use. Callers may keep the returned child."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _series(self) -> Iterable[Tuple[LabelValues, Any]]:
+        if self._default is not None:
+            yield (), self._default
+        yield from self._children.items()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._series():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: LabelValues, child) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.value += amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.value -= amount
+
+    def set(self, value: float) -> None:
+        self._default.value = value
+
+
+class GaugeFunc(_Metric):
+    """Gauge read at scrape time from state that is already kept elsewhere.
+
+    `collect` returns (label values, value) pairs.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], collect: Callable[[], Iterable[Tuple[LabelValues, float]]]):
+        self.collect = collect
+        super().__init__(name, documentation, labelnames)
+        self._default = None
+
+    def _new_child(self):
+        return None
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self.collect():
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(value)}")
+        return lines
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; buckets are stored per bucket and made cumulative when rendered."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def _render_child(self, values: LabelValues, child: _HistogramValue) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), child.counts):
+            cumulative += count
+            le = 'le="' + _number(bound) + '"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 10.0, 20.0)
+_GENERATION_BUCKETS = (0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 45.0, 60.0, 120.0)
+_TOKEN_BUCKETS = (16, 32, 64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096)
+_QUEUE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Request modes are client-supplied; anything unknown shares one label value to bound cardinality
+MODES = frozenset({"quick_triage", "detailed_explanation", "doctor_summary", "reassurance", "hospital_search"})
+
+
+def mode_label(mode: str) -> str:
+    return mode if mode in MODES else "other"
+
+
+# Provider calls. outcome: ok, error, timeout, quota, empty (no tokens) or cancelled (abandoned by the caller)
+TTFT = registry.register(Histogram(
+    "medgpt_ttft_seconds", "Time from sending a provider request to its first token.",
+    ("provider", "mode", "outcome"), _LATENCY_BUCKETS))
+GENERATION_TIME = registry.register(Histogram(
+    "medgpt_generation_seconds", "Duration of a provider call, from request to last token.",
+    ("provider", "mode", "outcome"), _GENERATION_BUCKETS))
+RESPONSE_TOKENS = registry.register(Histogram(
+    "medgpt_response_tokens", "Estimated tokens streamed back by a provider call.",
+    ("provider", "mode", "outcome"), _TOKEN_BUCKETS))
+QUEUE_WAIT = registry.register(Histogram(
+    "medgpt_queue_wait_seconds", "Time a request waited for a provider slot before being sent.",
+    ("provider", "mode", "outcome"), _QUEUE_BUCKETS))
+
+FALLBACKS = registry.register(Counter(
+    "medgpt_fallbacks_total", "Generations served by the backup provider, by why the primary was not used.",
+    ("provider", "reason")))
+RATE_LIMITED = registry.register(Counter(
+    "medgpt_rate_limit_rejections_total", "Requests rejected by the rate limiter.", ("endpoint", "scope")))
+SHED = registry.register(Counter(
+    "medgpt_shed_total", "Requests answered with an overload notice instead of a generation.", ("endpoint", "reason")))
+PARSE_FAILURES = registry.register(Counter(
+    "medgpt_parse_failures_total", "Model outputs that could not be used as structured JSON.", ("kind",)))
+ACTIVE_STREAMS = registry.register(Gauge(
+    "medgpt_active_streams", "/chat/stream generations currently running."))
+
+# Event loop health, fed by app.core.looplag
+LOOP_LAG = registry.register(Histogram(
+    "medgpt_event_loop_lag_seconds", "How late the loop monitor's periodic wakeups ran.", (), _LOOP_LAG_BUCKETS))
+LOOP_STALLS = registry.register(Counter(
+    "medgpt_event_loop_stalls_total", "Loop monitor wakeups that ran later than the stall threshold."))
+
+
+def process_stats() -> Dict[str, Any]:
+    """Resident memory of this process, for load tests watching for leaks."""
+    stats: Dict[str, Any] = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/statm") as f:
+            stats["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:  # Windows
+        pass
+    return stats
+
+
+def _collect_process() -> Iterable[Tuple[LabelValues, float]]:
+    rss = process_stats().get("rss_bytes")
+    if rss is not None:
+        yield (), rss
+
+
+registry.register(GaugeFunc("process_resident_memory_bytes", "Resident memory size in bytes.", (), _collect_process))
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,78 @@
+# Load shedding: turn requests away up front when no provider could answer them within the wait SLO
+
+import os
+import json
+import math
+import time
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.breaker import get_breaker
+from app.core.llm import GEMINI_MODEL, OLLAMA_MODEL
+from app.core.metrics import SHED
+from app.core.scheduler import PRIORITY_EMERGENCY, ollama_scheduler
+
+logger = logging.getLogger("MedGPT.overload")
+
+# Environment variables
+OVERLOAD_WAIT_SLO = float(os.getenv("OVERLOAD_WAIT_SLO", "15"))  # longest expected wait for a local model slot before shedding
+OVERLOAD_RESPONSE = os.getenv("OVERLOAD_RESPONSE", "degraded")  # "degraded" answers with a notice; "503" makes /chat return 503 + Retry-After
+OVERLOAD_MAX_RETRY_AFTER = int(os.getenv("OVERLOAD_MAX_RETRY_AFTER", "120"))
+
+OVERLOAD_MESSAGE = (
+    "I'm receiving more questions than I can answer right now, so I can't give you a full reply. "
+    "If your symptoms are severe or getting worse, please call emergency services or go to the nearest hospital now. "
+    "Otherwise, please try again in about {seconds} seconds."
+)
+
+
+@dataclass
+class Overload:
+    reason: str  # "queue_full", "slow" or "unavailable"
+    estimated_wait: float
+    retry_after: int
+
+    @property
+    def message(self) -> str:
+        return OVERLOAD_MESSAGE.format(seconds=self.retry_after)
+
+
+def check_overload(priority: int) -> Optional[Overload]:
+    """Whether a generation of `priority` should be shed instead of started.
+
+    Only when Gemini's breaker is open does a request depend on the local
+    model, and then it is shed if the Ollama queue is full, if the wait
+    estimated from recent service times exceeds OVERLOAD_WAIT_SLO, or if
+    Ollama's breaker is open too. Emergency priority is never shed: red-flag
+    guidance does not depend on a model and its elaboration always queues.
+    """
+    if priority == PRIORITY_EMERGENCY or get_breaker("gemini", GEMINI_MODEL).is_available():
+        return None
+
+    ollama = get_breaker("ollama", OLLAMA_MODEL)
+    if not ollama.is_available():
+        wait = max(0.0, ollama.open_until - time.monotonic())
+        return _shed("unavailable", wait)
+    wait = ollama_scheduler.estimated_wait(priority)
+    if ollama_scheduler.would_reject(priority):
+        return _shed("queue_full", wait)
+    if wait > OVERLOAD_WAIT_SLO:
+        return _shed("slow", wait)
+    return None
+
+
+def _shed(reason: str, wait: float) -> Overload:
+    retry_after = min(OVERLOAD_MAX_RETRY_AFTER, max(1, math.ceil(wait)))
+    return Overload(reason, wait, retry_after)
+
+
+def record_shed(endpoint: str, overload: Overload, session_id: str) -> None:
+    SHED.labels(endpoint, overload.reason).inc()
+    logger.warning(json.dumps({
+        "event": "load_shed",
+        "endpoint": endpoint,
+        "reason": overload.reason,
+        "estimated_wait_s": round(overload.estimated_wait, 2),
+        "session_id": session_id,
+    }))
@@ -0,0 +1,172 @@
+# Request rate limiting with constant per-key state
+
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Environment variables
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "token_bucket")  # "token_bucket" or "sliding_window"
+RATE_LIMIT_SESSION = os.getenv("RATE_LIMIT_SESSION", "15/60")  # requests/seconds per session, "0" disables
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"  # take the client IP from X-Forwarded-For
+# Behind a proxy that is not trusted every client has the proxy's address, so the IP limit is off unless trust is set
+RATE_LIMIT_IP = os.getenv("RATE_LIMIT_IP", "60/60" if RATE_LIMIT_TRUST_PROXY else "0")  # requests/seconds per client IP, "0" disables
+
+
+def parse_rate(spec: str) -> Optional[Tuple[int, float]]:
+    """Parse "limit/window_seconds" (e.g. "15/60"). Returns None when limiting is disabled."""
+    limit, _, window = spec.partition("/")
+    limit = int(limit)
+    if limit <= 0:
+        return None
+    return limit, float(window or 60)
+
+
+class TokenBucketLimiter:
+    """Token bucket per key: `limit` burst, refilled at `limit / window` tokens per second.
+
+    Each key costs two floats regardless of traffic. Keys whose bucket has
+    been full for a whole window carry no information and are dropped by a
+    sweep that runs at most once per `window`.
+    """
+
+    def __init__(self, limit: int = 15, window: float = 60):
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window
+        self.buckets: Dict[str, List[float]] = {}  # key -> [tokens, last_refill]
+        self.next_sweep = time.monotonic() + window
+        self.rejected = 0
+
+    def is_allowed(self, key: str, consume: bool = True) -> bool:
+        """Whether `key` has a token; it is spent only when `consume` is set."""
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self.expire(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if consume:
+                self.buckets[key] = [self.limit - 1.0, now]
+            return True
+        tokens = min(self.limit, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens < 1.0:
+            bucket[0], bucket[1] = tokens, now
+            self.rejected += 1
+            return False
+        if consume:
+            bucket[0], bucket[1] = tokens - 1.0, now
+        return True
+
+    def expire(self, now: float) -> int:
+        cutoff = now - self.window
+        idle = [key for key, bucket in self.buckets.items() if bucket[1] <= cutoff]
+        for key in idle:
+            del self.buckets[key]
+        self.next_sweep = now + self.window
+        return len(idle)
+
+    def stats(self) -> Dict[str, int]:
+        return {"keys": len(self.buckets), "rejected": self.rejected}
+
+
+class SlidingWindowLimiter:
+    """Approximate sliding-window counter per key.
+
+    Keeps only the current and previous fixed-window counts and weights the
+    previous one by how much of it still overlaps the sliding window, so the
+    per-key state is three numbers instead of a list of timestamps.
+    """
+
+    def __init__(self, limit: int = 15, window: float = 60):
+        self.limit = limit
+        self.window = window
+        self.counters: Dict[str, List[int]] = {}  # key -> [window_index, previous_count, current_count]
+        self.next_sweep = time.monotonic() + window
+        self.rejected = 0
+
+    def is_allowed(self, key: str, consume: bool = True) -> bool:
+        """Whether `key` is under the limit; the request is counted only when `consume` is set."""
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self.expire(now)
+        index = int(now // self.window)
+        counter = self.counters.get(key)
+        if counter is None:
+            if consume:
+                self.counters[key] = [index, 0, 1]
+            return True
+        if counter[0] != index:
+            # Roll over: the old current window becomes the previous one only if it is adjacent
+            counter[1] = counter[2] if index - counter[0] == 1 else 0
+            counter[2] = 0
+            counter[0] = index
+        overlap = 1.0 - (now / self.window - index)
+        if counter[1] * overlap + counter[2] >= self.limit:
+            self.rejected += 1
+            return False
+        if consume:
+            counter[2] += 1
+        return True
+
+    def expire(self, now: float) -> int:
+        # A key whose current window ended more than one window ago has no weight left
+        cutoff = int(now // self.window) - 2
+        idle = [key for key, counter in self.counters.items() if counter[0] <= cutoff]
+        for key in idle:
+            del self.counters[key]
+        self.next_sweep = now + self.window
+        return len(idle)
+
+    def stats(self) -> Dict[str, int]:
+        return {"keys": len(self.counters), "rejected": self.rejected}
+
+
+def create_limiter(spec: str, mode: str = RATE_LIMIT_MODE):
+    rate = parse_rate(spec)
+    if rate is None:
+        return None
+    if mode == "sliding_window":
+        return SlidingWindowLimiter(*rate)
+    if mode == "token_bucket":
+        return TokenBucketLimiter(*rate)
+    raise ValueError(f"Unknown RATE_LIMIT_MODE: {mode!r}")
+
+
+class RequestRateLimiter:
+    """Applies the per-session and per-client-IP limits together."""
+
+    def __init__(self, session_spec: str = RATE_LIMIT_SESSION, ip_spec: str = RATE_LIMIT_IP, mode: str = RATE_LIMIT_MODE):
+        self.by_session = create_limiter(session_spec, mode)
+        self.by_ip = create_limiter(ip_spec, mode)
+
+    def check(self, client_ip: Optional[str], session_id: str) -> Optional[str]:
+        """Return None if the request may proceed, else the scope ("session" or "ip") that rejected it.
+
+        Both limits are checked before either is charged, so a request one
+        limit rejects does not use up the other's allowance.
+        """
+        if self.by_session and not self.by_session.is_allowed(session_id, consume=False):
+            return "session"
+        if self.by_ip and client_ip and not self.by_ip.is_allowed(client_ip, consume=False):
+            return "ip"
+        if self.by_session:
+            self.by_session.is_allowed(session_id)
+        if self.by_ip and client_ip:
+            self.by_ip.is_allowed(client_ip)
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {}
+        if self.by_session:
+            stats["session"] = self.by_session.stats()
+        if self.by_ip:
+            stats["ip"] = self.by_ip.stats()
+        return stats
+
+
+def get_client_ip(request) -> Optional[str]:
+    """Client address of a Starlette request, honouring X-Forwarded-For when behind a trusted proxy."""
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
@@ -1,5 +1,277 @@
-# Placeholder for red-flag detection logic
+# Red-flag detection: rule-based fast path for emergencies
 
-def check_safety(message: str) -> bool:
-    # TODO: Implement safety checks
+import re
+import json
+import bisect
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from app.core.context import EMERGENCY_MARKER
+from app.core.llm import get_llm_response, is_failure_reply
+from app.core.scheduler import PRIORITY_EMERGENCY
+from app.core.state import get_session_record, get_session_state, save_session_state
+from app.core.tasks import SessionTasks
+from app.core.timeline import detach_timeline
+
+logger = logging.getLogger("MedGPT.safety")
+
+# Phrases for each red flag listed in SYSTEM_PROMPT (app/core/prompt.py), including
+# common patient wordings. Lowercase; matched against the lowercased message on word boundaries.
+RED_FLAG_PATTERNS = {
+    "chest_pain": [
+        r"chest pains?", r"pain in (?:my |the )?chest", r"chest (?:is )?(?:hurting|hurts|tightness|pressure)",
+        r"tight(?:ness in (?:my |the )?| )chest", r"crushing (?:pain|feeling) in (?:my |the )?chest",
+    ],
+    "shortness_of_breath": [
+        r"short(?:ness)? of breath", r"can'?t breathe?", r"cannot breathe?", r"unable to breathe?",
+        r"(?:difficulty|trouble|struggling|hard) (?:to )?breath(?:e|ing)", r"gasping for (?:air|breath)",
+    ],
+    "sudden_weakness": [
+        r"sudden(?:ly)? (?:weak(?:ness)?|numb(?:ness)?)", r"face (?:is )?drooping", r"drooping face",
+        r"slurred speech", r"can'?t (?:move|feel) (?:my )?(?:arm|leg|face|one side)", r"numb(?:ness)? on one side",
+    ],
+    "severe_bleeding": [
+        r"(?:severe|heavy|heavily|uncontrolled) bleeding", r"bleeding (?:heavily|a lot|badly|profusely)",
+        r"(?:won'?t|will not|can'?t|cannot) stop (?:the )?bleeding", r"losing a lot of blood",
+    ],
+    "fainting": [
+        r"faint(?:ed|ing)", r"pass(?:ed|ing) out", r"lost consciousness", r"unconscious", r"blacked out",
+    ],
+    "seizure": [
+        r"seizures?", r"seizing", r"convuls(?:ion|ions|ing)", r"having a fit",
+    ],
+    "confusion": [
+        r"sudden(?:ly)? confus(?:ed|ion)", r"severe(?:ly)? confus(?:ed|ion)", r"disoriented",
+        r"(?:very|extremely) confused",
+    ],
+    "stiff_neck_fever": [
+        r"stiff neck\b.*\bfever", r"fever\b.*\bstiff neck",
+    ],
+    "severe_allergic_reaction": [
+        r"anaphyla(?:xis|ctic)", r"severe allergic reaction", r"throat (?:is )?(?:closing|swelling)",
+        r"(?:tongue|lips?|face) (?:is |are )?swell(?:ing|ed) (?:up )?(?:after|from)",
+    ],
+    "suicidal_thoughts": [
+        r"suicid(?:al|e)", r"kill(?:ing)? myself", r"end(?:ing)? my (?:own )?life", r"take my (?:own )?life",
+        r"want to die", r"self[- ]harm(?:ing)?", r"(?:hurt|harm)(?:ing)? myself on purpose",
+        # Intent, not a bare "hurt myself", which is usually an accident ("I hurt myself playing football")
+        r"(?:want(?:ed)?|going|trying|tried|planning|urges?|thoughts?|thinking) (?:to |of |about )?(?:hurt|harm)(?:ing)? myself",
+    ],
+}
+
+# One alternation with a named group per flag, so a single pass finds every match.
+# The word boundary is hoisted out of the alternation so most positions fail on one check.
+_RED_FLAG_RE = re.compile(
+    "\\b(?:"
+    + "|".join(f"(?P<{flag}>{'|'.join(patterns)})" for flag, patterns in RED_FLAG_PATTERNS.items())
+    + ")\\b"
+)
+
+# A negation shortly before the phrase, in the same clause, cancels it ("no chest pain"),
+# but "without warning" describes how it started
+_NEGATION_RE = re.compile(
+    r"\b(?:no|not|never|without(?! (?:any )?(?:warning|notice|reason))|denies|deny|denied|don'?t|doesn'?t|didn'?t|isn'?t|wasn'?t|haven'?t|hasn'?t|"
+    r"no longer|free of|nor)\b[^.;!?]{0,25}$"
+)
+_NEGATION_WINDOW = 40  # characters before the phrase that _NEGATION_RE can reach
+_CLAUSE_BREAK_RE = re.compile(r"[.;!?]|\bbut\b")
+# Longer messages are scanned at the start and the end only: a symptom report is rarely
+# buried in the middle of a pasted document, and every request waits for this scan
+_MAX_SCAN_CHARS = 4000
+
+# Questions about a condition rather than reports of one, including the frontend's
+# dictionary tool ("What does 'seizure' mean? (Simple Dictionary Definition)")
+_EDUCATIONAL_RE = re.compile(
+    r"\b(?:what (?:is|are|causes|happens)|what's|whats|why do|how (?:do|does|is|are)|explain|tell me about|"
+    r"define|definition|meaning|dictionary|signs of|symptoms of|causes of|difference between|learn about|"
+    r"what (?:does|do) [^.!?]{1,60}? mean)\b"
+)
+# ...unless the message also reports something happening now ("what do I do, I'm having chest pain")
+_REPORT_RE = re.compile(
+    r"\b(?:i'?m having|i am having|i have|i've got|i feel|i just|i can'?t|"
+    r"(?:he|she|they|my \w+) (?:is|are|has|have|just|can'?t)\b)"
+)
+
+
+# Mentions in the past are history for the model to weigh, not an emergency now
+_HISTORICAL_RE = re.compile(
+    r"\b(?:(?:\d+|a|an|one|two|three|few|several|many) (?:days?|weeks?|months?|years?) (?:ago|back)|"
+    r"last (?:week|month|year|summer|winter|spring|autumn|fall)|years ago|as a (?:child|kid|teenager|baby)|"
+    r"when i was|history of|used to|in the past|back in|previously)\b"
+)
+_PAST_RE = re.compile(r"\b(?:had|was|were|fainted|passed out|lost consciousness|blacked out|collapsed)\b")
+# ...unless the clause places it in the present ("I just fainted", "I passed out an hour ago")
+_RECENT_RE = re.compile(
+    r"\b(?:just|right now|now|currently|still|again|keeps?|since|today|tonight|"
+    r"this (?:morning|afternoon|evening)|(?:\d+ |a few |few |an? )?(?:minutes?|mins?|hours?) ago|for the (?:last|past)|"
+    r"for (?:\d+|a few|few|an?|an hour|several|over an?|about an?) ?(?:minutes?|mins?|hours?)|"
+    r"suddenly|without (?:any )?warning|out of nowhere)\b"
+)
+# Everyday causes that explain the phrase away ("can't breathe through my nose", "a paper cut won't stop bleeding")
+_MILD_CONTEXT_RE = {
+    "shortness_of_breath": re.compile(
+        r"\b(?:through (?:my|the|one) nos(?:e|tril)|(?:blocked|stuffy|stuffed|runny) nose|(?:a|the|my|bad) cold|"
+        r"congest(?:ed|ion)|sinus(?:es|itis)?)\b"
+    ),
+    "severe_bleeding": re.compile(
+        r"\b(?:paper ?cut|(?:small|minor|tiny|little) cut|scratch|shaving|pricked|nose ?bleed)\b"
+    ),
+}
+
+
+@dataclass
+class RedFlagMatch:
+    flag: str
+    phrase: str
+    confident: bool  # safe to answer with emergency guidance without waiting for the model
+
+
+def detect_red_flag(message: str) -> Optional[RedFlagMatch]:
+    """Find a red-flag symptom in a user message.
+
+    Negated mentions ("no chest pain") are ignored. These are returned but
+    not marked confident, so the model makes the call:
+    - a mention inside an educational question ("what is a seizure?"),
+      unless the message also reports symptoms happening now;
+    - a mention in the past ("I fainted last year", "my dad had a
+      seizure"), unless its clause says it is happening now ("just");
+    - a phrase its clause explains away ("can't breathe through my nose").
+    Messages longer than _MAX_SCAN_CHARS are scanned at both ends only.
+    Returns the first confident match, else the first unconfident one, else None.
+    """
+    if len(message) > _MAX_SCAN_CHARS:
+        half = _MAX_SCAN_CHARS // 2
+        message = message[:half] + " . " + message[-half:]
+    message = message.lower()
+    # Clause boundaries, found once: a clause runs from the end of one break to the start of the next
+    break_starts: List[int] = []
+    break_ends: List[int] = []
+    for brk in _CLAUSE_BREAK_RE.finditer(message):
+        break_starts.append(brk.start())
+        break_ends.append(brk.end())
+    # Per clause: (historical, recent, first past-tense word or -1); per (clause, flag): mild
+    clauses: Dict[int, tuple] = {}
+    mild_clauses: Dict[tuple, bool] = {}
+
+    fallback = None
+    educational = None
+    for match in _RED_FLAG_RE.finditer(message):
+        index = bisect.bisect_right(break_ends, match.start())
+        clause_start = break_ends[index - 1] if index else 0
+        if _NEGATION_RE.search(message, max(clause_start, match.start() - _NEGATION_WINDOW), match.start()):
+            continue
+        following = bisect.bisect_left(break_starts, match.end())
+        clause_end = break_starts[following] if following < len(break_starts) else len(message)
+        if educational is None:
+            educational = bool(_EDUCATIONAL_RE.search(message)) and not _REPORT_RE.search(message)
+        if index not in clauses:
+            past = _PAST_RE.search(message, clause_start, clause_end)
+            clauses[index] = (
+                bool(_HISTORICAL_RE.search(message, clause_start, clause_end)),
+                bool(_RECENT_RE.search(message, clause_start, clause_end)),
+                past.start() if past else -1,
+            )
+        historical, recent, past_at = clauses[index]
+        if not historical and not recent:
+            historical = 0 <= past_at < match.end()
+        flag = match.lastgroup
+        mild = False
+        if flag in _MILD_CONTEXT_RE:
+            if (index, flag) not in mild_clauses:
+                mild_clauses[index, flag] = bool(_MILD_CONTEXT_RE[flag].search(message, clause_start, clause_end))
+            mild = mild_clauses[index, flag]
+        result = RedFlagMatch(flag=flag, phrase=match.group(0), confident=not (educational or historical or mild))
+        if result.confident:
+            return result
+        if fallback is None:
+            fallback = result
+    return fallback
+
+
+EMERGENCY_MESSAGE = (
+    "⚠️ **This could be a medical emergency.** Based on what you described ({symptom}), please seek help right now:\n\n"
+    "- **Call your local emergency number** (e.g. 112 or 911) or have someone take you to the nearest emergency department.\n"
+    "- Do not drive yourself if you feel faint, confused or short of breath.\n"
+    "- Stay with someone if possible and keep your phone nearby.\n\n"
+    "If you need to find nearby hospitals, ask 'Find hospitals near me'.\n\n"
+    "_I am an AI assistant, not a doctor. This information is for educational purposes only and does not replace professional medical advice._"
+)
+
+SUICIDE_MESSAGE = (
+    "⚠️ **I'm really sorry you're feeling this way, and you deserve support right now.**\n\n"
+    "- If you are in immediate danger or might act on these thoughts, **call your local emergency number** (e.g. 112 or 911) now.\n"
+    "- Please reach out to a suicide and crisis helpline in your country, or to someone you trust, and tell them how you are feeling.\n"
+    "- If you can, stay with another person and move away from anything you could use to hurt yourself.\n\n"
+    "You don't have to go through this alone.\n\n"
+    "_I am an AI assistant, not a doctor. This information is for educational purposes only and does not replace professional medical advice._"
+)
+
+_FLAG_DESCRIPTIONS = {
+    "chest_pain": "chest pain",
+    "shortness_of_breath": "difficulty breathing",
+    "sudden_weakness": "sudden weakness or numbness",
+    "severe_bleeding": "severe bleeding",
+    "fainting": "fainting or loss of consciousness",
+    "seizure": "a seizure",
+    "confusion": "sudden confusion",
+    "stiff_neck_fever": "a stiff neck with fever",
+    "severe_allergic_reaction": "a severe allergic reaction",
+}
+
+
+def emergency_message(match: RedFlagMatch) -> str:
+    if match.flag == "suicidal_thoughts":
+        return SUICIDE_MESSAGE
+    return EMERGENCY_MESSAGE.format(symptom=_FLAG_DESCRIPTIONS.get(match.flag, match.phrase))
+
+
+def emergency_turn(message: str, guidance: str) -> List[Dict[str, str]]:
+    """History entries for a turn answered by the fast path.
+
+    The assistant entry carries EMERGENCY_MARKER, which keeps the turn pinned
+    when the context is trimmed.
+    """
+    return [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": f"{EMERGENCY_MARKER}\n{guidance}"},
+    ]
+
+
+_running = SessionTasks("Emergency elaboration", logger)
+
+
+async def elaborate_emergency(session_id: str, prior: List[Dict[str, str]], message: str, mode: str) -> bool:
+    """Ask the model about a turn the fast path already answered and fold its reply into the history.
+
+    `prior` is the history before the turn. The model's message is appended
+    to the fast-path assistant entry, so later turns see the full answer;
+    if the session moved on or was reset meanwhile nothing is written.
+    Returns True if the history was updated.
+    """
+    detach_timeline()
+    raw_response = await get_llm_response(prior, message, mode=mode, priority=PRIORITY_EMERGENCY)
+    try:
+        parsed = json.loads(raw_response)
+    except json.JSONDecodeError:
+        return False
+    text = (parsed.get("message") or parsed.get("response") or "").strip()
+    # The orchestrator turns provider failures into apology text; the guidance already stands on its own
+    if not text or is_failure_reply(text):
+        return False
+
+    current = get_session_state(session_id)
+    n = len(prior)
+    if len(current) < n + 2 or current[:n] != prior or not current[n + 1]["content"].startswith(EMERGENCY_MARKER):
+        logger.info(f"Session {session_id} changed during emergency elaboration, discarding it")
+        return False
+    current[n + 1] = {"role": "assistant", "content": f"{current[n + 1]['content']}\n\n{text}"}
+    state = get_session_record(session_id, current)
+    # The regex match alone never locks the session; the model's stage for the turn does
+    state.extend_reply(text, stage=parsed.get("stage") or "interview")
+    save_session_state(session_id, current, state)
     return True
+
+
+def schedule_elaboration(session_id: str, prior: List[Dict[str, str]], message: str, mode: str) -> None:
+    """Run `elaborate_emergency` in the background; at most one per session."""
+    _running.start(session_id, elaborate_emergency(session_id, prior, message, mode))
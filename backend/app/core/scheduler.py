@@ -0,0 +1,198 @@
+# Admission control for the local model: a concurrency limit with a bounded priority queue in front of it
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.core.metrics import QUEUE_WAIT, mode_label
+from app.core.timeline import record_span
+
+logger = logging.getLogger("MedGPT.scheduler")
+
+# Environment variables
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))  # match OLLAMA_NUM_PARALLEL on the Ollama server
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "16"))  # requests waiting for a slot; more are rejected
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "20"))  # seconds a request may wait for a slot
+
+# Lower runs first
+PRIORITY_EMERGENCY = 0  # red-flag turns and sessions already in emergency mode
+PRIORITY_INTERACTIVE = 1  # someone is waiting for the answer
+PRIORITY_BACKGROUND = 2  # compaction and other work nobody is watching
+PRIORITY_NAMES = {PRIORITY_EMERGENCY: "emergency", PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+
+class QueueRejected(Exception):
+    """No slot was granted: the queue was full, the wait timed out, or a more urgent request took the place."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class SlotScheduler:
+    """Grants at most `limit` concurrent slots; everyone else waits in priority order.
+
+    Waiters are served by priority, then arrival. The queue holds at most
+    `max_queue` requests: when it is full a new request is rejected, unless
+    it is more urgent than the least urgent waiter, which is then rejected
+    in its place, so emergencies are never turned away by routine traffic.
+    A request that waits longer than `timeout` gives up.
+
+    A released slot is handed straight to the next waiter, so a request
+    arriving meanwhile cannot overtake the queue. How long slots are held
+    is tracked as a moving average, from which `estimated_wait` predicts
+    the wait of a new request. Runs on the event loop thread only.
+    """
+
+    # Weight of the newest hold time in the moving average
+    SERVICE_ALPHA = 0.2
+
+    def __init__(self, name: str, limit: int, max_queue: int, timeout: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []  # heap of (priority, arrival, future)
+        self._arrivals = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "timeout": 0, "displaced": 0}
+        self.total_wait = 0.0
+        self.avg_service: Optional[float] = None  # seconds a slot is held, None until one has been released
+
+    def depth(self) -> Dict[str, int]:
+        """Requests waiting, by priority name."""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                depth[PRIORITY_NAMES[priority]] += 1
+        return depth
+
+    def _waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def estimated_wait(self, priority: int) -> float:
+        """Seconds a request of `priority` arriving now would wait for a slot; 0 before any service time is known.
+
+        It needs one slot to free up for every request that would be served
+        before it, and with `limit` slots one frees up every
+        avg_service / limit seconds on average.
+        """
+        ahead = sum(1 for p, _, future in self._waiters if p <= priority and not future.done())
+        releases_needed = self.active + ahead - self.limit + 1
+        if releases_needed <= 0 or self.avg_service is None:
+            return 0.0
+        return releases_needed * self.avg_service / self.limit
+
+    def would_reject(self, priority: int) -> bool:
+        """Whether a request of `priority` arriving now would find the queue full."""
+        if self.active < self.limit and not self._waiting():
+            return False
+        if self._waiting() < self.max_queue:
+            return False
+        return not any(p > priority for p, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int) -> None:
+        """Wait for a slot. Raises QueueRejected if none is granted."""
+        if self.active < self.limit and not self._waiting():
+            self.active += 1
+            return
+        if self._waiting() >= self.max_queue and not self._displace(priority):
+            raise QueueRejected("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._arrivals += 1
+        heapq.heappush(self._waiters, (priority, self._arrivals, future))
+        try:
+            await asyncio.wait({future}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        if not future.done():
+            future.cancel()
+            raise QueueRejected("timeout")
+        if future.cancelled():
+            raise QueueRejected("displaced")
+        # The slot was handed over by `release`, which already counted it as active
+
+    def _displace(self, priority: int) -> bool:
+        """Reject the least urgent, most recent waiter if it is less urgent than `priority`."""
+        pending = [entry for entry in self._waiters if not entry[2].done()]
+        if not pending:
+            return False
+        victim = max(pending, key=lambda entry: (entry[0], entry[1]))
+        if victim[0] <= priority:
+            return False
+        victim[2].cancel()
+        return True
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        if future.done() and not future.cancelled():
+            # Granted just as the caller was cancelled: pass the slot on
+            self.release()
+        else:
+            future.cancel()
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int, mode: str) -> AsyncIterator[None]:
+        """Hold a slot for the enclosed block; the wait is recorded in the queue-wait histogram and the timeline."""
+        started = time.perf_counter()
+        try:
+            await self.acquire(priority)
+        except QueueRejected as e:
+            self.rejected[e.reason] += 1
+            self._observe_wait(mode, e.reason, started)
+            logger.warning("%s slot not granted (%s, %s priority)", self.name, e.reason, PRIORITY_NAMES[priority])
+            raise
+        except asyncio.CancelledError:
+            self._observe_wait(mode, "cancelled", started)
+            raise
+        self.admitted += 1
+        self.total_wait += self._observe_wait(mode, "admitted", started)
+        held_from = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release()
+            self._observe_service(time.perf_counter() - held_from)
+
+    def _observe_service(self, seconds: float) -> None:
+        if self.avg_service is None:
+            self.avg_service = seconds
+        else:
+            self.avg_service += self.SERVICE_ALPHA * (seconds - self.avg_service)
+
+    def _observe_wait(self, mode: str, outcome: str, started: float) -> float:
+        waited = time.perf_counter() - started
+        QUEUE_WAIT.labels(self.name, mode_label(mode), outcome).observe(waited)
+        if waited >= 0.001:
+            record_span(f"{self.name}_queue", started)
+        return waited
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.depth(),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "avg_service_ms": round(self.avg_service * 1000, 1) if self.avg_service is not None else None,
+            "estimated_wait_ms": round(self.estimated_wait(PRIORITY_INTERACTIVE) * 1000, 1),
+        }
+
+
+ollama_scheduler = SlotScheduler("ollama", OLLAMA_MAX_CONCURRENCY, OLLAMA_MAX_QUEUE, OLLAMA_QUEUE_TIMEOUT)
@@ -0,0 +1,316 @@
+# Semantic response cache: near-duplicate first-turn questions share an answer
+
+import os
+import re
+import json
+import time
+import zlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.cache import prompt_version
+
+logger = logging.getLogger("MedGPT.semantic_cache")
+
+# Environment variables
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))  # cosine similarity needed for a hit
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "20000"))
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "256"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "21600"))  # seconds
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "")  # set to memory-map the index to disk
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+if SEMANTIC_CACHE_PATH and WEB_CONCURRENCY > 1:
+    # Every worker would fill the same files from its own slot counter, pairing vectors with other workers' answers
+    logger.warning(f"SEMANTIC_CACHE_PATH is ignored with {WEB_CONCURRENCY} workers; the semantic cache stays in memory")
+    SEMANTIC_CACHE_PATH = ""
+
+# Only modes whose first answer is a general explanation of the question
+SEMANTIC_MODES = {"detailed_explanation", "quick_triage"}
+
+_SIGNATURE_BITS = 64
+_MAX_CANDIDATES = 512  # rows reranked with exact cosine per lookup
+_SEED = 1165  # fixed so signatures stay valid across restarts
+
+# Words that phrase a question without changing what is asked
+FILLER_WORDS = frozenset("""
+a an the is are was were be am do does did can could would should will shall may might must
+what whats what's how why when which who whom where tell me about explain explained describe described define meaning mean means
+please pls plz i you your my we us our it its this that these those there here of to in on for with by at from
+and or as into some any just really very much more also let lets let's know want wanna need understand
+give detail details detailed simple simply short briefly brief quick quickly info information overview
+""".split())
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Filler for the vector, but they change what is asked ("how much can I take" vs "why take"),
+# so like numbers they must match exactly; synonyms share a canonical word
+QUESTION_WORDS = {
+    "how": "how", "much": "much", "many": "much", "more": "more", "when": "when", "why": "why",
+    "can": "can", "could": "can", "may": "can", "might": "can",
+    "should": "should", "must": "should", "shall": "should",
+    "which": "which", "who": "who", "whom": "who", "where": "where",
+}
+
+
+def content_words(message: str) -> List[str]:
+    """Lowercased words with question phrasing removed; plurals folded to the singular."""
+    words = []
+    for word in _WORD_RE.findall(message.lower()):
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def _features(words: List[str]) -> List[Tuple[str, float]]:
+    # Words carry the meaning; unordered word pairs keep some context without caring
+    # about phrasing order ("dengue symptoms" vs "symptoms of dengue"); character
+    # 4-grams absorb spelling variants. Joined pairs and 4-grams bring a compound
+    # written as one word closer ("hair fall" vs "hairfall"), though not to a hit
+    # at the default threshold
+    feats = [(w, 1.0) for w in words]
+    for a, b in zip(words, words[1:]):
+        feats.append((" ".join(sorted((a, b))), 0.5))
+        feats.append((a + b, 0.4))
+    for w in words:
+        feats += [(f"#{w[i:i + 4]}", 0.25) for i in range(max(0, len(w) - 3))]
+    return feats
+
+
+def embed(message: str, dim: int = SEMANTIC_CACHE_DIM) -> Optional[np.ndarray]:
+    """Unit-length signed feature-hashing vector of a message, or None if nothing is left after filler removal."""
+    words = content_words(message)
+    if not words:
+        return None
+    vec = np.zeros(dim, dtype=np.float32)
+    for feat, weight in _features(words):
+        h = zlib.crc32(feat.encode("utf-8"))
+        vec[h % dim] += weight if h & 0x80000000 else -weight
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        return None
+    vec /= norm
+    return vec
+
+
+class SemanticCache:
+    """Fixed-capacity vector index of cached answers.
+
+    Vectors live in one contiguous float32 matrix (memory-mapped when a path
+    is given) next to a 64-bit random-hyperplane signature per row. A lookup
+    first compares signatures with one XOR + popcount pass over all rows,
+    which keeps only rows whose angle to the query can plausibly pass the
+    threshold, then reranks those few with exact cosine similarity. Rows are
+    reused in insertion order once the index is full.
+
+    Numbers and question words in a question must match exactly ("type 1"
+    vs "type 2 diabetes", "how much paracetamol can I take" vs "why take
+    paracetamol" are close in vector space but different questions).
+    """
+
+    def __init__(
+        self,
+        capacity: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        dim: int = SEMANTIC_CACHE_DIM,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: float = SEMANTIC_CACHE_TTL,
+        path: str = SEMANTIC_CACHE_PATH,
+    ):
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl = ttl
+        self.path = path
+        self._planes = np.random.default_rng(_SEED).standard_normal((_SIGNATURE_BITS, dim)).astype(np.float32)
+        self._bit_weights = np.left_shift(np.uint64(1), np.arange(_SIGNATURE_BITS, dtype=np.uint64))
+        # Signature bits that may differ for vectors at the threshold angle, with a margin
+        # of three standard deviations (each bit flips with probability angle / pi)
+        p = float(np.arccos(np.clip(threshold, -1.0, 1.0)) / np.pi)
+        self.max_hamming = int(np.ceil(_SIGNATURE_BITS * p + 3 * np.sqrt(_SIGNATURE_BITS * p * (1 - p)))) + 1
+
+        if path:
+            self.vectors, self.signatures, self.tags, self.expires = self._open_memmaps(path)
+        else:
+            self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+            self.signatures = np.zeros(capacity, dtype=np.uint64)
+            self.tags = np.zeros(capacity, dtype=np.uint32)
+            self.expires = np.zeros(capacity, dtype=np.float64)  # wall clock, 0 = empty slot
+        self.responses: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.terms: List[Tuple[str, ...]] = [()] * capacity  # numbers and question words
+        self.size = 0
+        self.next_slot = 0
+        # Sidecar records not yet appended; one writer thread appends them in order, off the event loop
+        self._unwritten: List[str] = []
+        self._unwritten_lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        if path:
+            self._load_entries()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-cache-writer")
+
+        self.hits = 0
+        self.misses = 0
+
+    # --- persistence ---
+
+    def _open_memmaps(self, path: str):
+        arrays = []
+        for name, dtype, shape in (
+            ("vectors", np.float32, (self.capacity, self.dim)),
+            ("signatures", np.uint64, (self.capacity,)),
+            ("tags", np.uint32, (self.capacity,)),
+            ("expires", np.float64, (self.capacity,)),
+        ):
+            file = f"{path}.{name}.npy"
+            array = None
+            if os.path.exists(file):
+                array = np.lib.format.open_memmap(file, mode="r+")
+                if array.shape != shape or array.dtype != dtype:
+                    logger.warning(f"Semantic cache file {file} has a different layout, starting empty")
+                    del array
+                    array = None
+            if array is None:
+                array = np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=shape)
+            arrays.append(array)
+        return arrays
+
+    def _load_entries(self) -> None:
+        """Answers are kept in an append-only sidecar; the last line written for a slot wins."""
+        file = f"{self.path}.entries.jsonl"
+        if not os.path.exists(file):
+            self.expires[:] = 0.0
+            return
+        latest: Dict[int, Dict[str, Any]] = {}
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if 0 <= record.get("slot", -1) < self.capacity:
+                    latest[record["slot"]] = record
+        now = time.time()
+        for slot in range(self.capacity):
+            record = latest.get(slot)
+            # Records from before question words were kept cannot be checked for them
+            if record is None or "terms" not in record or self.expires[slot] <= now:
+                self.expires[slot] = 0.0
+                continue
+            self.responses[slot] = record["response"]
+            self.terms[slot] = tuple(record["terms"])
+        filled = [slot for slot in latest if self.responses[slot] is not None]
+        self.size = max(filled) + 1 if filled else 0
+        self.next_slot = (max(filled, key=lambda s: self.expires[s]) + 1) % self.capacity if filled else 0
+        # Rewrite the sidecar so it only holds live slots
+        with open(file, "w", encoding="utf-8") as f:
+            for slot in sorted(filled):
+                f.write(json.dumps(latest[slot], ensure_ascii=False) + "\n")
+
+    def _persist(self, slot: int) -> None:
+        if self._writer is None:
+            return
+        record = {"slot": slot, "response": self.responses[slot], "terms": list(self.terms[slot])}
+        with self._unwritten_lock:
+            self._unwritten.append(json.dumps(record, ensure_ascii=False) + "\n")
+            if len(self._unwritten) > 1:
+                # A write is already scheduled and will take this record along
+                return
+        self._writer.submit(self._write_unwritten)
+
+    def _write_unwritten(self) -> None:
+        with self._unwritten_lock:
+            lines, self._unwritten = self._unwritten, []
+        try:
+            with open(f"{self.path}.entries.jsonl", "a", encoding="utf-8") as f:
+                f.writelines(lines)
+        except OSError as e:
+            logger.error(f"Semantic cache write failed, {len(lines)} entries will not survive a restart: {e}")
+
+    def close(self) -> None:
+        """Wait for pending sidecar writes to finish."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    # --- index ---
+
+    def _signature(self, vec: np.ndarray) -> np.uint64:
+        bits = (self._planes @ vec) > 0
+        return np.bitwise_or.reduce(self._bit_weights[bits]) if bits.any() else np.uint64(0)
+
+    @staticmethod
+    def _tag(mode: str) -> int:
+        return zlib.crc32(f"{mode}:{prompt_version(mode)}".encode("utf-8"))
+
+    @staticmethod
+    def _terms(message: str) -> Tuple[str, ...]:
+        words = _WORD_RE.findall(message.lower())
+        return tuple(sorted({w for w in words if w.isdigit()} | {QUESTION_WORDS[w] for w in words if w in QUESTION_WORDS}))
+
+    def lookup(self, message: str, mode: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Best cached answer for a question like `message`, as (response, similarity), or None."""
+        vec = embed(message, self.dim)
+        if vec is None or self.size == 0:
+            self.misses += 1
+            return None
+        n = self.size
+        distances = np.bitwise_count(self.signatures[:n] ^ self._signature(vec))
+        candidates = np.flatnonzero(
+            (distances <= self.max_hamming) & (self.tags[:n] == self._tag(mode)) & (self.expires[:n] > time.time())
+        )
+        if len(candidates) > _MAX_CANDIDATES:
+            nearest = np.argpartition(distances[candidates], _MAX_CANDIDATES)[:_MAX_CANDIDATES]
+            candidates = candidates[nearest]
+        if len(candidates):
+            similarities = self.vectors[candidates] @ vec
+            terms = self._terms(message)
+            for i in np.argsort(similarities)[::-1]:
+                if similarities[i] < self.threshold:
+                    break
+                slot = int(candidates[i])
+                if self.terms[slot] == terms:
+                    self.hits += 1
+                    return self.responses[slot], float(similarities[i])
+        self.misses += 1
+        return None
+
+    def store(self, message: str, mode: str, response: Dict[str, Any]) -> None:
+        vec = embed(message, self.dim)
+        if vec is None:
+            return
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.capacity
+        self.size = max(self.size, slot + 1)
+        self.vectors[slot] = vec
+        self.signatures[slot] = self._signature(vec)
+        self.tags[slot] = self._tag(mode)
+        self.expires[slot] = time.time() + self.ttl
+        self.responses[slot] = response
+        self.terms[slot] = self._terms(message)
+        self._persist(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": int(np.count_nonzero(self.expires[:self.size] > time.time())),
+            "capacity": self.capacity,
+            "memory_mapped": bool(self.path),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+semantic_cache = SemanticCache()
+
+
+def is_semantic_request(history: list, mode: str, image: Optional[str]) -> bool:
+    return SEMANTIC_CACHE_ENABLED and not history and not image and mode in SEMANTIC_MODES
@@ -0,0 +1,159 @@
+# Server-Sent Events framing and per-session replay for /chat/stream
+
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+from app.core.timeline import mark
+
+# Environment variables
+STREAM_REPLAY_EVENTS = int(os.getenv("STREAM_REPLAY_EVENTS", "4096"))  # frames kept per stream
+STREAM_REPLAY_TTL = float(os.getenv("STREAM_REPLAY_TTL", "120"))  # seconds a finished stream stays resumable
+STREAM_CANCEL_GRACE = float(os.getenv("STREAM_CANCEL_GRACE", "3"))  # seconds to wait for a reconnect before cancelling
+STREAM_DISCONNECT_POLL = float(os.getenv("STREAM_DISCONNECT_POLL", "0.5"))  # how often an idle stream checks its client
+
+# Keep proxies (nginx, HF Spaces) from buffering or caching the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse(event: str, data: Any, event_id: str) -> str:
+    """One SSE frame. `data` is JSON-encoded so it always fits on a single `data:` line."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamRun:
+    """The events of one /chat/stream generation, buffered so clients can resume.
+
+    The producer appends frames with `emit`; any number of readers `follow`
+    the run from a given sequence number and are woken on each new frame.
+    Event ids are "<run_id>:<seq>", which is what a reconnecting client
+    sends back in `Last-Event-ID`.
+
+    When the last reader goes away before the run is done, the producer task
+    is cancelled after `STREAM_CANCEL_GRACE` seconds unless someone resumes
+    in the meantime. Cancelling the task unwinds the provider stream, which
+    closes the upstream HTTP connection.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.run_id = uuid.uuid4().hex[:12]
+        self.frames: List[str] = []
+        self.first_seq = 1  # sequence number of frames[0] once old frames were dropped
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.followers = 0
+        self.abandoned = False
+        self._changed = asyncio.Event()
+        self._cancel_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def last_seq(self) -> int:
+        return self.first_seq + len(self.frames) - 1
+
+    def emit(self, event: str, data: Any) -> None:
+        if self.done:
+            return
+        if event == "token":
+            mark("ttft")  # first text the user sees, whatever produced it
+        seq = self.last_seq + 1
+        self.frames.append(format_sse(event, data, f"{self.run_id}:{seq}"))
+        if len(self.frames) > STREAM_REPLAY_EVENTS:
+            del self.frames[0]
+            self.first_seq += 1
+        if event == "done":
+            self.done = True
+            self.finished_at = time.monotonic()
+        self._wake()
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(
+        self,
+        after_seq: int = 0,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """Yield every frame after `after_seq`, then new frames as they arrive, until the run is done.
+
+        While waiting for the next frame `is_disconnected` is polled, so a
+        client that goes away during a silent stretch (TTFT, the JSON tail)
+        is noticed without having to write to it.
+        """
+        self.followers += 1
+        if self._cancel_handle is not None:
+            self._cancel_handle.cancel()
+            self._cancel_handle = None
+        try:
+            seq = after_seq
+            while True:
+                while seq < self.last_seq:
+                    # Checked before every frame, since frames can be dropped while the reader is suspended:
+                    # a reader further behind than the buffer reaches resumes from the oldest frame kept
+                    seq = max(seq, self.first_seq - 1) + 1
+                    yield self.frames[seq - self.first_seq]
+                if self.done:
+                    return
+                changed = self._changed
+                while not changed.is_set():
+                    try:
+                        await asyncio.wait_for(changed.wait(), timeout=STREAM_DISCONNECT_POLL)
+                    except asyncio.TimeoutError:
+                        if is_disconnected is not None and await is_disconnected():
+                            return
+        finally:
+            self.followers -= 1
+            if self.followers == 0 and not self.done:
+                self._cancel_handle = asyncio.get_running_loop().call_later(STREAM_CANCEL_GRACE, self._cancel_if_abandoned)
+
+    def _cancel_if_abandoned(self) -> None:
+        self._cancel_handle = None
+        if self.followers == 0 and not self.done and self.task is not None:
+            self.abandoned = True
+            self.task.cancel()
+
+
+class ReplayRegistry:
+    """Keeps the latest stream of each session so a dropped connection can resume it."""
+
+    def __init__(self, ttl: float = STREAM_REPLAY_TTL):
+        self.ttl = ttl
+        self.runs: "OrderedDict[str, StreamRun]" = OrderedDict()
+
+    def start(self, session_id: str) -> StreamRun:
+        self._prune()
+        run = StreamRun(session_id)
+        self.runs.pop(session_id, None)
+        self.runs[session_id] = run
+        return run
+
+    def resume(self, session_id: str, last_event_id: str) -> Optional[Tuple[StreamRun, int]]:
+        """Find the run a `Last-Event-ID` belongs to. Returns (run, last seen seq) or None if it expired."""
+        run_id, _, seq = last_event_id.partition(":")
+        run = self.runs.get(session_id)
+        if run is None or run.run_id != run_id or not seq.isdigit():
+            return None
+        return run, int(seq)
+
+    def _prune(self) -> None:
+        # Runs are kept in start order; finished, expired ones at the front are dropped
+        cutoff = time.monotonic() - self.ttl
+        while self.runs:
+            run = next(iter(self.runs.values()))
+            if not run.done or run.finished_at > cutoff:
+                break
+            self.runs.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streams": len(self.runs),
+            "active": sum(1 for run in self.runs.values() if not run.done),
+        }
+
+
+replay_registry = ReplayRegistry()
@@ -1,5 +1,550 @@
 # Session / conversation state handling
 
-def get_session_state(session_id: str):
-    # TODO: Implement state retrieval
-    return {}
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from app.core.context import EMERGENCY_MARKER, estimate_tokens
+
+logger = logging.getLogger("MedGPT.state")
+
+# Environment variables
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" or "sqlite"
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "5000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0.05"))
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", "64"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+
+# Rough per-object overhead so resident bytes track real RSS more closely than raw text length
+_MESSAGE_OVERHEAD_BYTES = 232
+_SESSION_OVERHEAD_BYTES = 512
+
+
+class SessionState:
+    """What routing needs to know about a session, kept next to its history.
+
+    Updated once per turn by `record_turn`, so deciding whether a session is
+    locked in emergency mode does not mean rescanning the conversation.
+    """
+
+    __slots__ = ("stage", "urgency", "mode", "turns", "input_tokens", "output_tokens")
+
+    def __init__(
+        self,
+        stage: str = "interview",
+        urgency: str = "Low",
+        mode: str = "quick_triage",
+        turns: int = 0,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+    ):
+        self.stage = stage
+        self.urgency = urgency
+        self.mode = mode
+        self.turns = turns
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def is_emergency(self) -> bool:
+        return self.stage == "emergency"
+
+    def record_turn(self, user_message: str, assistant_message: str, stage: str, urgency: str, mode: str) -> None:
+        self.stage = stage
+        self.urgency = urgency
+        self.mode = mode
+        self.turns += 1
+        self.input_tokens += estimate_tokens(user_message)
+        self.output_tokens += estimate_tokens(assistant_message)
+
+    def extend_reply(self, text: str, stage: Optional[str] = None) -> None:
+        """Count assistant text added to the current turn after it was recorded; `stage` replaces the turn's if given."""
+        self.output_tokens += estimate_tokens(text)
+        if stage:
+            self.stage = stage
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SessionState":
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    @classmethod
+    def from_history(cls, history: List[Dict[str, str]]) -> "SessionState":
+        """Rebuild the state of a session saved before states were stored."""
+        state = cls()
+        for msg in history:
+            if msg["role"] == "user":
+                state.turns += 1
+                state.input_tokens += estimate_tokens(msg.get("content", ""))
+            else:
+                state.output_tokens += estimate_tokens(msg.get("content", ""))
+        last_assistant = next((msg for msg in reversed(history) if msg["role"] == "assistant"), None)
+        if last_assistant and EMERGENCY_MARKER in last_assistant.get("content", ""):
+            state.stage = "emergency"
+            state.urgency = "High"
+        return state
+
+
+def estimate_history_bytes(history: List[Dict[str, str]]) -> int:
+    """Cheap estimate of the memory held by one conversation history."""
+    total = _SESSION_OVERHEAD_BYTES
+    for msg in history:
+        total += _MESSAGE_OVERHEAD_BYTES + len(msg.get("content", ""))
+    return total
+
+
+class SessionBackend:
+    """Interface every session backend implements.
+
+    `get` returns the stored history list (or `default`), `set` replaces it;
+    `set` without a `state` keeps the session's current `SessionState`, and
+    `get_state` returns it (None if the session has none stored).
+    `start`/`stop` are called from the app's startup/shutdown hooks to run
+    any background work (sweeping, write flushing).
+    """
+
+    def get(self, session_id: str, default: Optional[List[Dict[str, str]]] = None) -> Optional[List[Dict[str, str]]]:
+        raise NotImplementedError
+
+    def get_state(self, session_id: str) -> Optional[SessionState]:
+        raise NotImplementedError
+
+    def set(self, session_id: str, history: List[Dict[str, str]], state: Optional[SessionState] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class _Entry:
+    __slots__ = ("history", "state", "last_access", "nbytes")
+
+    def __init__(self, history: List[Dict[str, str]], state: Optional[SessionState], now: float):
+        self.history = history
+        self.state = state
+        self.last_access = now
+        self.nbytes = estimate_history_bytes(history)
+
+
+class SessionStore(SessionBackend):
+    """In-process conversation store with LRU + idle-TTL eviction.
+
+    Entries are kept in access order, so the least recently used session is
+    always at the front and eviction on overflow is O(1). Idle sessions are
+    removed lazily on access and periodically by `run_sweeper`.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_COUNT, ttl: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        self.resident_bytes = 0
+        self.evictions_lru = 0
+        self.evictions_ttl = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def _touch(self, session_id: str) -> Optional[_Entry]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry.last_access > self.ttl:
+            self._remove(session_id)
+            self.evictions_ttl += 1
+            return None
+        entry.last_access = now
+        self._entries.move_to_end(session_id)
+        return entry
+
+    def get(self, session_id: str, default: Optional[List[Dict[str, str]]] = None) -> Optional[List[Dict[str, str]]]:
+        entry = self._touch(session_id)
+        return default if entry is None else entry.history
+
+    def get_state(self, session_id: str) -> Optional[SessionState]:
+        entry = self._touch(session_id)
+        return None if entry is None else entry.state
+
+    def set(self, session_id: str, history: List[Dict[str, str]], state: Optional[SessionState] = None) -> None:
+        old = self._entries.pop(session_id, None)
+        if old is not None:
+            self.resident_bytes -= old.nbytes
+            if state is None:
+                state = old.state
+        entry = _Entry(history, state, time.monotonic())
+        self._entries[session_id] = entry
+        self.resident_bytes += entry.nbytes
+        while len(self._entries) > self.max_sessions:
+            oldest_id = next(iter(self._entries))
+            self._remove(oldest_id)
+            self.evictions_lru += 1
+
+    def delete(self, session_id: str) -> None:
+        if session_id in self._entries:
+            self._remove(session_id)
+
+    def _remove(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id)
+        self.resident_bytes -= entry.nbytes
+
+    def sweep(self) -> int:
+        """Drop every session idle for longer than the TTL. Returns the number removed."""
+        cutoff = time.monotonic() - self.ttl
+        expired = []
+        # Entries are in access order, so we can stop at the first live one
+        for session_id, entry in self._entries.items():
+            if entry.last_access > cutoff:
+                break
+            expired.append(session_id)
+        for session_id in expired:
+            self._remove(session_id)
+        self.evictions_ttl += len(expired)
+        return len(expired)
+
+    async def run_sweeper(self, interval: float = SESSION_SWEEP_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.info(f"Session sweeper expired {removed} idle sessions ({len(self)} resident)")
+
+    def start(self) -> None:
+        self._sweeper = asyncio.create_task(self.run_sweeper())
+
+    async def stop(self) -> None:
+        if self._sweeper:
+            self._sweeper.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "resident_bytes": self.resident_bytes,
+            "evictions_lru": self.evictions_lru,
+            "evictions_ttl": self.evictions_ttl,
+        }
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Session store shared by every worker process on one host.
+
+    The database runs in WAL mode so readers never block the writer. Writes
+    are serialized on the request path and handed to a flusher thread that
+    commits them in batches, so a turn never waits on fsync. Reads go through
+    a small LRU cache that is revalidated with `PRAGMA data_version`: only
+    when another connection has committed since our last look do we ask the
+    database which sessions changed and drop those from the cache.
+    """
+
+    def __init__(
+        self,
+        path: str = SESSION_DB_PATH,
+        ttl: float = SESSION_TTL_SECONDS,
+        flush_interval: float = SESSION_FLUSH_INTERVAL,
+        batch_size: int = SESSION_FLUSH_BATCH,
+        cache_size: int = SESSION_CACHE_SIZE,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+
+        self._reader = self._connect()
+        self._reader.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, history TEXT NOT NULL, updated_at REAL NOT NULL, state TEXT)"
+        )
+        columns = {row[1] for row in self._reader.execute("PRAGMA table_info(sessions)")}
+        if "state" not in columns:
+            # Databases created before session states were stored
+            self._reader.execute("ALTER TABLE sessions ADD COLUMN state TEXT")
+        self._reader.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions(updated_at)")
+
+        # session_id -> (history, updated_at, state)
+        self._cache: "OrderedDict[str, Tuple[List[Dict[str, str]], float, Optional[SessionState]]]" = OrderedDict()
+        self._data_version = self._read_data_version()
+        self._synced_at = time.time()
+
+        # session_id -> (serialized history, updated_at, serialized state); None marks a delete
+        self._pending: Dict[str, Optional[Tuple[str, float, Optional[str]]]] = {}
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._flusher: Optional[threading.Thread] = None
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        # Stored sessions as of the last flush or sweep, so stats() never queries on the event loop
+        self.session_count = self._count_sessions(self._reader)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @staticmethod
+    def _count_sessions(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _read_data_version(self) -> int:
+        return self._reader.execute("PRAGMA data_version").fetchone()[0]
+
+    def _revalidate_cache(self) -> None:
+        version = self._read_data_version()
+        if version == self._data_version:
+            return
+        self._data_version = version
+        # Overlap covers other workers' flush delay and clock jitter between processes
+        since = self._synced_at - 1.0 - self.flush_interval
+        self._synced_at = time.time()
+        rows = self._reader.execute(
+            "SELECT session_id, updated_at FROM sessions WHERE updated_at >= ?", (since,)
+        ).fetchall()
+        for session_id, updated_at in rows:
+            cached = self._cache.get(session_id)
+            if cached is not None and cached[1] != updated_at:
+                del self._cache[session_id]
+
+    def _cache_put(
+        self, session_id: str, history: List[Dict[str, str]], updated_at: float, state: Optional[SessionState]
+    ) -> None:
+        self._cache[session_id] = (history, updated_at, state)
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load(self, session_id: str) -> Optional[Tuple[List[Dict[str, str]], float, Optional[SessionState]]]:
+        """(history, updated_at, state) of a live session, from the cache, pending writes or the database."""
+        self._revalidate_cache()
+        cutoff = time.time() - self.ttl
+
+        cached = self._cache.get(session_id)
+        if cached is not None:
+            if cached[1] >= cutoff:
+                self.cache_hits += 1
+                self._cache.move_to_end(session_id)
+                return cached
+            del self._cache[session_id]
+
+        self.cache_misses += 1
+        with self._pending_lock:
+            pending = self._pending.get(session_id, False)
+        if pending is None:
+            return None
+        if pending:
+            payload, updated_at, state_payload = pending
+        else:
+            row = self._reader.execute(
+                "SELECT history, updated_at, state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, updated_at, state_payload = row
+        if updated_at < cutoff:
+            return None
+        history = json.loads(payload)
+        state = SessionState.from_dict(json.loads(state_payload)) if state_payload else None
+        self._cache_put(session_id, history, updated_at, state)
+        return history, updated_at, state
+
+    def get(self, session_id: str, default: Optional[List[Dict[str, str]]] = None) -> Optional[List[Dict[str, str]]]:
+        loaded = self._load(session_id)
+        return default if loaded is None else loaded[0]
+
+    def get_state(self, session_id: str) -> Optional[SessionState]:
+        loaded = self._load(session_id)
+        return None if loaded is None else loaded[2]
+
+    def set(self, session_id: str, history: List[Dict[str, str]], state: Optional[SessionState] = None) -> None:
+        if state is None:
+            state = self.get_state(session_id)
+        updated_at = time.time()
+        payload = json.dumps(history, separators=(",", ":"), ensure_ascii=False)
+        state_payload = json.dumps(state.to_dict(), separators=(",", ":")) if state is not None else None
+        self._cache_put(session_id, history, updated_at, state)
+        with self._pending_lock:
+            self._pending[session_id] = (payload, updated_at, state_payload)
+            should_wake = len(self._pending) >= self.batch_size
+        if self._flusher is None:
+            # No background flusher (scripts, tests): write through
+            self.flush()
+        elif should_wake:
+            self._wakeup.set()
+
+    def delete(self, session_id: str) -> None:
+        self._cache.pop(session_id, None)
+        with self._pending_lock:
+            self._pending[session_id] = None
+        if self._flusher is None:
+            self.flush()
+        else:
+            self._wakeup.set()
+
+    def flush(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Commit every pending write in a single transaction. Returns the rows written."""
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        conn = conn or self._reader
+        upserts = [(sid, *item) for sid, item in batch.items() if item is not None]
+        deletes = [(sid,) for sid, item in batch.items() if item is None]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if upserts:
+                conn.executemany(
+                    "INSERT INTO sessions (session_id, history, updated_at, state) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET history = excluded.history, "
+                    "updated_at = excluded.updated_at, state = excluded.state",
+                    upserts,
+                )
+            if deletes:
+                conn.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            # Put the batch back unless a newer write for the same session arrived meanwhile
+            with self._pending_lock:
+                for sid, item in batch.items():
+                    self._pending.setdefault(sid, item)
+            raise
+        self.flushes += 1
+        self.rows_flushed += len(batch)
+        self.session_count = self._count_sessions(conn)
+        return len(batch)
+
+    def _flush_loop(self) -> None:
+        # Flushing and sweeping share one dedicated connection so the event loop never waits on them
+        conn = self._connect()
+        next_sweep = time.monotonic() + SESSION_SWEEP_INTERVAL
+        try:
+            while not self._stopping:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                try:
+                    self.flush(conn)
+                    if time.monotonic() >= next_sweep:
+                        next_sweep = time.monotonic() + SESSION_SWEEP_INTERVAL
+                        removed = self.sweep(conn)
+                        if removed:
+                            logger.info(f"Session sweeper expired {removed} idle sessions")
+                except sqlite3.Error as e:
+                    logger.error(f"Session flush failed: {e}")
+            self.flush(conn)
+        finally:
+            conn.close()
+
+    def sweep(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Delete every session idle for longer than the TTL. Returns the number removed."""
+        conn = conn or self._reader
+        removed = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,)).rowcount
+        # Also picks up sessions other workers wrote since this worker last flushed
+        self.session_count = self._count_sessions(conn)
+        return removed
+
+    def start(self) -> None:
+        self._stopping = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+
+    async def stop(self) -> None:
+        if self._flusher:
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.to_thread(self._flusher.join)
+            self._flusher = None
+        else:
+            self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            "sessions": self.session_count,
+            "cached_sessions": len(self._cache),
+            "pending_writes": pending,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+        }
+
+
+def create_session_backend(kind: str = SESSION_BACKEND) -> SessionBackend:
+    if kind == "sqlite":
+        return SQLiteSessionBackend()
+    if kind == "memory":
+        return SessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND: {kind!r}")
+
+
+session_store = create_session_backend()
+
+
+def get_session_state(session_id: str) -> List[Dict[str, str]]:
+    """Return the conversation history for a session (empty for new or expired sessions)."""
+    return session_store.get(session_id, [])
+
+
+def get_session_record(session_id: str, history: Optional[List[Dict[str, str]]] = None) -> SessionState:
+    """Return the `SessionState` of a session, fresh for new sessions.
+
+    Sessions saved before states were stored get one rebuilt from `history`
+    (fetched if not given); it is persisted with the next save.
+    """
+    state = session_store.get_state(session_id)
+    if state is None:
+        state = SessionState.from_history(get_session_state(session_id) if history is None else history)
+    return state
+
+
+def save_session_state(session_id: str, history: List[Dict[str, str]], state: Optional[SessionState] = None) -> None:
+    """Store a session's history, and its state if given (otherwise the stored state is kept)."""
+    session_store.set(session_id, history, state)
+
+
+# Routing keywords shared by both chat endpoints, matched in one pass. The lookaheads
+# report both groups independently: "search" asks for a hospital lookup, "help" is any
+# request for care (allowed even while a session is locked in emergency mode).
+_ROUTING_RE = re.compile(
+    r"(?:(?=.*?\b(?P<search>hospital|emergency center|medical center|clinic|where is the nearest)))?"
+    r"(?:(?=.*?\b(?P<help>emergency|doctor|help|where)))?",
+    re.DOTALL,
+)
+
+
+def match_routing_keywords(message: str) -> Tuple[bool, bool]:
+    """(asks for a hospital search, is seeking help) for a user message."""
+    match = _ROUTING_RE.match(message.lower())
+    search = match.group("search") is not None
+    return search, search or match.group("help") is not None
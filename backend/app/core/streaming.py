@@ -0,0 +1,178 @@
+# Incremental processing of streamed LLM output
+
+import json
+from typing import List
+
+
+class JsonInterceptor:
+    """Splits a streamed response into user-visible prose and the trailing JSON block.
+
+    Models answer with a friendly lead-in followed by a JSON object. Everything
+    before the first '{' is shown to the user; from that brace on the text is
+    only buffered for parsing once the stream ends. Each chunk is scanned once
+    and appended to a list, so the cost per chunk does not grow with the
+    length of the response.
+
+    The JSON part is also run through a `StreamingJsonScanner`; the fields it
+    has completed so far are available in `fields`.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.length = 0
+        self.brace_pos = -1  # offset of the first '{' in the full text, -1 until seen
+        self.scanner = StreamingJsonScanner()
+
+    def feed(self, chunk: str) -> str:
+        """Buffer `chunk` and return the part of it that should be shown to the user."""
+        self.parts.append(chunk)
+        offset = self.length
+        self.length += len(chunk)
+        if self.brace_pos != -1:
+            self.scanner.feed(chunk)
+            return ""
+        idx = chunk.find("{")
+        if idx == -1:
+            return chunk
+        self.brace_pos = offset + idx
+        self.scanner.feed(chunk[idx:])
+        return chunk[:idx]
+
+    @property
+    def fields(self) -> dict:
+        """Top-level metadata fields recognized so far."""
+        return self.scanner.fields
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+class StreamingJsonScanner:
+    """Incremental scanner for the top-level fields of a JSON object as it streams in.
+
+    Tracks nesting depth and string/escape state one character at a time and
+    reports a watched top-level field as soon as its value is complete, long
+    before the whole object can be parsed. Only the raw text of watched values
+    is kept.
+    """
+
+    WATCHED = ("stage", "urgency", "data")
+
+    def __init__(self, watched=WATCHED):
+        self.watched = set(watched)
+        self.fields = {}
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"  # at depth 1: "key" -> "colon" -> "value" -> "comma"
+        self._key_parts: List[str] = []
+        self._key = None
+        self._value_parts: List[str] = []
+        self._value_kind = None  # "string", "nested" or "scalar" while a depth-1 value is being read
+        self._capturing = False
+        self._new = []
+
+    def feed(self, text: str) -> list:
+        """Consume the next slice of JSON text. Returns newly completed (key, value) pairs."""
+        if self.done:
+            return []
+        self._new = []
+        reading_key = self._in_string and self._depth == 1 and self._expect == "key"
+        seg_start = 0 if (self._capturing or reading_key) else None
+        i = 0
+        n = len(text)
+        while i < n and not self.done:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key":
+                        self._key_parts.append(text[seg_start:i])
+                        self._key = "".join(self._key_parts)
+                        self._key_parts = []
+                        seg_start = None
+                        self._expect = "colon"
+                    elif self._depth == 1 and self._value_kind == "string":
+                        self._finish_value(text, seg_start, i)
+                        seg_start = None
+                i += 1
+                continue
+
+            if self._depth == 0:
+                # Between objects: skip prose until the next object opens
+                if ch == "{":
+                    self._depth = 1
+                    self._expect = "key"
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect == "key":
+                    seg_start = i + 1
+                elif self._depth == 1 and self._expect == "value":
+                    self._start_value("string")
+                    seg_start = i + 1
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 2 and self._expect == "value":
+                    self._start_value("nested")
+                    seg_start = i
+            elif ch in "}]":
+                if self._depth == 1 and self._value_kind == "scalar":
+                    self._finish_value(text, seg_start, i)
+                    seg_start = None
+                self._depth -= 1
+                if self._depth == 1 and self._value_kind == "nested":
+                    self._finish_value(text, seg_start, i + 1)
+                    seg_start = None
+                elif self._depth == 0:
+                    # A brace in the prose lead-in is not the metadata object; keep looking
+                    self.done = bool(self.fields)
+            elif self._depth == 1:
+                if ch == ":" and self._expect == "colon":
+                    self._expect = "value"
+                elif ch == ",":
+                    if self._value_kind == "scalar":
+                        self._finish_value(text, seg_start, i)
+                        seg_start = None
+                    self._expect = "key"
+                elif self._expect == "value" and not ch.isspace():
+                    self._start_value("scalar")
+                    seg_start = i
+            i += 1
+
+        # Carry a partially read key or value over to the next chunk
+        if seg_start is not None:
+            if self._in_string and self._depth == 1 and self._expect == "key":
+                self._key_parts.append(text[seg_start:])
+            elif self._capturing:
+                self._value_parts.append(text[seg_start:])
+        return self._new
+
+    def _start_value(self, kind: str) -> None:
+        self._value_kind = kind
+        self._expect = "comma"
+        self._capturing = self._key in self.watched
+        self._value_parts = []
+
+    def _finish_value(self, text: str, seg_start, end: int) -> None:
+        kind = self._value_kind
+        self._value_kind = None
+        if not self._capturing:
+            return
+        self._capturing = False
+        self._value_parts.append(text[seg_start:end] if seg_start is not None else "")
+        raw = "".join(self._value_parts)
+        self._value_parts = []
+        try:
+            value = json.loads(f'"{raw}"' if kind == "string" else raw.strip())
+        except json.JSONDecodeError:
+            return
+        self.fields[self._key] = value
+        self._new.append((self._key, value))
@@ -0,0 +1,37 @@
+# Background work keyed by session: at most one running task per session and kind of work
+
+import asyncio
+import logging
+from typing import Coroutine, Dict
+
+
+class SessionTasks:
+    """Running background tasks of one kind, by session id.
+
+    Holding the task here also keeps a reference to it, so it is not
+    garbage collected while it runs. Failures are logged, since nothing
+    awaits the task.
+    """
+
+    def __init__(self, name: str, logger: logging.Logger):
+        self.name = name
+        self.logger = logger
+        self._running: Dict[str, asyncio.Task] = {}
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._running
+
+    def start(self, session_id: str, coro: Coroutine) -> bool:
+        """Run `coro` in the background unless a task is already running for the session (then `coro` is closed)."""
+        if session_id in self._running:
+            coro.close()
+            return False
+        task = asyncio.create_task(coro)
+        self._running[session_id] = task
+        task.add_done_callback(lambda t: self._on_done(session_id, t))
+        return True
+
+    def _on_done(self, session_id: str, task: asyncio.Task) -> None:
+        self._running.pop(session_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"{self.name} for session {session_id} failed: {task.exception()}")
@@ -0,0 +1,188 @@
+# Per-request latency breakdown: monotonic spans in a contextvar, reported as Server-Timing and one log line
+
+import os
+import json
+import time
+import logging
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("MedGPT.timeline")
+
+# Environment variables
+TIMELINE_ENABLED = os.getenv("TIMELINE_ENABLED", "1") == "1"
+TIMELINE_SERVER_TIMING = os.getenv("TIMELINE_SERVER_TIMING", "1") == "1"  # send the Server-Timing header to clients
+TIMELINE_PATHS = tuple(p for p in os.getenv("TIMELINE_PATHS", "/chat,/chat/stream").split(",") if p)
+
+
+class Timeline:
+    """Spans and marks of one request, in milliseconds from its start.
+
+    A span is a named interval ("history", "gemini_connect"); a mark is a
+    point in time ("ttft"). Names may repeat (a fallback records a second
+    provider span); the Server-Timing header sums them. Anything recorded
+    after `finish` is ignored, so late background work cannot skew a
+    request that has already been reported.
+    """
+
+    __slots__ = ("endpoint", "start", "spans", "marks", "fields", "finished_at")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []  # (name, start offset, duration)
+        self.marks: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {}
+        self.finished_at: Optional[float] = None
+
+    def record(self, name: str, started: float, ended: Optional[float] = None) -> None:
+        """Add a span from perf_counter values."""
+        if self.finished_at is None:
+            ended = time.perf_counter() if ended is None else ended
+            self.spans.append((name, (started - self.start) * 1000, (ended - started) * 1000))
+
+    def mark(self, name: str, once: bool = True) -> None:
+        if self.finished_at is None and not (once and name in self.marks):
+            self.marks[name] = (time.perf_counter() - self.start) * 1000
+
+    def elapsed_ms(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def finish(self) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    def totals(self) -> Dict[str, float]:
+        """Duration per span name (repeats summed), then marks, then the total so far."""
+        totals: Dict[str, float] = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        totals.update(self.marks)
+        totals["total"] = self.elapsed_ms()
+        return {name: round(value, 2) for name, value in totals.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={value}" for name, value in self.totals().items())
+
+    def to_log(self) -> Dict[str, Any]:
+        return {
+            "event": "request_timeline",
+            "endpoint": self.endpoint,
+            **self.fields,
+            "total_ms": round(self.elapsed_ms(), 2),
+            "spans": [{"name": n, "start_ms": round(s, 2), "dur_ms": round(d, 2)} for n, s, d in self.spans],
+            "marks": {name: round(value, 2) for name, value in self.marks.items()},
+        }
+
+
+_current: ContextVar[Optional[Timeline]] = ContextVar("medgpt_timeline", default=None)
+
+
+def current_timeline() -> Optional[Timeline]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block as a span of the current request; a no-op outside one."""
+    timeline = _current.get()
+    if timeline is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timeline.record(name, started)
+
+
+def record_span(name: str, started: float) -> None:
+    """Add a span that started at `started` (a perf_counter value) and ends now."""
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.record(name, started)
+
+
+def mark(name: str) -> None:
+    """Record the first time `name` happens in the current request."""
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.mark(name)
+
+
+def annotate(**fields: Any) -> None:
+    """Extra fields for the request's log line (session id, mode, path taken)."""
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.fields.update(fields)
+
+
+def detach_timeline() -> None:
+    """Stop the calling task from recording into the request that started it.
+
+    Tasks copy the context they are created in, so background work spawned
+    by a request (compaction, emergency elaboration) calls this first.
+    """
+    _current.set(None)
+
+
+def timed_handler(endpoint: Callable) -> Callable:
+    """Bracket an endpoint so request parsing and response serialization by FastAPI show up as their own spans."""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        timeline = _current.get()
+        if timeline is not None:
+            timeline.record("receive", timeline.start)
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timeline = _current.get()
+            if timeline is not None:
+                timeline.mark("handler")
+    return wrapper
+
+
+class TimelineMiddleware:
+    """ASGI middleware that gives each request in TIMELINE_PATHS a Timeline.
+
+    The Server-Timing header is added when the response starts, so for
+    /chat it covers the whole request including serialization while for
+    /chat/stream it only covers the work before the first byte; the stream
+    sends its full breakdown as a trailing `timing` event. One structured
+    log line is written when the response body is complete.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not TIMELINE_ENABLED or scope["type"] != "http" or scope["path"] not in TIMELINE_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        timeline = Timeline(scope["path"])
+        token = _current.set(timeline)
+        status = 0
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                handler = timeline.marks.get("handler")
+                if handler is not None:
+                    timeline.spans.append(("serialize", handler, timeline.elapsed_ms() - handler))
+                if TIMELINE_SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timeline.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            timeline.finish()
+            _current.reset(token)
+            logger.info(json.dumps({**timeline.to_log(), "status": status}))
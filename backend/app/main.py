@@ -1,44 +1,39 @@
 import json
+import asyncio
 import logging
-import sys
 import time
-from typing import Dict, List
-from collections import defaultdict
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
 from app.schemas import ChatRequest, ChatResponse
-from app.core.llm import get_llm_response
-from app.core.state import get_session_state
+from app.core.llm import NO_MESSAGE_REPLY, PROCESSING_ERROR_REPLY, get_llm_response, generation_stats
+from app.core.hedging import hedge_stats, ttft_trackers
+from app.core.breaker import STATE_VALUES, breaker_states
+from app.core.state import get_session_record, get_session_state, save_session_state, session_store, match_routing_keywords, SessionState
+from app.core.ratelimit import RequestRateLimiter, get_client_ip
+from app.core.compaction import schedule_compaction
+from app.core.cache import response_cache, cache_key, is_cacheable_request, is_cacheable_response, replay_text
+from app.core.semantic_cache import semantic_cache, is_semantic_request
+from app.core.hospitals import hospital_answer, hospital_cache
+from app.core.safety import detect_red_flag, emergency_message, emergency_turn, schedule_elaboration, RedFlagMatch
+from app.core.timeline import TimelineMiddleware, annotate, current_timeline, record_span, span, timed_handler
+from app.core.logs import capture_debug, logging_stats, setup_logging
+from app.core.looplag import loop_monitor
+from app.core.scheduler import PRIORITY_EMERGENCY, PRIORITY_INTERACTIVE, ollama_scheduler
+from app.core.overload import OVERLOAD_RESPONSE, check_overload, record_shed
+from app.core.metrics import ACTIVE_STREAMS, CONTENT_TYPE, PARSE_FAILURES, RATE_LIMITED, GaugeFunc, process_stats, registry, render_metrics
+from typing import Any, Dict, Optional, Tuple
 
 # --- Configuration ---
-# Simple in-memory state for demonstration, in prod use Redis/DB
-session_store = {}
+# Conversations live in the backend chosen by SESSION_BACKEND (see app/core/state.py)
 
 # --- Logging Setup ---
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    stream=sys.stdout
-)
+# Records are written by a background thread (see app/core/logs.py for LOG_* settings)
+setup_logging()
 logger = logging.getLogger("MedGPT")
 
 # --- Rate Limiter ---
-class RateLimiter:
-    def __init__(self, limit=10, window=60):
-        self.limit = limit
-        self.window = window
-        self.requests: Dict[str, List[float]] = defaultdict(list)
-
-    def is_allowed(self, key: str) -> bool:
-        now = time.time()
-        # Filter out old timestamps
-        self.requests[key] = [t for t in self.requests[key] if now - t < self.window]
-        if len(self.requests[key]) >= self.limit:
-            return False
-        self.requests[key].append(now)
-        return True
-
-limiter = RateLimiter(limit=15, window=60) # 15 requests per minute
+# Per-session and per-client-IP limits (see app/core/ratelimit.py for RATE_LIMIT_* settings)
+limiter = RequestRateLimiter()
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -52,79 +47,276 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
+app.add_middleware(TimelineMiddleware)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    session_store.start()
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await loop_monitor.stop()
+    await session_store.stop()
+    await asyncio.to_thread(semantic_cache.close)
 
 # --- Endpoints ---
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "sessions": session_store.stats(),
+        "rate_limiter": limiter.stats(),
+        "generations": generation_stats.snapshot(),
+        "hedging": {**hedge_stats.snapshot(), "delay_s": round(ttft_trackers["gemini"].hedge_delay(), 3)},
+        "breakers": breaker_states(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "hospital_cache": hospital_cache.stats(),
+        "process": process_stats(),
+        "logging": logging_stats(),
+        "event_loop": loop_monitor.stats(),
+        "ollama_queue": ollama_scheduler.stats(),
+    }
+
+registry.register(GaugeFunc(
+    "medgpt_sessions", "Conversations held by the session store.", (),
+    lambda: [((), session_store.stats()["sessions"])]))
+registry.register(GaugeFunc(
+    "medgpt_queue_depth", "Requests waiting for a local model slot, by priority.", ("provider", "priority"),
+    lambda: [((ollama_scheduler.name, priority), depth) for priority, depth in ollama_scheduler.depth().items()]))
+registry.register(GaugeFunc(
+    "medgpt_slots_in_use", "Local model slots held by running generations.", ("provider",),
+    lambda: [((ollama_scheduler.name,), ollama_scheduler.active)]))
+registry.register(GaugeFunc(
+    "medgpt_breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open.", ("provider", "model"),
+    lambda: [((b["provider"], b["model"]), STATE_VALUES[b["state"]]) for b in breaker_states()]))
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
 
 from fastapi.responses import StreamingResponse
 from app.core.llm import get_llm_response_stream, ensure_json_response
+from app.core.streaming import JsonInterceptor
+from app.core.sse import SSE_HEADERS, STREAM_DISCONNECT_POLL, format_sse, replay_registry
+
+EMERGENCY_LOCK_MESSAGE = "⚠️ An emergency was detected in this conversation. Please seek immediate medical attention by calling emergency services or visiting the nearest hospital.\n\nIf you need to find nearby hospitals, please ask 'Find hospitals near me' or start a new chat for other questions."
+
+def _route_request(request: ChatRequest, state: SessionState) -> bool:
+    """Pick the mode for this turn from the session state and the message.
+
+    Returns False when the session is locked in emergency mode and the message
+    is not asking for help; only hospital search is allowed then.
+    """
+    asks_search, seeking_help = match_routing_keywords(request.message)
+    if state.is_emergency:
+        if not seeking_help:
+            return False
+        request.mode = "hospital_search"
+    elif asks_search and request.mode != "hospital_search":
+        logger.info(f"Auto-switching to hospital_search mode for session {request.session_id}")
+        request.mode = "hospital_search"
+    return True
+
+def _lookup_cached_answer(request: ChatRequest, history: list) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """(whether this turn may be cached, a cached answer or None).
+
+    The exact-match cache is tried first, then the semantic cache for paraphrases.
+    """
+    exact = is_cacheable_request(history, request.mode, request.image)
+    semantic = is_semantic_request(history, request.mode, request.image)
+    if exact:
+        cached = response_cache.get(cache_key(request.message, request.mode))
+        if cached:
+            return True, cached
+    if semantic:
+        found = semantic_cache.lookup(request.message, request.mode)
+        if found:
+            logger.info(json.dumps({"event": "semantic_cache_hit", "session_id": request.session_id, "similarity": round(found[1], 3)}))
+            return True, found[0]
+    return exact or semantic, None
+
+def _store_cached_answer(request: ChatRequest, answer: Dict[str, Any]) -> None:
+    if not is_cacheable_response(answer):
+        return
+    if is_cacheable_request([], request.mode, None):
+        response_cache.put(cache_key(request.message, request.mode), answer)
+    if is_semantic_request([], request.mode, None):
+        semantic_cache.store(request.message, request.mode, answer)
+
+def _llm_priority(state: SessionState, red_flag: Optional[RedFlagMatch] = None) -> int:
+    """Sessions in emergency mode and red-flag turns go first in the local model queue."""
+    return PRIORITY_EMERGENCY if red_flag or state.is_emergency else PRIORITY_INTERACTIVE
+
+def _red_flag_fast_path(request: ChatRequest) -> Optional[RedFlagMatch]:
+    """A confident red-flag match means emergency guidance goes out before the model is asked."""
+    if request.mode == "hospital_search":
+        return None
+    match = detect_red_flag(request.message)
+    if match is None or not match.confident:
+        return None
+    logger.warning(json.dumps({"event": "red_flag_fast_path", "flag": match.flag, "session_id": request.session_id}))
+    return match
 
 @app.post("/chat/stream")
-async def chat_stream_endpoint(request: ChatRequest):
-    """Streaming endpoint for faster perceived response."""
+@timed_handler
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """Streaming endpoint for faster perceived response.
+
+    Emits SSE events: `token` ({"text"}), `metadata` ({"urgency", "stage", "data"}),
+    `error` ({"message"}), `timing` (milliseconds per step, see app/core/timeline.py)
+    and a final `done`. A client that loses the connection can
+    re-send the request with `Last-Event-ID` to resume the same generation.
+    """
+    # Resume: replay buffered events instead of running the LLM again
+    last_event_id = http_request.headers.get("last-event-id")
+    if last_event_id:
+        resumed = replay_registry.resume(request.session_id, last_event_id)
+        if resumed is None:
+            async def expired_gen():
+                yield format_sse("error", {"message": "This response is no longer available. Please send your message again.", "code": "resume_expired"}, "0")
+                yield format_sse("done", {}, "0")
+            return StreamingResponse(expired_gen(), media_type="text/event-stream", headers=SSE_HEADERS)
+        run, seen_seq = resumed
+        return StreamingResponse(run.follow(seen_seq, http_request.is_disconnected), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    annotate(session_id=request.session_id, mode=request.mode)
+
     # Rate check
-    if not limiter.is_allowed(request.session_id):
+    with span("rate_limit"):
+        rejected_by = limiter.check(get_client_ip(http_request), request.session_id)
+    if rejected_by:
+        RATE_LIMITED.labels("chat_stream", rejected_by).inc()
+        annotate(path="rate_limited")
         async def rate_limit_gen():
-            yield json.dumps({"message": "You are sending messages too quickly. Please wait.", "stage": "interview", "urgency": "Low"})
-        return StreamingResponse(rate_limit_gen(), media_type="text/event-stream")
-
-    history = session_store.get(request.session_id, [])
-    
-    async def stream_generator():
+            yield format_sse("token", {"text": "You are sending messages too quickly. Please wait."}, "0")
+            yield format_sse("metadata", {"urgency": "Low", "stage": "interview", "data": None}, "0")
+            yield format_sse("done", {}, "0")
+        return StreamingResponse(rate_limit_gen(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    with span("history"):
+        history = get_session_state(request.session_id)
+        state = get_session_record(request.session_id, history)
+    if not _route_request(request, state):
+        annotate(path="locked")
+        async def locked_gen():
+            yield format_sse("token", {"text": EMERGENCY_LOCK_MESSAGE}, "0")
+            yield format_sse("metadata", {"urgency": "High", "stage": "emergency", "data": None}, "0")
+            yield format_sse("done", {}, "0")
+        return StreamingResponse(locked_gen(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    run = replay_registry.start(request.session_id)
+
+    async def produce():
         # --- STRICT INTERCEPTION FOR QUICK ACTION ---
         if not history and request.message.strip().lower() == "can you explain this simply?":
             response_text = "yes i would love to explain things in short and easily understandable way what is the thing you need explanation with?"
-            yield response_text
+            run.emit("token", {"text": response_text})
+            annotate(path="quick_action")
             
             # Record in history
             history.append({"role": "user", "content": request.message})
             history.append({"role": "assistant", "content": response_text})
-            session_store[request.session_id] = history
+            state.record_turn(request.message, response_text, "interview", "Low", request.mode)
+            save_session_state(request.session_id, history, state)
             
             # Send completion metadata
-            yield f"\nMETADATA:{json.dumps({'urgency': 'Low', 'stage': 'interview', 'data': None})}"
+            run.emit("metadata", {"urgency": "Low", "stage": "interview", "data": None})
             return
         # ---------------------------------------------
 
-        full_content = ""
-        is_json_suppressed = False
+        interceptor = JsonInterceptor()
+        early_metadata_sent = False
+        any_visible = False
+
+        # --- RED-FLAG FAST PATH ---
+        # Emergency guidance is sent and saved before the model starts; its answer follows as elaboration.
+        # The turn is not marked as the emergency stage (which locks the chat) until the model agrees.
+        red_flag = _red_flag_fast_path(request)
+        if red_flag:
+            annotate(path="red_flag")
+            guidance = emergency_message(red_flag)
+            run.emit("metadata", {"urgency": "High", "stage": "interview", "data": None})
+            run.emit("token", {"text": guidance})
+            prior = list(history)
+            state.record_turn(request.message, guidance, "interview", "High", request.mode)
+            save_session_state(request.session_id, prior + emergency_turn(request.message, guidance), state)
+
+        # --- CACHED ANSWERS ---
+        # Hospital lists come from the per-location cache; stateless first-turn questions
+        # from the response caches. Both are replayed at a reading pace.
+        cacheable, cached = False, None
+        with span("cache"):
+            if request.mode == "hospital_search":
+                cached = await hospital_answer(request.message, _llm_priority(state, red_flag))
+            elif not red_flag:
+                cacheable, cached = _lookup_cached_answer(request, history)
+        if cached:
+            annotate(path="cache")
+            async for text in replay_text(cached["message"]):
+                run.emit("token", {"text": text})
+            history.append({"role": "user", "content": request.message})
+            history.append({"role": "assistant", "content": cached["message"]})
+            state.record_turn(request.message, cached["message"], cached["stage"], cached["urgency"], request.mode)
+            save_session_state(request.session_id, history, state)
+            run.emit("metadata", {"urgency": cached["urgency"], "stage": cached["stage"], "data": cached["data"]})
+            return
         
+        # --- LOAD SHEDDING ---
+        # With Gemini out and the local queue saturated, say so now instead of timing out later.
+        # Red-flag turns are emergency priority and never shed. The status is already sent, so
+        # the notice goes out in the stream whatever OVERLOAD_RESPONSE says.
+        overload = check_overload(_llm_priority(state, red_flag))
+        if overload:
+            annotate(path="shed")
+            record_shed("chat_stream", overload, request.session_id)
+            run.emit("token", {"text": overload.message})
+            run.emit("metadata", {"urgency": "Low", "stage": "interview", "data": None})
+            return
+
         # 1. Start streaming from LLM
+        if not red_flag:
+            annotate(path="llm")
+        llm_started = time.perf_counter()
         async for chunk in get_llm_response_stream(
             history, 
             request.message, 
             mode=request.mode, 
             image=request.image, 
-            mime_type=request.mime_type
+            mime_type=request.mime_type,
+            priority=_llm_priority(state, red_flag),
         ):
-            full_content += chunk
-            
             # --- FIRST-BRACE INTERCEPTOR ---
-            # If we detect a '{', we assume a JSON block has started and stop yielding to user.
-            if not is_json_suppressed:
-                if "{" in full_content:
-                    is_json_suppressed = True
-                    # Yield everything PRIOR to the '{'
-                    previously_yielded_len = len(full_content) - len(chunk)
-                    tag_index = full_content.find("{")
-                    if tag_index > previously_yielded_len:
-                        yield full_content[previously_yielded_len:tag_index]
-                    continue
-
-            if not is_json_suppressed:
-                yield chunk
+            # Once a '{' appears, a JSON block has started and nothing more is sent to the user.
+            visible = interceptor.feed(chunk)
+            if visible:
+                if red_flag and not any_visible:
+                    visible = "\n\n" + visible
+                any_visible = True
+                run.emit("token", {"text": visible})
+
+            # --- EARLY EMERGENCY SIGNAL ---
+            # Push metadata as soon as the model commits to the emergency stage so the UI
+            # can switch to the emergency state without waiting for the rest of the JSON.
+            if not early_metadata_sent and interceptor.fields.get("stage") == "emergency":
+                early_metadata_sent = True
+                run.emit("metadata", {"urgency": "High", "stage": "emergency", "data": interceptor.fields.get("data")})
+
+        record_span("llm", llm_started)
 
         # 2. After stream finishes, parse for metadata and update history
         # Robustly extract JSON even if tags are present
-        final_json_str = ensure_json_response(full_content)
+        parse_started = time.perf_counter()
+        final_json_str = ensure_json_response(interceptor.text())
         try:
             parsed = json.loads(final_json_str)
-            message_content = parsed.get("message") or parsed.get("response") or "Internal processing error."
+            message_content = parsed.get("message") or parsed.get("response") or PROCESSING_ERROR_REPLY
             
             # Handle summary formatted responses (DeepSeek style)
             if parsed.get("stage") == "summary" and "summary" in parsed:
@@ -141,32 +333,101 @@ async def chat_stream_endpoint(request: ChatRequest):
                         formatted_summary += "\n"
                     message_content += formatted_summary
 
-            history.append({"role": "user", "content": request.message})
-            history.append({"role": "assistant", "content": message_content})
-            session_store[request.session_id] = history
+            # The model answered with bare JSON: the user has seen nothing yet
+            if not any_visible:
+                run.emit("token", {"text": ("\n\n" if red_flag else "") + message_content})
+
+            if red_flag:
+                # The fast-path turn is already saved; fold the model's answer into it, which decides the stage
+                turn = emergency_turn(request.message, f"{guidance}\n\n{message_content}")
+                history[:] = prior + turn
+                state.extend_reply(message_content, stage=parsed.get("stage") or "interview")
+            else:
+                history.append({"role": "user", "content": request.message})
+                history.append({"role": "assistant", "content": message_content})
+                state.record_turn(request.message, message_content, parsed.get("stage") or "interview", parsed.get("urgency") or "Low", request.mode)
+            record_span("parse", parse_started)
+            with span("save"):
+                save_session_state(request.session_id, history, state)
+                schedule_compaction(request.session_id, history)
+
+            if cacheable:
+                _store_cached_answer(request, {
+                    "stage": parsed.get("stage", "interview"),
+                    "urgency": parsed.get("urgency", "Low"),
+                    "message": message_content,
+                    "confidence": parsed.get("confidence", 0.0),
+                    "data": parsed.get("data"),
+                })
             
-            # We also send the final metadata as a special JSON chunk at the end
-            # This allows the frontend to update urgency/stage
-            yield f"\nMETADATA:{json.dumps({'urgency': parsed.get('urgency', 'Low'), 'stage': parsed.get('stage', 'interview'), 'data': parsed.get('data')})}"
+            # Final metadata lets the frontend update urgency/stage
+            if red_flag:
+                run.emit("metadata", {"urgency": "High", "stage": parsed.get("stage", "interview"), "data": parsed.get("data")})
+            else:
+                run.emit("metadata", {"urgency": parsed.get("urgency", "Low"), "stage": parsed.get("stage", "interview"), "data": parsed.get("data")})
             
         except Exception as e:
             logger.error(f"Stream finalizing error: {e}")
+            PARSE_FAILURES.labels("finalize").inc()
+            # After the fast path the guidance already went out and was saved
+            if not red_flag:
+                run.emit("error", {"message": "Internal processing error. Please repeat."})
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    async def run_producer():
+        ACTIVE_STREAMS.inc()
+        try:
+            await produce()
+        except asyncio.CancelledError:
+            logger.info(json.dumps({"event": "stream_abandoned", "session_id": request.session_id}))
+        except Exception as e:
+            logger.error(f"Stream producer error: {e}")
+            run.emit("error", {"message": "An unexpected error occurred. Please try again."})
+        finally:
+            ACTIVE_STREAMS.dec()
+            timeline = current_timeline()
+            if timeline is not None:
+                run.emit("timing", timeline.totals())
+            run.emit("done", {})
+
+    # Generation runs independently of this connection so a reconnect can pick it up;
+    # it is cancelled once no client has been following it for STREAM_CANCEL_GRACE seconds
+    run.task = asyncio.create_task(run_producer())
+    return StreamingResponse(run.follow(0, http_request.is_disconnected), media_type="text/event-stream", headers=SSE_HEADERS)
+
+class ClientDisconnected(Exception):
+    pass
+
+async def _unless_disconnected(http_request: Request, coro):
+    """Await `coro`, cancelling it (and the upstream LLM call inside it) if the client goes away."""
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=STREAM_DISCONNECT_POLL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+@timed_handler
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     start_time = time.time()
     
     # 1. Rate Check
     if request.image:
-        print(f"DEBUG: Endpoint received image. Size: {len(request.image)} chars. Mime: {request.mime_type}")
-    else:
-        print("DEBUG: No image in request.")
-
-    if not limiter.is_allowed(request.session_id):
+        logger.debug("Request with image: %d base64 chars, %s", len(request.image), request.mime_type)
+
+    annotate(session_id=request.session_id, mode=request.mode)
+    with span("rate_limit"):
+        rejected_by = limiter.check(get_client_ip(http_request), request.session_id)
+    if rejected_by:
+        RATE_LIMITED.labels("chat", rejected_by).inc()
+        annotate(path="rate_limited")
         logger.warning(json.dumps({
             "event": "rate_limit_exceeded",
+            "scope": rejected_by,
             "session_id": request.session_id,
         }))
         # Return a polite error equivalent to a ChatResponse or 429
@@ -184,47 +445,92 @@ async def chat_endpoint(request: ChatRequest):
         )
 
 
-    # 2. Retrieve conversation history
-    history = session_store.get(request.session_id, [])
-    
-    # 2a. Check if session is in emergency state
-    # If in emergency state, only allow hospital search or new session
-    is_emergency_session = False
-    if history:
-        last_assistant_msg = next((msg for msg in reversed(history) if msg["role"] == "assistant"), None)
-        if last_assistant_msg and "STAGE: emergency" in last_assistant_msg.get("content", ""):
-            is_emergency_session = True
-            
-            # Check if user is asking for hospital/help - allow this
-            user_msg_lower = request.message.lower()
-            hospital_keywords = ["hospital", "emergency", "doctor", "clinic", "medical center", "help", "where"]
-            is_seeking_help = any(keyword in user_msg_lower for keyword in hospital_keywords)
-            
-            if not is_seeking_help:
-                # Block non-help queries after emergency
-                return ChatResponse(
-                    stage="emergency",
-                    urgency="High",
-                    message="⚠️ An emergency was detected in this conversation. Please seek immediate medical attention by calling emergency services or visiting the nearest hospital.\n\nIf you need to find nearby hospitals, please ask 'Find hospitals near me' or start a new chat for other questions.",
-                    confidence=0.0
-                )
-            else:
-                # User is seeking help - switch to hospital_search mode
-                request.mode = "hospital_search"
+    # 2. Retrieve conversation history and session state
+    with span("history"):
+        history = get_session_state(request.session_id)
+        state = get_session_record(request.session_id, history)
 
-    # 2b. Auto-detect hospital search mode if not already set
-    hospital_keywords = ["hospital", "emergency center", "medical center", "clinic", "where is the nearest", "hospitals in"]
-    if request.mode != "hospital_search" and any(keyword in request.message.lower() for keyword in hospital_keywords):
-        logger.info(f"Auto-switching to hospital_search mode for session {request.session_id}")
-        request.mode = "hospital_search"
+    # 2a. Route: a session in emergency state only allows hospital search (or a new session);
+    # otherwise hospital questions switch to hospital_search mode
+    if not _route_request(request, state):
+        annotate(path="locked")
+        return ChatResponse(
+            stage="emergency",
+            urgency="High",
+            message=EMERGENCY_LOCK_MESSAGE,
+            confidence=0.0
+        )
+
+    # 2b. Red-flag fast path: answer with emergency guidance now, let the model elaborate in the background.
+    # The session is only locked in the emergency stage if the model's elaboration agrees.
+    red_flag = _red_flag_fast_path(request)
+    if red_flag:
+        annotate(path="red_flag")
+        guidance = emergency_message(red_flag)
+        prior = list(history)
+        state.record_turn(request.message, guidance, "interview", "High", request.mode)
+        save_session_state(request.session_id, prior + emergency_turn(request.message, guidance), state)
+        schedule_elaboration(request.session_id, prior, request.message, request.mode)
+        return ChatResponse(
+            stage="interview",
+            urgency="High",
+            message=guidance,
+            confidence=0.95
+        )
 
+    # 2c. Cached answers: hospital lists per location, stateless first-turn questions
+    cacheable, cached = False, None
+    cache_started = time.perf_counter()
+    if request.mode == "hospital_search":
+        try:
+            # Concurrent searches for one location share a single generation
+            cached = await _unless_disconnected(http_request, hospital_answer(request.message, _llm_priority(state)))
+        except ClientDisconnected:
+            logger.info(json.dumps({"event": "client_disconnected", "session_id": request.session_id}))
+            return Response(status_code=499)
+    else:
+        cacheable, cached = _lookup_cached_answer(request, history)
+    record_span("cache", cache_started)
+    if cached:
+        annotate(path="cache")
+        history.append({"role": "user", "content": request.message})
+        history.append({"role": "assistant", "content": cached["message"]})
+        state.record_turn(request.message, cached["message"], cached["stage"], cached["urgency"], request.mode)
+        save_session_state(request.session_id, history, state)
+        logger.info(json.dumps({"event": "cached_answer", "session_id": request.session_id, "mode": request.mode}))
+        return ChatResponse(**cached)
+
+
+    # 2d. Load shedding: with Gemini out and the local queue saturated, answer now instead of timing out later.
+    # Not saved to the history, so sending the message again later is a normal turn.
+    overload = check_overload(_llm_priority(state))
+    if overload:
+        annotate(path="shed")
+        record_shed("chat", overload, request.session_id)
+        if OVERLOAD_RESPONSE == "503":
+            raise HTTPException(status_code=503, detail=overload.message, headers={"Retry-After": str(overload.retry_after)})
+        return ChatResponse(
+            stage="interview",
+            urgency="Low",
+            message=overload.message,
+            confidence=0.0
+        )
 
     # 3. Get LLM response with Timeout/Error Handling
+    annotate(path="llm")
+    llm_started = time.perf_counter()
     try:
         # get_llm_response internally handles generic exceptions and returns a JSON error string
         # but we wrap it here to catch any unexpected runtime errors in the orchestration layer
-        llm_raw_response = await get_llm_response(history, request.message, mode=request.mode, image=request.image, mime_type=request.mime_type)
+        llm_raw_response = await _unless_disconnected(
+            http_request,
+            get_llm_response(history, request.message, mode=request.mode, image=request.image, mime_type=request.mime_type, priority=_llm_priority(state)),
+        )
+    except ClientDisconnected:
+        logger.info(json.dumps({"event": "client_disconnected", "session_id": request.session_id}))
+        return Response(status_code=499)
     except Exception as e:
+        record_span("llm", llm_started)
         logger.error(json.dumps({
             "event": "llm_error",
             "element": "execution_fail",
@@ -238,14 +544,16 @@ async def chat_endpoint(request: ChatRequest):
             confidence=0.0
         )
     
+    record_span("llm", llm_started)
+    parse_started = time.perf_counter()
+
     try:
         # 4. Parse JSON
         # The llm_raw_response should already be cleaned by ensure_json_response
         parsed_response = json.loads(llm_raw_response)
         
-        # DEBUG: Write parsed response to file
-        with open("debug_response.txt", "w") as f:
-            f.write(json.dumps(parsed_response, indent=2))
+        # Kept per session in LOG_DEBUG_CAPTURE_DIR when set, written off the event loop
+        capture_debug(request.session_id, parsed_response)
         
         # 5. Context & History Update
         message_content = (
@@ -262,7 +570,8 @@ async def chat_endpoint(request: ChatRequest):
                     break
         
         if not message_content:
-            message_content = "I apologize, but I'm having trouble formulating a response. Could you rephrase your question?"
+            PARSE_FAILURES.labels("no_message").inc()
+            message_content = NO_MESSAGE_REPLY
         
         # Validate and fix urgency
         urgency = parsed_response.get("urgency", "Low")
@@ -288,7 +597,11 @@ async def chat_endpoint(request: ChatRequest):
         
         history.append({"role": "user", "content": request.message})
         history.append({"role": "assistant", "content": assistant_context})
-        session_store[request.session_id] = history
+        state.record_turn(request.message, assistant_context, parsed_response.get("stage") or "interview", urgency, request.mode)
+        record_span("parse", parse_started)
+        with span("save"):
+            save_session_state(request.session_id, history, state)
+            schedule_compaction(request.session_id, history)
 
         # 6. Logging
         logger.info(json.dumps({
@@ -317,15 +630,19 @@ async def chat_endpoint(request: ChatRequest):
             except Exception as e:
                 logger.error(f"Failed to parse stringified hospital list: {e}")
 
-        return ChatResponse(
+        response = ChatResponse(
             stage=parsed_response.get("stage", "interview"),
             urgency=parsed_response.get("urgency", "Low"),
             message=message_content,
             confidence=parsed_response.get("confidence", 0.0),
             data=data
         )
+        if cacheable:
+            _store_cached_answer(request, response.model_dump())
+        return response
         
     except json.JSONDecodeError:
+        PARSE_FAILURES.labels("decode").inc()
         logger.error(json.dumps({
             "event": "json_parse_error",
             "session_id": request.session_id,
@@ -0,0 +1,441 @@
+"""Load benchmark for /chat and /chat/stream.
+
+    python -m bench_load --concurrency 16 --requests 400 --out run.json
+    python -m bench_load --concurrency 16 --duration 60 --baseline run.json   # run and compare
+    python -m bench_load --compare before.json after.json                    # compare two saved runs
+
+Requests are drawn from a weighted message mix (the built-in DEFAULT_MIX
+or a JSON file of {"message", "mode", "weight"} objects) with a fixed
+seed, split between the two endpoints by --stream-ratio. With --sessions N
+they rotate through N session ids so conversations build up history;
+the default sends every request on a fresh session. --vary appends the
+request number to each message so the response caches do not answer it.
+
+Reported per endpoint: TTFT (first `token` event; /chat has none) and
+total latency percentiles, output tokens/s, and the share of requests
+that errored, were rate limited or got a degraded answer (shed requests
+count as degraded). The backend's /health is polled during the run for
+resident memory and, before and after, for how many generations were
+answered by Ollama, by fallback or by winning a hedge.
+
+For numbers about the backend rather than the providers, run it against
+mock_provider.py and with RATE_LIMIT_IP=0 RATE_LIMIT_SESSION=0.
+"""
+
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import platform
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+CHARS_PER_TOKEN = 4  # same estimate the backend uses
+
+DEFAULT_MIX = [
+    {"message": "Hi there", "mode": "quick_triage", "weight": 1},
+    {"message": "What is GERD?", "mode": "detailed_explanation", "weight": 2},
+    {"message": "Explain type 2 diabetes", "mode": "detailed_explanation", "weight": 2},
+    {"message": "What causes migraines?", "mode": "detailed_explanation", "weight": 1},
+    {"message": "I have had a headache for three days", "mode": "quick_triage", "weight": 3},
+    {"message": "My child has a fever and a sore throat", "mode": "quick_triage", "weight": 2},
+    {"message": "I feel anxious about my blood test results", "mode": "reassurance", "weight": 1},
+    {"message": "Find hospitals in Pune", "mode": "hospital_search", "weight": 1},
+    {"message": "I have crushing chest pain", "mode": "quick_triage", "weight": 0.5},
+]
+
+# Replies the backend gives instead of an answer
+RATE_LIMITED_PREFIX = "You are sending messages too quickly"
+DEGRADED_PREFIXES = (
+    "I'm having trouble",
+    "I apologize, but I'm having trouble",
+    "Internal processing error",
+    "An unexpected error occurred",
+    "I'm receiving more questions than I can answer right now",  # load shed (OVERLOAD_RESPONSE=degraded)
+)
+
+# Lower is better unless listed in HIGHER_IS_BETTER
+COMPARED_METRICS = [
+    "ttft_ms.p50", "ttft_ms.p95", "ttft_ms.p99",
+    "total_ms.p50", "total_ms.p95", "total_ms.p99",
+    "throughput_rps", "tokens_per_s.aggregate", "error_rate", "degraded_rate",
+]
+HIGHER_IS_BETTER = {"throughput_rps", "tokens_per_s.aggregate"}
+RATE_METRICS = {"error_rate", "degraded_rate"}
+
+
+# --- measurement ---
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q in 0..100) of `values`, None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    result = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+    result["mean"] = sum(values) / len(values) if values else None
+    result["max"] = max(values) if values else None
+    return {k: round(v, 1) if v is not None else None for k, v in result.items()}
+
+
+def classify(status: int, text: str, sse_error: bool = False) -> str:
+    if status == 503:
+        # Load shed with OVERLOAD_RESPONSE=503: turned away on purpose, like the in-band notice
+        return "degraded"
+    if status != 200 or sse_error:
+        return "error"
+    if text.startswith(RATE_LIMITED_PREFIX):
+        return "rate_limited"
+    if text.lstrip().startswith(DEGRADED_PREFIXES):
+        return "degraded"
+    return "ok"
+
+
+async def send_chat(client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    response = await client.post("/chat", json=payload)
+    total = time.perf_counter() - start
+    text = response.json().get("message", "") if response.status_code == 200 else ""
+    return {
+        "outcome": classify(response.status_code, text),
+        "status": response.status_code,
+        "ttft_ms": None,
+        "total_ms": total * 1000,
+        "chars": len(text),
+        "gen_s": total,
+    }
+
+
+async def send_stream(client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    first_token: Optional[float] = None
+    parts: List[str] = []
+    sse_error = False
+    event = None
+    async with client.stream("POST", "/chat/stream", json=payload) as response:
+        status = response.status_code
+        if status == 200:
+            async for line in response.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event == "token":
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    parts.append(json.loads(line[5:]).get("text", ""))
+                elif line.startswith("data:") and event == "error":
+                    sse_error = True
+                elif line.startswith("data:") and event == "done":
+                    break
+    end = time.perf_counter()
+    text = "".join(parts)
+    return {
+        "outcome": classify(status, text, sse_error),
+        "status": status,
+        "ttft_ms": (first_token - start) * 1000 if first_token else None,
+        "total_ms": (end - start) * 1000,
+        "chars": len(text),
+        "gen_s": end - (first_token or start),
+    }
+
+
+def summarize(samples: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    n = len(samples)
+    outcomes: Dict[str, int] = {}
+    for s in samples:
+        outcomes[s["outcome"]] = outcomes.get(s["outcome"], 0) + 1
+    answered = [s for s in samples if s["outcome"] == "ok"]
+    tokens = sum(s["chars"] for s in answered) / CHARS_PER_TOKEN
+    per_request = [s["chars"] / CHARS_PER_TOKEN / s["gen_s"] for s in answered if s["gen_s"] > 0 and s["chars"]]
+    return {
+        "requests": n,
+        "outcomes": outcomes,
+        "error_rate": round(outcomes.get("error", 0) / n, 4) if n else 0.0,
+        "degraded_rate": round(outcomes.get("degraded", 0) / n, 4) if n else 0.0,
+        "rate_limited_rate": round(outcomes.get("rate_limited", 0) / n, 4) if n else 0.0,
+        "throughput_rps": round(n / wall_s, 2) if wall_s else 0.0,
+        "ttft_ms": distribution([s["ttft_ms"] for s in answered if s["ttft_ms"] is not None]),
+        "total_ms": distribution([s["total_ms"] for s in answered]),
+        "tokens_per_s": {
+            "aggregate": round(tokens / wall_s, 1) if wall_s else 0.0,
+            "per_request_p50": round(percentile(per_request, 50), 1) if per_request else None,
+        },
+    }
+
+
+# --- backend probes ---
+
+async def fetch_health(client: httpx.AsyncClient) -> Optional[Dict[str, Any]]:
+    try:
+        response = await client.get("/health", timeout=5.0)
+        return response.json() if response.status_code == 200 else None
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def served_by_fallback(health: Dict[str, Any]) -> Dict[str, int]:
+    """Generation counters; Ollama answers after Gemini failed or was skipped and Ollama hedge wins are counted apart."""
+    generations = health.get("generations", {})
+    wins = health.get("hedging", {}).get("wins", {})
+    return {
+        "generations": generations.get("completed", 0) + generations.get("cancelled", 0),
+        "fallbacks": generations.get("fallbacks", 0),
+        "hedge_wins": wins.get("ollama", 0),
+    }
+
+
+async def sample_rss(client: httpx.AsyncClient, interval: float, samples: List[int], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        health = await fetch_health(client)
+        rss = (health or {}).get("process", {}).get("rss_bytes")
+        if rss:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+# --- driver ---
+
+def load_mix(path: Optional[str]) -> List[Dict[str, Any]]:
+    if not path:
+        return DEFAULT_MIX
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    mix = load_mix(args.mix)
+    weights = [item.get("weight", 1) for item in mix]
+    rng = random.Random(args.seed)
+    run_id = uuid.uuid4().hex[:8]
+    sessions = [f"bench-{run_id}-{i}" for i in range(args.sessions)]
+    counter = 0
+
+    def next_request() -> Dict[str, Any]:
+        nonlocal counter
+        counter += 1
+        item = rng.choices(mix, weights)[0]
+        message = f"{item['message']} (request {counter})" if args.vary else item["message"]
+        session = sessions[counter % len(sessions)] if sessions else f"bench-{run_id}-n{counter}"
+        return {
+            "endpoint": "stream" if rng.random() < args.stream_ratio else "chat",
+            "payload": {"session_id": session, "message": message, "mode": item.get("mode", "quick_triage")},
+        }
+
+    limits = httpx.Limits(max_connections=args.concurrency + 2, max_keepalive_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        before = await fetch_health(client)
+        if before is None:
+            print(f"warning: {args.url}/health is not reachable; backend stats will be missing", file=sys.stderr)
+
+        for _ in range(args.warmup):
+            request = next_request()
+            try:
+                await (send_stream if request["endpoint"] == "stream" else send_chat)(client, request["payload"])
+            except httpx.HTTPError:
+                pass
+
+        samples: List[Dict[str, Any]] = []
+        rss: List[int] = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(client, args.sample_interval, rss, stop))
+        started = time.perf_counter()
+        deadline = started + args.duration if args.duration else None
+        remaining = args.requests
+
+        async def worker() -> None:
+            nonlocal remaining
+            while True:
+                if deadline is not None:
+                    if time.perf_counter() >= deadline:
+                        return
+                elif remaining <= 0:
+                    return
+                else:
+                    remaining -= 1
+                request = next_request()
+                try:
+                    sample = await (send_stream if request["endpoint"] == "stream" else send_chat)(client, request["payload"])
+                except (httpx.HTTPError, json.JSONDecodeError) as e:
+                    sample = {"outcome": "error", "status": 0, "ttft_ms": None, "total_ms": 0.0, "chars": 0, "gen_s": 0.0,
+                              "exception": type(e).__name__}
+                sample["endpoint"] = request["endpoint"]
+                samples.append(sample)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall_s = time.perf_counter() - started
+        stop.set()
+        await sampler
+        after = await fetch_health(client)
+
+    summary = {"all": summarize(samples, wall_s)}
+    for endpoint in ("chat", "stream"):
+        subset = [s for s in samples if s["endpoint"] == endpoint]
+        if subset:
+            summary[endpoint] = summarize(subset, wall_s)
+
+    backend: Dict[str, Any] = {}
+    if before and after:
+        b, a = served_by_fallback(before), served_by_fallback(after)
+        generations = a["generations"] - b["generations"]
+        hedge_wins = a["hedge_wins"] - b["hedge_wins"]
+        # Both mean the answer came from Ollama rather than Gemini
+        fallbacks = a["fallbacks"] - b["fallbacks"] + hedge_wins
+        backend["generations"] = generations
+        backend["fallbacks"] = fallbacks
+        backend["hedge_wins"] = hedge_wins
+        # Background work (emergency elaboration) can still be running when /health is read
+        backend["fallback_rate"] = round(fallbacks / max(generations, fallbacks), 4) if fallbacks else 0.0
+    if rss:
+        backend["rss_bytes"] = {"start": rss[0], "peak": max(rss), "end": rss[-1]}
+    if after and after.get("process", {}).get("peak_rss_bytes"):
+        backend["peak_rss_bytes"] = after["process"]["peak_rss_bytes"]
+
+    return {
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": args.requests if not args.duration else None,
+            "duration_s": args.duration,
+            "sessions": args.sessions,
+            "stream_ratio": args.stream_ratio,
+            "mix": args.mix or "default",
+            "vary": args.vary,
+            "seed": args.seed,
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": platform.node(),
+        "wall_s": round(wall_s, 2),
+        "summary": summary,
+        "backend": backend,
+    }
+
+
+# --- reporting ---
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{result['summary']['all']['requests']} requests in {result['wall_s']}s "
+          f"(concurrency {result['config']['concurrency']})\n")
+    print(f"{'endpoint':10}{'req':>6}{'rps':>8}{'ttft p50':>10}{'p95':>8}{'p99':>8}"
+          f"{'total p50':>11}{'p95':>8}{'p99':>8}{'tok/s':>8}{'err%':>7}{'degr%':>7}{'rl%':>6}")
+    for name, s in result["summary"].items():
+        print(f"{name:10}{s['requests']:>6}{s['throughput_rps']:>8.2f}"
+              f"{_fmt(s['ttft_ms']['p50']):>10}{_fmt(s['ttft_ms']['p95']):>8}{_fmt(s['ttft_ms']['p99']):>8}"
+              f"{_fmt(s['total_ms']['p50']):>11}{_fmt(s['total_ms']['p95']):>8}{_fmt(s['total_ms']['p99']):>8}"
+              f"{s['tokens_per_s']['aggregate']:>8.1f}{s['error_rate'] * 100:>7.1f}"
+              f"{s['degraded_rate'] * 100:>7.1f}{s['rate_limited_rate'] * 100:>6.1f}")
+    backend = result["backend"]
+    if "fallback_rate" in backend:
+        print(f"\nfallback to Ollama: {backend['fallbacks']}/{backend['generations']} generations "
+              f"({backend['fallback_rate'] * 100:.1f}%, {backend.get('hedge_wins', 0)} of them hedge wins)")
+    if "rss_bytes" in backend:
+        mb = {k: v / 2 ** 20 for k, v in backend["rss_bytes"].items()}
+        print(f"backend RSS: start {mb['start']:.1f} MB, peak {mb['peak']:.1f} MB, end {mb['end']:.1f} MB")
+    if result["summary"]["all"]["rate_limited_rate"]:
+        print("note: some requests were rate limited; start the backend with RATE_LIMIT_IP=0 RATE_LIMIT_SESSION=0")
+
+
+def _lookup(stats: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = stats
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], tolerance: float, min_ms: float) -> List[str]:
+    """Print old vs new per endpoint and metric; returns the regressions found.
+
+    Latencies and throughput regress when they move the wrong way by more
+    than `tolerance` (relative) and, for latencies, `min_ms`; error and
+    degraded rates when they grow by more than one percentage point.
+    """
+    regressions = []
+    print(f"{'endpoint':10}{'metric':26}{'old':>10}{'new':>10}{'change':>9}")
+    metrics = [(name, m) for name in new["summary"] if name in old["summary"] for m in COMPARED_METRICS]
+    metrics.append(("backend", "rss_bytes.peak"))
+    for name, metric in metrics:
+        if name == "backend":
+            a, b = _lookup(old["backend"], metric), _lookup(new["backend"], metric)
+        else:
+            a, b = _lookup(old["summary"][name], metric), _lookup(new["summary"][name], metric)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a if a else 0.0
+        if metric in RATE_METRICS:
+            worse = b - a > 0.01
+        elif metric in HIGHER_IS_BETTER:
+            worse = b < a * (1 - tolerance)
+        elif metric.endswith("_bytes.peak"):
+            worse = b > a * (1 + tolerance)
+        else:
+            worse = b > a * (1 + tolerance) and b - a > min_ms
+        flag = "  REGRESSION" if worse else ""
+        if worse:
+            regressions.append(f"{name} {metric}: {a} -> {b}")
+        print(f"{name:10}{metric:26}{a:>10.4g}{b:>10.4g}{change * 100:>8.1f}%{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench_load", description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--warmup", type=int, default=5, help="unrecorded requests sent first")
+    parser.add_argument("--sessions", type=int, default=0, help="session ids to rotate through; 0 = a new one per request")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="share of requests sent to /chat/stream")
+    parser.add_argument("--mix", help="JSON file with a list of {message, mode, weight}")
+    parser.add_argument("--vary", action="store_true", help="make every message unique so caches miss")
+    parser.add_argument("--seed", type=int, default=1165)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between /health RSS samples")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results file to compare this run against")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files and exit")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change allowed before flagging")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="latency change below this is never flagged")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.tolerance, args.min_ms)
+        return 1 if regressions else 0
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nresults written to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            old = json.load(f)
+        print()
+        regressions = compare(old, result, args.tolerance, args.min_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
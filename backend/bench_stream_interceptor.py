@@ -0,0 +1,55 @@
+import time
+from app.core.streaming import JsonInterceptor
+
+# Simulates a long streamed answer: ~1500 output tokens of prose, chunked the way
+# Gemini/Ollama deliver it, followed by the JSON block.
+CHUNK = "word " * 2  # ~2 tokens per streamed chunk
+PROSE_CHUNKS = 6000
+JSON_TAIL = ['{"stage": "interview", ', '"urgency": "Low", ', '"message": "ok", ', '"confidence": 0.9}']
+BUCKETS = 6
+
+
+def legacy_interceptor(chunks):
+    """The old stream_generator logic: string += and a full rescan per chunk."""
+    full_content = ""
+    is_json_suppressed = False
+    timings = []
+    for chunk in chunks:
+        start = time.perf_counter()
+        full_content += chunk
+        if not is_json_suppressed and "{" in full_content:
+            is_json_suppressed = True
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def incremental_interceptor(chunks):
+    interceptor = JsonInterceptor()
+    timings = []
+    for chunk in chunks:
+        start = time.perf_counter()
+        interceptor.feed(chunk)
+        timings.append(time.perf_counter() - start)
+    interceptor.text()
+    return timings
+
+
+def report(name, timings):
+    size = len(timings) // BUCKETS
+    print(f"{name:12}", end="")
+    for b in range(BUCKETS):
+        bucket = timings[b * size:(b + 1) * size]
+        print(f"{sum(bucket) / len(bucket) * 1e9:10.0f}", end="")
+    print(f"   total {sum(timings) * 1e3:.2f}ms")
+
+
+def main():
+    chunks = [CHUNK] * PROSE_CHUNKS + JSON_TAIL
+    print(f"Per-chunk cost in ns, averaged over {BUCKETS} equal slices of a {len(chunks)}-chunk stream")
+    print(f"{'':12}" + "".join(f"{'slice ' + str(b + 1):>10}" for b in range(BUCKETS)))
+    report("legacy", legacy_interceptor(chunks))
+    report("incremental", incremental_interceptor(chunks))
+
+
+if __name__ == "__main__":
+    main()
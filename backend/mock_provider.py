@@ -0,0 +1,337 @@
+"""Deterministic stand-in for the Gemini and Ollama streaming APIs, for offline load testing.
+
+Serves the two endpoints the backend streams from:
+
+    POST /v1beta/models/{model}:streamGenerateContent   (Gemini, JSON array or ?alt=sse)
+    POST /api/chat                                      (Ollama, NDJSON)
+
+Point the backend at it:
+
+    python mock_provider.py --port 11500
+    GEMINI_BASE_URL=http://localhost:11500 GEMINI_API_KEY=mock \\
+    OLLAMA_BASE_URL=http://localhost:11500 python -m uvicorn app.main:app --port 8000
+
+Behaviour is set with MOCK_* environment variables. Each one can be
+overridden per provider with MOCK_GEMINI_* / MOCK_OLLAMA_*
+(e.g. MOCK_GEMINI_429_RATE=0.2), and changed on a running server by
+POSTing a JSON object of the same names without the prefix to /mock/config:
+
+    MOCK_TTFT_MS            delay before the first chunk (default 300 Gemini, 150 Ollama)
+    MOCK_TTFT_JITTER_MS     uniform extra delay added to the TTFT (default 0)
+    MOCK_TOKEN_MS           delay per token after the first chunk (default 10 Gemini, 25 Ollama)
+    MOCK_TOKENS_PER_CHUNK   tokens per streamed chunk (default 12 Gemini, 1 Ollama)
+    MOCK_REPLY_TOKENS       length of the generated default reply (default 180)
+    MOCK_ERROR_RATE         fraction of requests answered with HTTP 500 (default 0)
+    MOCK_429_RATE           fraction of requests answered with HTTP 429 (default 0)
+    MOCK_ABORT_RATE         fraction of streams cut off halfway through (default 0)
+    MOCK_SEED               seed for jitter and fault injection (default 1165)
+    MOCK_RESPONSES          path to a JSON file of canned replies (see below)
+
+A token is one whitespace-separated word. Fault decisions and jitter come
+from a random generator seeded with MOCK_SEED and the request's sequence
+number, so a run with the same request order sees the same faults.
+
+Canned replies are a JSON list tried in order against the last user
+message; the first whose "match" regex (case-insensitive) is found wins:
+
+    [{"match": "headache", "text": "Headaches are common...", "body": {"stage": "interview", ...}}]
+
+"text" is streamed as prose and "body", if present, is streamed after it as
+the JSON block the prompts ask for. Without a match the reply is generic
+prose, or a hospital list for the hospital_search prompt. Ollama requests
+with "format": "json" get only the body.
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+PROVIDERS = ("gemini", "ollama")
+
+DEFAULTS: Dict[str, Dict[str, float]] = {
+    "gemini": {"TTFT_MS": 300, "TOKEN_MS": 10, "TOKENS_PER_CHUNK": 12},
+    "ollama": {"TTFT_MS": 150, "TOKEN_MS": 25, "TOKENS_PER_CHUNK": 1},
+}
+SHARED_DEFAULTS: Dict[str, float] = {
+    "TTFT_JITTER_MS": 0, "REPLY_TOKENS": 180, "ERROR_RATE": 0, "429_RATE": 0, "ABORT_RATE": 0, "SEED": 1165,
+}
+
+_HOSPITAL_PROMPT_RE = re.compile(r"list of major hospitals", re.IGNORECASE)
+_FILLER = (
+    "This is a simulated answer used for load testing. It has the length and pacing of a real reply "
+    "but no medical content. Please consult a qualified healthcare professional for advice about your health."
+).split()
+
+
+def load_settings() -> Dict[str, Dict[str, float]]:
+    settings = {}
+    for provider in PROVIDERS:
+        values = {**SHARED_DEFAULTS, **DEFAULTS[provider]}
+        for name in values:
+            raw = os.getenv(f"MOCK_{provider.upper()}_{name}", os.getenv(f"MOCK_{name}"))
+            if raw is not None:
+                values[name] = float(raw)
+        settings[provider] = values
+    return settings
+
+
+def load_canned(path: str) -> List[Dict[str, Any]]:
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    return [{**entry, "pattern": re.compile(entry.get("match", ""), re.IGNORECASE)} for entry in entries]
+
+
+settings = load_settings()
+canned = load_canned(os.getenv("MOCK_RESPONSES", ""))
+stats: Dict[str, Any] = {
+    provider: {"requests": 0, "completed": 0, "errors": 0, "rate_limited": 0, "aborted": 0, "active": 0}
+    for provider in PROVIDERS
+}
+_sequence = itertools.count()
+
+app = FastAPI(title="MedGPT mock provider")
+
+
+# --- replies ---
+
+def hospital_body(message: str) -> Dict[str, Any]:
+    match = re.search(r"\b(?:in|near|at|around)\s+([A-Za-z .'-]+)", message)
+    place = match.group(1).strip(" .?!") if match else "your area"
+    return {
+        "stage": "interview",
+        "urgency": "Low",
+        "message": f"Here are some major hospitals and emergency centers in {place}...",
+        "confidence": 0.9,
+        "data": {
+            "type": "hospital_list",
+            "hospitals": [
+                {"name": f"{place} {name}", "category": category, "maps_query": f"{place} {name}, {place}"}
+                for name, category in (
+                    ("General Hospital", "Multi-Specialty"),
+                    ("Medical College Hospital", "Government"),
+                    ("Children's Hospital", "Pediatrics"),
+                )
+            ],
+        },
+    }
+
+
+def default_text(message: str, tokens: int) -> str:
+    words = [f"**About:** {message.strip()}\n\n"] + list(itertools.islice(itertools.cycle(_FILLER), max(tokens - 1, 0)))
+    return " ".join(words)
+
+
+def build_reply(system: str, message: str, provider: str, json_only: bool = False) -> str:
+    """The full model output for a request: prose, optionally followed by a JSON body."""
+    text: Optional[str] = None
+    body: Optional[Dict[str, Any]] = None
+    for entry in canned:
+        if entry["pattern"].search(message):
+            text, body = entry.get("text"), entry.get("body")
+            break
+    else:
+        if _HOSPITAL_PROMPT_RE.search(system):
+            body = hospital_body(message)
+            text = body["message"]
+        else:
+            text = default_text(message, int(settings[provider]["REPLY_TOKENS"]))
+    if json_only:
+        return json.dumps(body if body is not None else {
+            "stage": "interview", "urgency": "Low", "message": text or "", "confidence": 0.9,
+        })
+    reply = text or ""
+    if body is not None:
+        reply += "\n" + json.dumps(body, indent=2)
+    return reply
+
+
+def split_chunks(reply: str, tokens_per_chunk: int) -> List[str]:
+    """Whitespace-preserving chunks of `tokens_per_chunk` words each."""
+    pieces = re.findall(r"\S+\s*", reply)
+    lead = reply[:len(reply) - len(reply.lstrip())]
+    if pieces and lead:
+        pieces[0] = lead + pieces[0]
+    size = max(int(tokens_per_chunk), 1)
+    return ["".join(pieces[i:i + size]) for i in range(0, len(pieces), size)]
+
+
+# --- request plumbing ---
+
+def _fault(provider: str, rng: random.Random) -> Optional[str]:
+    config = settings[provider]
+    roll = rng.random()
+    if roll < config["429_RATE"]:
+        return "rate_limited"
+    if roll < config["429_RATE"] + config["ERROR_RATE"]:
+        return "errors"
+    return None
+
+
+async def _paced(provider: str, chunks: List[str], rng: random.Random) -> AsyncGenerator[tuple, None]:
+    """Yield (index, chunk) with the configured TTFT and per-token delays; stops early when aborting."""
+    config = settings[provider]
+    abort_at = len(chunks) // 2 if rng.random() < config["ABORT_RATE"] else None
+    stats[provider]["active"] += 1
+    try:
+        await asyncio.sleep((config["TTFT_MS"] + rng.uniform(0, config["TTFT_JITTER_MS"])) / 1000)
+        for i, chunk in enumerate(chunks):
+            if i == abort_at:
+                stats[provider]["aborted"] += 1
+                raise ConnectionAbortedError("mock stream aborted")
+            if i:
+                await asyncio.sleep(config["TOKEN_MS"] * len(chunk.split()) / 1000)
+            yield i, chunk
+        stats[provider]["completed"] += 1
+    finally:
+        stats[provider]["active"] -= 1
+
+
+def _start(provider: str) -> random.Random:
+    stats[provider]["requests"] += 1
+    return random.Random(int(settings[provider]["SEED"]) * 1_000_003 + next(_sequence))
+
+
+# --- Gemini ---
+
+def _gemini_chunk(text: str, model: str, final: bool = False, usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    candidate: Dict[str, Any] = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if final:
+        candidate["finishReason"] = "STOP"
+    chunk: Dict[str, Any] = {"candidates": [candidate], "modelVersion": model}
+    if usage:
+        chunk["usageMetadata"] = usage
+    return chunk
+
+
+@app.post("/v1beta/models/{model}:streamGenerateContent")
+async def gemini_stream(model: str, request: Request):
+    payload = await request.json()
+    rng = _start("gemini")
+    fault = _fault("gemini", rng)
+    if fault:
+        stats["gemini"][fault] += 1
+        code, status = (429, "RESOURCE_EXHAUSTED") if fault == "rate_limited" else (500, "INTERNAL")
+        return JSONResponse({"error": {"code": code, "message": "Injected by mock provider", "status": status}}, status_code=code)
+
+    system = " ".join(p.get("text", "") for p in (payload.get("system_instruction") or {}).get("parts", []))
+    contents = payload.get("contents") or []
+    message = " ".join(p.get("text", "") for p in contents[-1].get("parts", [])) if contents else ""
+    chunks = split_chunks(build_reply(system, message, "gemini"), settings["gemini"]["TOKENS_PER_CHUNK"])
+    prompt_tokens = sum(len(p.get("text", "").split()) for c in contents for p in c.get("parts", []))
+    usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": sum(len(c.split()) for c in chunks)}
+    usage["totalTokenCount"] = usage["promptTokenCount"] + usage["candidatesTokenCount"]
+    sse = request.query_params.get("alt") == "sse"
+
+    async def body():
+        # Without alt=sse the response is one JSON array, written an element per line
+        if not sse:
+            yield "[\n"
+        async for i, chunk in _paced("gemini", chunks, rng):
+            last = i == len(chunks) - 1
+            element = json.dumps(_gemini_chunk(chunk, model, final=last, usage=usage if last else None))
+            if sse:
+                yield f"data: {element}\n\n"
+            else:
+                yield f"{',' if i else ''}{element}\n"
+        if not sse:
+            yield "]\n"
+
+    return StreamingResponse(body(), media_type="text/event-stream" if sse else "application/json")
+
+
+# --- Ollama ---
+
+@app.post("/api/chat")
+async def ollama_chat(request: Request):
+    payload = await request.json()
+    rng = _start("ollama")
+    fault = _fault("ollama", rng)
+    if fault:
+        stats["ollama"][fault] += 1
+        return JSONResponse({"error": "Injected by mock provider"}, status_code=429 if fault == "rate_limited" else 500)
+
+    model = payload.get("model", "mock")
+    messages = payload.get("messages") or []
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    message = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    reply = build_reply(system, message, "ollama", json_only=payload.get("format") == "json")
+    chunks = split_chunks(reply, settings["ollama"]["TOKENS_PER_CHUNK"])
+    started = time.perf_counter_ns()
+
+    def line(content: str, done: bool = False) -> str:
+        record: Dict[str, Any] = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+        if done:
+            record.update({
+                "done_reason": "stop",
+                "total_duration": time.perf_counter_ns() - started,
+                "prompt_eval_count": sum(len(m.get("content", "").split()) for m in messages),
+                "eval_count": len(reply.split()),
+            })
+        return json.dumps(record) + "\n"
+
+    if payload.get("stream") is False:
+        async for _ in _paced("ollama", [reply], rng):
+            pass
+        return JSONResponse(json.loads(line(reply, done=True)))
+
+    async def body():
+        async for _, chunk in _paced("ollama", chunks, rng):
+            yield line(chunk)
+        yield line("", done=True)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+# --- control ---
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return {"stats": stats, "settings": settings, "canned_replies": len(canned)}
+
+
+@app.post("/mock/config")
+async def mock_config(request: Request):
+    """Update settings on a running server: {"TTFT_MS": 800} for both providers, or {"gemini": {"429_RATE": 1}}."""
+    update = await request.json()
+    for provider in PROVIDERS:
+        values = {k: v for k, v in update.items() if k not in PROVIDERS}
+        values.update(update.get(provider) or {})
+        for name, value in values.items():
+            if name in settings[provider]:
+                settings[provider][name] = float(value)
+    return {"settings": settings}
+
+
+@app.post("/mock/reset")
+async def mock_reset():
+    for counters in stats.values():
+        for name in counters:
+            if name != "active":
+                counters[name] = 0
+    return {"stats": stats}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock Gemini/Ollama streaming server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
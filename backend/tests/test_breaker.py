@@ -0,0 +1,65 @@
+# Circuit breaker unit tests. Run from backend/: python -m pytest tests
+
+import json
+import time
+import asyncio
+
+import httpx
+
+from app.core import llm
+from app.core.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def _gemini(status: int) -> httpx.AsyncClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if status != 200:
+            return httpx.Response(status)
+        chunk = {"candidates": [{"content": {"parts": [{"text": "hello"}]}}]}
+        return httpx.Response(200, text="[\n" + json.dumps(chunk) + "\n]\n")
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def _stream(client: httpx.AsyncClient) -> list:
+    async def run():
+        try:
+            return [chunk async for chunk in llm.call_gemini_stream([{"role": "user", "content": "hi"}])]
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+
+def _expire(breaker: CircuitBreaker) -> None:
+    breaker.open_until = time.monotonic() - 1
+
+
+def test_probe_quota_reopens_then_recovers(monkeypatch):
+    breaker = llm.get_breaker("gemini", llm.GEMINI_MODEL)
+    monkeypatch.setattr(llm, "GEMINI_API_KEY", "test")
+    breaker._open(30)
+    _expire(breaker)
+
+    monkeypatch.setattr(llm, "http_client", _gemini(429))
+    assert _stream(llm.http_client) == ["ERROR: QUOTA_EXCEEDED"]
+    assert breaker.state == OPEN
+    assert breaker._probe is None
+
+    _expire(breaker)
+    assert breaker.is_available()
+    monkeypatch.setattr(llm, "http_client", _gemini(200))
+    assert _stream(llm.http_client) == ["hello"]
+    assert breaker.state == CLOSED
+
+
+def test_only_probe_owner_resolves_half_open():
+    breaker = CircuitBreaker("gemini", "test")
+    call = breaker.allow_request()
+    breaker._open(30)
+    _expire(breaker)
+    probe = breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() is None
+
+    breaker.record_failure("quota", call)
+    assert breaker.state == HALF_OPEN
+    breaker.record_failure("quota", probe)
+    assert breaker.state == OPEN
@@ -0,0 +1,56 @@
+# Hospital location extraction and directory resolution tests. Run from backend/: python -m pytest tests
+
+import asyncio
+
+import pytest
+
+from app.core import hospitals
+from app.core.hospitals import extract_locations
+
+pytestmark = pytest.mark.skipif(hospitals.hospital_directory is None, reason="no hospital directory data")
+
+
+@pytest.mark.parametrize("message,expected", [
+    ("hospitals near Sadar Chowk, Raipur", ["sadar chowk raipur", "raipur", "sadar chowk"]),
+    ("hospitals near andheri right now, thanks", ["andheri"]),
+    ("near the station in pune", ["pune"]),
+    ("hospitals near me", []),
+])
+def test_extract_locations(message, expected):
+    assert extract_locations(message) == expected
+
+
+def _answer(message, monkeypatch):
+    """(place shown, location sent to the model or None)."""
+    asked = []
+
+    async def lookup(location, priority):
+        asked.append(location)
+        return {"type": "hospital_list", "hospitals": [{"name": "X", "category": "Hospital", "maps_query": "X"}]}
+
+    monkeypatch.setattr(hospitals.hospital_cache, "lookup", lookup)
+    answer = asyncio.run(hospitals.hospital_answer(message))
+    return answer["message"] if answer else None, asked[0] if asked else None
+
+
+@pytest.mark.parametrize("message,city", [
+    ("hospitals in andheri west mumbai", "Andheri West, Mumbai"),
+    ("hospitals in sector 62 noida", "Noida"),
+    ("hospitals in Koramangala, Bengaluru, Karnataka", "Koramangala, Bengaluru"),
+    ("hospitals in pune, india", "Pune"),
+    ("hospitals mumbai", "Mumbai"),
+])
+def test_directory_resolves(message, city, monkeypatch):
+    place, asked = _answer(message, monkeypatch)
+    assert asked is None and f"in {city}." in place
+
+
+@pytest.mark.parametrize("message,asked", [
+    ("hospitals near Sadar Chowk, Raipur", "sadar chowk raipur"),
+    ("hospitals in a new town near Boston", "boston"),
+    ("Hospitals in Hyderabad Pakistan", "hyderabad pakistan"),
+    ("Hospitals in Hyderabad, Pakistan", "hyderabad pakistan"),
+    ("hospitals in srinagar garhwal", "srinagar garhwal"),
+])
+def test_unknown_place_goes_to_model(message, asked, monkeypatch):
+    assert _answer(message, monkeypatch)[1] == asked
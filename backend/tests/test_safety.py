@@ -0,0 +1,69 @@
+# Red-flag detector unit tests. Run from backend/: python -m pytest tests
+
+import time
+
+import pytest
+
+from app.core.safety import detect_red_flag
+
+CONFIDENT = [
+    ("I have crushing chest pain", "chest_pain"),
+    ("I can't breathe", "shortness_of_breath"),
+    ("my mom just fainted", "fainting"),
+    ("I passed out an hour ago", "fainting"),
+    ("I have had chest pain for 2 hours", "chest_pain"),
+    ("I've had chest pain for the past hour", "chest_pain"),
+    ("Without warning I had a seizure", "seizure"),
+    ("my son is having a seizure right now", "seizure"),
+    ("I want to kill myself", "suicidal_thoughts"),
+    ("what do I do, I'm having chest pain", "chest_pain"),
+    ("it's been fine but now I have chest pain", "chest_pain"),
+]
+
+NOT_CONFIDENT = [
+    "What is a seizure?",
+    "What does 'seizure' mean? (Simple Dictionary Definition)",
+    "I fainted last year",
+    "my dad had a seizure",
+    "I can't breathe through my nose because of a cold",
+    "a paper cut won't stop bleeding",
+]
+
+NONE = [
+    "no chest pain, just a cough",
+    "I hurt myself playing football",
+    "I have a mild headache",
+]
+
+
+@pytest.mark.parametrize("message,flag", CONFIDENT)
+def test_confident(message, flag):
+    match = detect_red_flag(message)
+    assert match is not None and match.flag == flag and match.confident
+
+
+@pytest.mark.parametrize("message", NOT_CONFIDENT)
+def test_not_confident(message):
+    match = detect_red_flag(message)
+    assert match is not None and not match.confident
+
+
+@pytest.mark.parametrize("message", NONE)
+def test_none(message):
+    assert detect_red_flag(message) is None
+
+
+@pytest.mark.parametrize("filler", [
+    "i had a seizure and chest pain and fainted ",  # one long clause full of matches
+    "no seizure. ",  # many short negated clauses
+])
+def test_long_input_stays_fast(filler):
+    message = filler * (30000 // len(filler))
+    started = time.perf_counter()
+    detect_red_flag(message)
+    assert time.perf_counter() - started < 0.1
+
+
+def test_long_input_scans_the_end():
+    match = detect_red_flag("my history: nothing notable. " * 1000 + "Right now I have crushing chest pain")
+    assert match is not None and match.confident
@@ -0,0 +1,49 @@
+# Semantic cache unit tests. Run from backend/: python -m pytest tests
+
+import pytest
+
+from app.core.semantic_cache import SemanticCache
+
+MODE = "detailed_explanation"
+
+SAME_QUESTION = [
+    ("What is GERD?", "Explain GERD"),
+    ("symptoms of dengue", "what are dengue symptoms"),
+    ("How much paracetamol can I take?", "how much paracetamol could i take"),
+]
+
+DIFFERENT_QUESTIONS = [
+    ("How much paracetamol can I take?", "Why should I take paracetamol?"),
+    ("When should I take ibuprofen?", "Can I take more ibuprofen?"),
+    ("can I give my baby aspirin", "why give baby aspirin"),
+    ("type 1 diabetes", "type 2 diabetes"),
+]
+
+
+def _cache(tmp_path=None) -> SemanticCache:
+    return SemanticCache(capacity=64, path=str(tmp_path / "cache") if tmp_path else "")
+
+
+@pytest.mark.parametrize("stored,asked", SAME_QUESTION)
+def test_paraphrase_hits(stored, asked):
+    cache = _cache()
+    cache.store(stored, MODE, {"message": stored})
+    found = cache.lookup(asked, MODE)
+    assert found is not None and found[0] == {"message": stored}
+
+
+@pytest.mark.parametrize("stored,asked", DIFFERENT_QUESTIONS)
+def test_different_question_misses(stored, asked):
+    cache = _cache()
+    cache.store(stored, MODE, {"message": stored})
+    assert cache.lookup(asked, MODE) is None
+
+
+def test_persisted_entries_reload(tmp_path):
+    cache = _cache(tmp_path)
+    cache.store("How much paracetamol can I take?", MODE, {"message": "dose"})
+    cache.close()
+    reloaded = _cache(tmp_path)
+    assert reloaded.lookup("how much paracetamol could i take", MODE)[0] == {"message": "dose"}
+    assert reloaded.lookup("why should I take paracetamol", MODE) is None
+    reloaded.close()
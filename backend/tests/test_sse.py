@@ -0,0 +1,30 @@
+# Stream replay buffer tests. Run from backend/: python -m pytest tests
+
+import asyncio
+
+from app.core import sse
+from app.core.sse import StreamRun
+
+
+def test_slow_follower_skips_dropped_frames(monkeypatch):
+    monkeypatch.setattr(sse, "STREAM_REPLAY_EVENTS", 4)
+
+    async def run():
+        stream = StreamRun("session")
+        for i in range(3):
+            stream.emit("token", {"text": str(i)})
+        received = []
+        follower = stream.follow()
+        received.append(await follower.__anext__())
+        # The producer outpaces the reader by more than the buffer holds
+        for i in range(3, 20):
+            stream.emit("token", {"text": str(i)})
+        stream.emit("done", {})
+        async for frame in follower:
+            received.append(frame)
+        return stream, received
+
+    stream, received = asyncio.run(run())
+    seqs = [int(frame.split("\n")[0].rsplit(":", 1)[1]) for frame in received]
+    assert seqs[0] == 1
+    assert seqs[1:] == list(range(stream.first_seq, stream.last_seq + 1))
@@ -821,58 +821,93 @@ export default function Home() {
 
         try {
             const apiUrl = process.env.NODE_ENV === 'development' ? "http://localhost:8000" : "";
-            const response = await fetch(`${apiUrl}/chat/stream`, {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                signal: controller.signal,
-                body: JSON.stringify({
-                    message: content,
-                    session_id: sessionId,
-                    mode: modeOverride || currentMode,
-                    image: imageToSend,
-                    mime_type: mimeType
-                })
+            const requestBody = JSON.stringify({
+                message: content,
+                session_id: sessionId,
+                mode: modeOverride || currentMode,
+                image: imageToSend,
+                mime_type: mimeType
             });
 
-            if (!response.body) throw new Error("No response body");
-
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
             let fullContent = "";
+            let lastEventId: string | null = null;
+            let finished = false;
 
-            while (true) {
-                const { value, done } = await reader.read();
-                if (done) break;
-
-                const chunk = decoder.decode(value, { stream: true });
-
-                // Check for metadata at the end of stream
-                if (chunk.includes("METADATA:")) {
-                    const parts = chunk.split("METADATA:");
-                    const mainText = parts[0];
-                    const metadataStr = parts[1];
-
-                    fullContent += mainText;
-
-                    try {
-                        const metadata = JSON.parse(metadataStr);
-                        setMessages(prev => prev.map(m => m.id === aiMsgId ? {
-                            ...m,
-                            content: fullContent,
-                            urgency: metadata.urgency,
-                            stage: metadata.stage,
-                            data: metadata.data
-                        } : m));
-
-                        if (metadata.stage === "emergency") setIsEmergency(true);
-                    } catch (e) {
-                        console.error("Metadata parse error", e);
-                        setMessages(prev => prev.map(m => m.id === aiMsgId ? { ...m, content: fullContent } : m));
-                    }
-                } else {
-                    fullContent += chunk;
+            const applyEvent = (event: string, data: any) => {
+                if (event === "token") {
+                    fullContent += data.text;
+                    setMessages(prev => prev.map(m => m.id === aiMsgId ? { ...m, content: fullContent } : m));
+                } else if (event === "metadata") {
+                    setMessages(prev => prev.map(m => m.id === aiMsgId ? {
+                        ...m,
+                        content: fullContent,
+                        urgency: data.urgency,
+                        stage: data.stage,
+                        data: data.data
+                    } : m));
+
+                    if (data.stage === "emergency") setIsEmergency(true);
+                } else if (event === "error") {
+                    fullContent += (fullContent ? "\n\n" : "") + data.message;
                     setMessages(prev => prev.map(m => m.id === aiMsgId ? { ...m, content: fullContent } : m));
+                } else if (event === "done") {
+                    finished = true;
                 }
+            };
+
+            // If the connection drops mid-answer, reconnect with Last-Event-ID to resume the same generation
+            for (let attempt = 0; !finished && attempt < 3; attempt++) {
+                const headers: Record<string, string> = { "Content-Type": "application/json" };
+                if (lastEventId) headers["Last-Event-ID"] = lastEventId;
+
+                try {
+                    const response = await fetch(`${apiUrl}/chat/stream`, {
+                        method: "POST",
+                        headers,
+                        signal: controller.signal,
+                        body: requestBody
+                    });
+
+                    if (!response.body) throw new Error("No response body");
+
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = "";
+
+                    while (!finished) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+
+                        buffer += decoder.decode(value, { stream: true });
+
+                        // SSE frames end with a blank line; keep a partial frame for the next read
+                        let boundary;
+                        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                            const frame = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+
+                            let event = "message";
+                            let data = "";
+                            for (const line of frame.split("\n")) {
+                                if (line.startsWith("id: ")) lastEventId = line.slice(4);
+                                else if (line.startsWith("event: ")) event = line.slice(7);
+                                else if (line.startsWith("data: ")) data += line.slice(6);
+                            }
+
+                            try {
+                                applyEvent(event, JSON.parse(data));
+                            } catch (e) {
+                                console.error("Stream event parse error", e);
+                            }
+                        }
+                    }
+                } catch (error: any) {
+                    // Nothing received yet means nothing to resume; let the outer handler report it
+                    if (error.name === 'AbortError' || !lastEventId) throw error;
+                    console.warn("Stream interrupted, resuming", error);
+                }
+
+                if (!lastEventId) break;
             }
 
             // Final save to history
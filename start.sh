@@ -13,6 +13,11 @@ echo ">>> Pulling Llama 3.2 (1b)..."
 ollama pull llama3.2:1b
 
 # Start the Backend (which now serves the Frontend too)
-echo ">>> Starting MedGPT on port 7860..."
+# More than one worker needs a session backend the workers can share
+WORKERS=${WEB_CONCURRENCY:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    export SESSION_BACKEND=${SESSION_BACKEND:-sqlite}
+fi
+echo ">>> Starting MedGPT on port 7860 ($WORKERS workers, ${SESSION_BACKEND:-memory} sessions)..."
 cd /app/backend
-python -m uvicorn app.main:app --host 0.0.0.0 --port 7860
+python -m uvicorn app.main:app --host 0.0.0.0 --port 7860 --workers "$WORKERS"